@@ -0,0 +1,417 @@
+"""Clock
+==========
+
+Provides the :attr:`Clock` that the players and recorders use to schedule
+callbacks in the main thread, from which their state machines are run.
+
+By default, :attr:`Clock` forwards to the Kivy :attr:`kivy.clock.Clock`, so the
+callbacks are executed in the kivy thread. In headless mode, e.g. when running
+on a server without a display or a Kivy app, it forwards instead to a
+:class:`HeadlessClock`, whose callbacks are executed in its own dispatcher
+thread, or in any thread that calls :meth:`HeadlessClock.run_until`.
+
+Headless mode is selected by setting the ``CPL_MEDIA_HEADLESS`` environment
+variable to ``1`` before :mod:`cpl_media` is imported, or by calling
+:func:`set_headless` before any player or recorder is created. In headless mode
+the settings widgets and their kv files should not be imported. E.g.::
+
+    from cpl_media.clock import set_headless, call_in_clock
+    set_headless()
+
+    from cpl_media.ffmpeg import FFmpegPlayer
+    from cpl_media.recorder import VideoRecorder
+
+    player = FFmpegPlayer(play_filename='video.mp4')
+    call_in_clock(player.play).result()
+"""
+
+import os
+import sys
+import heapq
+import traceback
+import logging
+from itertools import count
+from threading import Thread, Condition, get_ident
+from concurrent.futures import Future
+from time import perf_counter
+
+from kivy.clock import Clock as KivyClock
+
+import cpl_media
+
+__all__ = (
+    'Clock', 'MediaClock', 'HeadlessClock', 'HeadlessClockEvent',
+    'set_headless', 'is_headless', 'call_in_clock', 'tick_clock',
+    'run_clock_until')
+
+
+class HeadlessClockEvent(object):
+    """A callback scheduled with a :class:`HeadlessClock`. It is similar to
+    the kivy :class:`kivy.clock.ClockEvent`.
+
+    Calling the event schedules the callback to be called after
+    :attr:`timeout`, unless it's already scheduled.
+    """
+
+    clock = None
+    """The :class:`HeadlessClock` that owns the event.
+    """
+
+    callback = None
+    """The callback to be called with the elapsed time since it was scheduled.
+    """
+
+    timeout = 0
+    """The delay in seconds after which the callback is called.
+    """
+
+    interval = False
+    """Whether the callback is rescheduled after it is called, until it's
+    canceled or it returns False.
+    """
+
+    _entry = None
+
+    _cancelled = False
+    """Whether the event was canceled since it was last scheduled, also
+    while its callback is being dispatched, so it's not called or rescheduled.
+    """
+
+    def __init__(self, clock, callback, timeout=0, interval=False, **kwargs):
+        super(HeadlessClockEvent, self).__init__(**kwargs)
+        self.clock = clock
+        self.callback = callback
+        self.timeout = timeout
+        self.interval = interval
+
+    def __call__(self, *largs):
+        self.clock._schedule(self)
+
+    @property
+    def is_triggered(self):
+        """Whether the event is currently scheduled.
+        """
+        return self._entry is not None
+
+    def cancel(self):
+        """Unschedules the event, if it's scheduled.
+        """
+        self.clock._unschedule(self)
+
+
+class HeadlessClock(object):
+    """A clock which executes the scheduled callbacks from a single dispatcher
+    thread, without Kivy.
+
+    It provides the subset of the :attr:`kivy.clock.Clock` API used by the
+    players and recorders. The callbacks are called either from the thread
+    started with :meth:`start`, or from a thread that calls :meth:`tick` or
+    :meth:`run_until`. Only one thread should execute the callbacks.
+    """
+
+    thread = None
+    """The dispatcher thread started with :meth:`start`, if any.
+    """
+
+    _cond = None
+
+    _events = []
+
+    _counter = None
+
+    _running = False
+
+    _ident = None
+
+    def __init__(self, **kwargs):
+        super(HeadlessClock, self).__init__(**kwargs)
+        self._cond = Condition()
+        self._events = []
+        self._counter = count()
+
+    def create_trigger(self, callback, timeout=0, interval=False):
+        """Creates a :class:`HeadlessClockEvent` that when called schedules
+        the callback, like :meth:`kivy.clock.ClockBase.create_trigger`.
+        """
+        return HeadlessClockEvent(self, callback, timeout, interval)
+
+    def schedule_once(self, callback, timeout=0):
+        """Schedules the callback to be called once after ``timeout``.
+
+        :return: The :class:`HeadlessClockEvent`.
+        """
+        event = HeadlessClockEvent(self, callback, timeout)
+        event()
+        return event
+
+    def schedule_interval(self, callback, timeout):
+        """Schedules the callback to be called every ``timeout`` seconds.
+
+        :return: The :class:`HeadlessClockEvent`.
+        """
+        event = HeadlessClockEvent(self, callback, timeout, True)
+        event()
+        return event
+
+    def unschedule(self, event):
+        """Unschedules the :class:`HeadlessClockEvent`.
+        """
+        event.cancel()
+
+    def _schedule(self, event):
+        with self._cond:
+            if event._entry is not None:
+                return
+            event._cancelled = False
+            entry = event._entry = [
+                perf_counter() + event.timeout, next(self._counter), event]
+            heapq.heappush(self._events, entry)
+            # run_until may also wait on it, so wake the dispatcher too
+            self._cond.notify_all()
+
+    def _unschedule(self, event):
+        with self._cond:
+            # it may be canceled while being dispatched, after it was popped
+            event._cancelled = True
+            if event._entry is not None:
+                event._entry[2] = None
+                event._entry = None
+
+    def _pop_due(self, timeout):
+        """Returns the list of due events, waiting up to timeout for the first
+        one to be due.
+        """
+        cond = self._cond
+        events = self._events
+        with cond:
+            end = None if timeout is None else perf_counter() + timeout
+            while True:
+                while events and events[0][2] is None:
+                    heapq.heappop(events)
+
+                now = perf_counter()
+                if events and events[0][0] <= now:
+                    break
+
+                wait = None
+                if events:
+                    wait = events[0][0] - now
+                if end is not None:
+                    if now >= end:
+                        return []
+                    wait = end - now if wait is None else min(wait, end - now)
+                if timeout is None and not self._running:
+                    return []
+                cond.wait(wait)
+
+            due = []
+            while events and events[0][0] <= now:
+                deadline, _, event = heapq.heappop(events)
+                if event is not None:
+                    event._entry = None
+                    due.append((deadline - event.timeout, event))
+            return due
+
+    def tick(self, timeout=0):
+        """Calls all the callbacks that are due, waiting up to ``timeout``
+        seconds for the first callback to be due.
+
+        :return: The number of callbacks called.
+        """
+        due = self._pop_due(timeout)
+        for scheduled, event in due:
+            # canceled by a callback called before it in this tick
+            if event._cancelled:
+                continue
+            try:
+                res = event.callback(perf_counter() - scheduled)
+            except Exception as e:
+                cpl_media.error_callback(
+                    e, exc_info=''.join(
+                        traceback.format_exception(*sys.exc_info())),
+                    threaded=True)
+                continue
+
+            if event.interval and res is not False and not event._cancelled:
+                event()
+        return len(due)
+
+    def run_until(self, condition, timeout=None):
+        """Calls the scheduled callbacks from the calling thread until
+        ``condition()`` returns True, or the timeout elapsed.
+
+        If the dispatcher thread is running, it only waits for the condition.
+
+        :param condition: A function that returns whether to stop.
+        :param timeout: The maximum duration to run in seconds, or None to run
+            until the condition is True.
+        :return: The last return value of the condition.
+        """
+        end = None if timeout is None else perf_counter() + timeout
+        running = self._running and self._ident != get_ident()
+        while not condition():
+            wait = .05
+            if end is not None:
+                wait = min(end - perf_counter(), wait)
+                if wait <= 0:
+                    return condition()
+
+            if running:
+                with self._cond:
+                    self._cond.wait(wait)
+            else:
+                self.tick(wait)
+        return True
+
+    def start(self):
+        """Starts the dispatcher thread, which calls the scheduled callbacks
+        until :meth:`stop` is called.
+        """
+        if self.thread is not None:
+            return
+
+        self._running = True
+        thread = self.thread = Thread(
+            target=self._run, name='Headless clock thread', daemon=True)
+        thread.start()
+
+    def _run(self):
+        self._ident = get_ident()
+        while self._running:
+            self.tick(None)
+
+    def stop(self, join=False):
+        """Stops the dispatcher thread started with :meth:`start`.
+
+        :param join: Whether to wait for the thread to exit.
+        """
+        thread = self.thread
+        if thread is None:
+            return
+
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        if join:
+            thread.join()
+        self.thread = self._ident = None
+
+
+class MediaClock(object):
+    """Forwards all the attributes to the current clock :attr:`backend`, so
+    that modules can import :attr:`Clock` once, regardless of the mode.
+    """
+
+    backend = KivyClock
+    """The clock to which it forwards. Either :attr:`kivy.clock.Clock` or a
+    :class:`HeadlessClock`.
+    """
+
+    def __getattr__(self, name):
+        return getattr(self.backend, name)
+
+
+Clock = MediaClock()
+"""The :class:`MediaClock` used by all the players and recorders to schedule
+callbacks in the main thread.
+"""
+
+
+def set_headless(headless=True, start=True):
+    """Sets whether :attr:`Clock` uses a :class:`HeadlessClock`, or the Kivy
+    clock.
+
+    It must be called before any player or recorder is created, because they
+    create their clock triggers when created.
+
+    :param headless: Whether to use a headless clock.
+    :param start: When headless, whether to start the dispatcher thread with
+        :meth:`HeadlessClock.start`. If False, some thread must call
+        :meth:`HeadlessClock.tick` or :meth:`HeadlessClock.run_until` to
+        execute the callbacks.
+    """
+    backend = Clock.backend
+    if isinstance(backend, HeadlessClock):
+        backend.stop()
+
+    if not headless:
+        Clock.backend = KivyClock
+        return
+
+    backend = Clock.backend = HeadlessClock()
+    if start:
+        backend.start()
+
+
+def is_headless():
+    """Returns whether :attr:`Clock` uses a :class:`HeadlessClock`.
+    """
+    return isinstance(Clock.backend, HeadlessClock)
+
+
+def call_in_clock(f, *args, **kwargs):
+    """Schedules the function to be called from the :attr:`Clock` thread, e.g.
+    to call :meth:`~cpl_media.player.BasePlayer.play` from another thread.
+
+    :param f: The function to call.
+    :param args: The positional args to pass to the function.
+    :param kwargs: The keyword args to pass to the function.
+    :return: A :class:`concurrent.futures.Future` that gets the return value
+        of the function. It must not be waited on from the :attr:`Clock`
+        thread.
+    """
+    future = Future()
+
+    def callback(*largs):
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(f(*args, **kwargs))
+        except BaseException as e:
+            future.set_exception(e)
+
+    Clock.schedule_once(callback)
+    return future
+
+
+def tick_clock():
+    """Calls the :attr:`Clock` callbacks that are due from the calling thread,
+    for when no Kivy app or headless dispatcher thread is running them.
+
+    With the Kivy clock, it calls :meth:`kivy.clock.ClockBase.tick`, which may
+    sleep until the next Kivy frame is due. It does nothing if the
+    :class:`HeadlessClock` dispatcher thread is running.
+    """
+    backend = Clock.backend
+    if not isinstance(backend, HeadlessClock):
+        backend.tick()
+    elif backend.thread is None:
+        backend.tick()
+
+
+def run_clock_until(condition, timeout=None):
+    """Calls the :attr:`Clock` callbacks from the calling thread with
+    :func:`tick_clock` until ``condition()`` returns True, or the timeout
+    elapsed. Like :func:`tick_clock`, it must not be called while a Kivy app
+    is running.
+
+    :param condition: A function that returns whether to stop.
+    :param timeout: The maximum duration to run in seconds, or None to run
+        until the condition is True.
+    :return: The last return value of the condition.
+    """
+    backend = Clock.backend
+    if isinstance(backend, HeadlessClock):
+        return backend.run_until(condition, timeout)
+
+    end = None if timeout is None else perf_counter() + timeout
+    while not condition():
+        if end is not None and perf_counter() >= end:
+            return condition()
+        backend.tick()
+    return True
+
+
+if os.environ.get('CPL_MEDIA_HEADLESS', '').lower() in ('1', 'true', 'yes'):
+    set_headless()
+    logging.debug('cpl_media: Using the headless clock')
@@ -6,16 +6,493 @@ Provides common base classes and tools.
 """
 
 from queue import Queue, Empty
+from threading import Lock, Thread, Event
+from math import log10
+from time import perf_counter, thread_time
+from weakref import WeakSet
+from importlib import import_module
+from importlib.util import find_spec
+from functools import lru_cache
 import sys
+import time
 import traceback
 from more_kivy_app.config import Configurable
 
-from kivy.clock import Clock
+from .clock import Clock
 
 from cpl_media import error_guard
 import cpl_media
 
-__all__ = ('KivyMediaBase', )
+__all__ = (
+    'KivyMediaBase', 'KivyThreadStats', 'LatencyHistogram', 'ThreadTimers',
+    'ThreadTimersDumper', 'get_thread_timers', 'format_thread_timers',
+    'lazy_module_getattr', 'module_available')
+
+_thread_timers = WeakSet()
+
+
+def lazy_module_getattr(module_name, attrs):
+    """Returns a module level ``__getattr__`` function that imports the named
+    attributes from other modules only when they are first accessed.
+
+    It's used so that the settings widgets, which import the Kivy widgets and
+    load their kv files, can still be accessed from their original modules
+    without being imported when running headless (see :mod:`cpl_media.clock`).
+
+    :param module_name: The name of the module whose ``__getattr__`` it is.
+    :param attrs: A dict mapping attribute names to the name of the module
+        from which they are imported.
+    """
+    def __getattr__(name):
+        if name not in attrs:
+            raise AttributeError(
+                "module '{}' has no attribute '{}'".format(module_name, name))
+        return getattr(import_module(attrs[name]), name)
+
+    return __getattr__
+
+
+@lru_cache(maxsize=None)
+def module_available(name):
+    """Returns whether the top level module or package is installed, without
+    importing it.
+
+    It's used to probe the optional camera backends when their player modules
+    are imported, so that the backend is only imported when the player is
+    used. A module that is found may still fail to import, e.g. when its
+    drivers are missing, so the players must still handle and report the
+    import failing when they first import it.
+
+    :param name: The name of the top level module, e.g. ``'rotpy'``.
+    """
+    try:
+        return find_spec(name) is not None
+    except (ImportError, ValueError):
+        return False
+
+
+class KivyThreadStats(object):
+    """Coalesces the counters and "latest value" statistics that the internal
+    threads update for every frame, so they are applied to the kivy properties
+    at most once per kivy frame.
+
+    Internal threads call :meth:`increment` and :meth:`set`, which only update
+    plain dicts under a lock. The first update after the last snapshot calls
+    :attr:`trigger`, and the kivy thread then calls :meth:`apply` to set all
+    the accumulated values at once. So the number of scheduled calls scales
+    with the kivy frame rate rather than with the camera frame rate.
+    """
+
+    trigger = None
+    """The callback that is called when the first value is updated after the
+    last :meth:`snapshot`. Typically a Kivy clock trigger.
+    """
+
+    _lock = None
+
+    _increments = {}
+
+    _values = {}
+
+    _pending = False
+
+    def __init__(self, trigger=None, **kwargs):
+        super(KivyThreadStats, self).__init__(**kwargs)
+        self.trigger = trigger
+        self._lock = Lock()
+        self._increments = {}
+        self._values = {}
+
+    def increment(self, name, value=1):
+        """Increments the named statistic by the value. May be called from
+        any thread.
+
+        :param name: The statistic (property) name.
+        :param value: The value by which it will be incremented.
+        """
+        with self._lock:
+            increments = self._increments
+            increments[name] = increments.get(name, 0) + value
+            if self._pending:
+                return
+            self._pending = True
+
+        if self.trigger is not None:
+            self.trigger()
+
+    def set(self, **kwargs):
+        """Sets the latest value of the named statistics, replacing any
+        previous value or increments not yet applied. May be called from
+        any thread.
+
+        :param kwargs: The dict of values.
+        """
+        with self._lock:
+            increments = self._increments
+            self._values.update(kwargs)
+            for name in kwargs:
+                if name in increments:
+                    del increments[name]
+
+            if self._pending:
+                return
+            self._pending = True
+
+        if self.trigger is not None:
+            self.trigger()
+
+    def snapshot(self):
+        """Returns the values and increments accumulated since the last
+        snapshot and resets them.
+
+        :return: A 2-tuple of dicts, ``(values, increments)``. Values should be
+            applied before increments.
+        """
+        with self._lock:
+            values, increments = self._values, self._increments
+            self._values = {}
+            self._increments = {}
+            self._pending = False
+        return values, increments
+
+    def clear(self):
+        """Drops all the values and increments not yet applied.
+        """
+        self.snapshot()
+
+    def apply(self, obj):
+        """Applies the accumulated values and increments to the properties of
+        ``obj``. Should be called from the kivy thread.
+
+        :param obj: The object whose properties will be set.
+        """
+        values, increments = self.snapshot()
+        for prop, val in values.items():
+            setattr(obj, prop, val)
+        for prop, val in increments.items():
+            setattr(obj, prop, getattr(obj, prop) + val)
+
+
+class LatencyHistogram(object):
+    """A fixed memory histogram of latencies (or any other positive durations)
+    in seconds, using logarithmically spaced bins.
+
+    Values are added with :meth:`add` from any single thread, and the
+    percentiles are estimated from the bins, so the memory does not grow with
+    the number of values. The estimate is the upper edge of the bin, so its
+    relative error is at most ``10 ** (1 / bins_per_decade) - 1``.
+    """
+
+    min_value = 1e-6
+    """Values smaller than this are counted in the first bin.
+    """
+
+    max_value = 100.
+    """Values larger than this are counted in the last bin.
+    """
+
+    bins_per_decade = 20
+    """The number of bins for every factor of 10.
+    """
+
+    count = 0
+    """The number of values added.
+    """
+
+    total = 0
+    """The sum of all the values added.
+    """
+
+    max = 0
+    """The largest value added.
+    """
+
+    bins = []
+    """The count of values in each bin.
+    """
+
+    _log_min = 0
+
+    def __init__(
+            self, min_value=1e-6, max_value=100., bins_per_decade=20,
+            **kwargs):
+        super(LatencyHistogram, self).__init__(**kwargs)
+        self.min_value = min_value
+        self.max_value = max_value
+        self.bins_per_decade = bins_per_decade
+        self._log_min = log10(min_value)
+        n = int((log10(max_value) - self._log_min) * bins_per_decade) + 1
+        self.bins = [0, ] * n
+
+    def add(self, value):
+        """Adds the value to the histogram.
+        """
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+        if value <= self.min_value:
+            i = 0
+        else:
+            i = int((log10(value) - self._log_min) * self.bins_per_decade)
+        bins = self.bins
+        bins[min(i, len(bins) - 1)] += 1
+
+    def reset(self):
+        """Removes all the values from the histogram.
+        """
+        self.count = self.total = self.max = 0
+        self.bins = [0, ] * len(self.bins)
+
+    def percentile(self, p):
+        """Returns the estimated value at the given percentile.
+
+        :param p: The percentile, between 0 and 100.
+        :return: The estimated value, or zero if there are no values.
+        """
+        count = self.count
+        if not count:
+            return 0
+
+        target = count * p / 100.
+        seen = 0
+        # the last bin also holds all the values larger than max_value
+        for i, n in enumerate(self.bins[:-1]):
+            seen += n
+            if n and seen >= target:
+                edge = 10 ** (self._log_min + (i + 1) / self.bins_per_decade)
+                return min(edge, self.max)
+        return self.max
+
+    def summary(self):
+        """Returns a dict with the ``count``, ``mean``, ``p50``, ``p95``,
+        ``p99``, and ``max`` of the values.
+        """
+        count = self.count
+        return {
+            'count': count,
+            'mean': self.total / count if count else 0,
+            'p50': self.percentile(50), 'p95': self.percentile(95),
+            'p99': self.percentile(99), 'max': self.max}
+
+
+class ThreadTimers(object):
+    """Accumulates how long an internal thread spends in each named stage of
+    its loop, e.g. ``'acquire'``, ``'write'`` or ``'sleep'``, as well as the
+    CPU time used by the thread.
+
+    The thread calls :meth:`start` when it starts, :meth:`mark` or
+    :meth:`add` after each stage and :meth:`tick` once per iteration of its
+    loop. Each stage only keeps its count, total and maximum duration, so the
+    memory doesn't grow with time and the overhead is a few clock reads per
+    iteration, low enough to always leave enabled.
+
+    :meth:`snapshot` may be called from any thread. It doesn't lock, so the
+    values of a stage may be off by one iteration.
+
+    All the live instances are listed by :func:`get_thread_timers`.
+    """
+
+    name = ''
+    """The name of the thread, e.g. ``'FFmpegPlayer play'``.
+    """
+
+    stages = {}
+    """Maps each stage name to a list of its ``[count, total, max]`` duration
+    in seconds.
+    """
+
+    iterations = 0
+    """The number of times :meth:`tick` was called since :meth:`start`.
+    """
+
+    cpu_time = 0
+    """The CPU time in seconds used by the thread from :meth:`start` until
+    the last :meth:`tick`.
+    """
+
+    wall_time = 0
+    """The time in seconds from :meth:`start` until the last :meth:`tick`.
+    """
+
+    _cpu_start = 0
+
+    _wall_start = 0
+
+    def __init__(self, name='', **kwargs):
+        super(ThreadTimers, self).__init__(**kwargs)
+        self.name = name
+        self.stages = {}
+        _thread_timers.add(self)
+
+    def start(self):
+        """Clears the timers and starts measuring the CPU time of the calling
+        thread. It must be called from the thread that is measured.
+        """
+        self.stages = {}
+        self.iterations = 0
+        self.cpu_time = self.wall_time = 0
+        self._cpu_start = thread_time()
+        self._wall_start = perf_counter()
+
+    def add(self, stage, duration):
+        """Adds the duration in seconds to the stage.
+        """
+        stats = self.stages.get(stage)
+        if stats is None:
+            stats = self.stages[stage] = [0, 0., 0.]
+        stats[0] += 1
+        stats[1] += duration
+        if duration > stats[2]:
+            stats[2] = duration
+
+    def mark(self, stage, ts):
+        """Adds the time elapsed since ``ts`` to the stage and returns the
+        current time, so that consecutive stages can be chained. E.g.::
+
+            ts = perf_counter()
+            image = camera.get_image()
+            ts = timers.mark('acquire', ts)
+            process_frame(image)
+            timers.mark('callbacks', ts)
+
+        :param stage: The stage name.
+        :param ts: The :func:`time.perf_counter` time when the stage started.
+        :return: The current :func:`time.perf_counter` time.
+        """
+        now = perf_counter()
+        self.add(stage, now - ts)
+        return now
+
+    def tick(self):
+        """Updates :attr:`iterations`, :attr:`cpu_time` and :attr:`wall_time`.
+        It must be called from the thread that is measured.
+        """
+        self.iterations += 1
+        self.cpu_time = thread_time() - self._cpu_start
+        self.wall_time = perf_counter() - self._wall_start
+
+    def snapshot(self):
+        """Returns a dict with the ``name``, ``iterations``, ``cpu_s``,
+        ``wall_s`` and ``cpu_fraction`` of the thread, and ``stages``, mapping
+        each stage to a dict with its ``count``, ``total_s``, ``mean_s`` and
+        ``max_s``.
+        """
+        wall = self.wall_time
+        stages = {}
+        for stage, (count, total, max_) in list(self.stages.items()):
+            stages[stage] = {
+                'count': count, 'total_s': total,
+                'mean_s': total / count if count else 0, 'max_s': max_}
+        return {
+            'name': self.name, 'iterations': self.iterations,
+            'cpu_s': self.cpu_time, 'wall_s': wall,
+            'cpu_fraction': self.cpu_time / wall if wall else 0,
+            'stages': stages}
+
+
+def get_thread_timers():
+    """Returns a list of all the :class:`ThreadTimers` that still exist.
+    """
+    return list(_thread_timers)
+
+
+def format_thread_timers(timers=None):
+    """Returns a text summary of the :meth:`ThreadTimers.snapshot` of the
+    timers.
+
+    :param timers: The list of :class:`ThreadTimers`. Defaults to all of
+        :func:`get_thread_timers` that have run.
+    """
+    if timers is None:
+        timers = [t for t in get_thread_timers() if t.iterations]
+
+    lines = []
+    for snapshot in sorted(
+            (t.snapshot() for t in timers), key=lambda s: s['name']):
+        lines.append(
+            '{}: {} iterations, {:.3f}s CPU in {:.3f}s ({:.1%})'.format(
+                snapshot['name'], snapshot['iterations'], snapshot['cpu_s'],
+                snapshot['wall_s'], snapshot['cpu_fraction']))
+        for stage, stats in sorted(snapshot['stages'].items()):
+            lines.append(
+                '    {}: {} x {:.3f}ms mean, {:.3f}ms max, {:.3f}s total'
+                .format(stage, stats['count'], stats['mean_s'] * 1e3,
+                        stats['max_s'] * 1e3, stats['total_s']))
+    return '\n'.join(lines)
+
+
+class ThreadTimersDumper(object):
+    """Periodically appends the :func:`format_thread_timers` summary of all
+    the :class:`ThreadTimers` to a text file, from its own thread. E.g.::
+
+        dumper = ThreadTimersDumper('timers.txt', interval=30)
+        dumper.start()
+    """
+
+    filename = ''
+    """The file to which the summaries are appended.
+    """
+
+    interval = 10.
+    """The interval in seconds between summaries.
+    """
+
+    thread = None
+    """The thread that writes the file, while started.
+    """
+
+    _stop_event = None
+
+    def __init__(self, filename, interval=10., **kwargs):
+        super(ThreadTimersDumper, self).__init__(**kwargs)
+        self.filename = filename
+        self.interval = interval
+
+    def start(self):
+        """Starts writing the summaries.
+        """
+        if self.thread is not None:
+            return
+
+        self._stop_event = Event()
+        thread = self.thread = Thread(
+            target=self._run, args=(self._stop_event, ),
+            name='Thread timers dumper', daemon=True)
+        thread.start()
+
+    def stop(self, join=False):
+        """Stops writing the summaries.
+
+        :param join: Whether to wait for the thread to exit.
+        """
+        thread = self.thread
+        if thread is None:
+            return
+
+        self._stop_event.set()
+        if join:
+            thread.join()
+        self.thread = None
+
+    def dump(self):
+        """Appends the current summary to the file. It may be called from any
+        thread.
+        """
+        with open(self.filename, 'a') as fh:
+            fh.write('{}\n{}\n\n'.format(
+                time.strftime('%Y-%m-%d %H:%M:%S'), format_thread_timers()))
+
+    def _run(self, stop_event):
+        while not stop_event.wait(self.interval):
+            try:
+                self.dump()
+            except Exception as e:
+                cpl_media.error_callback(
+                    e, exc_info=''.join(
+                        traceback.format_exception(*sys.exc_info())),
+                    threaded=True)
 
 
 class KivyMediaBase(Configurable):
@@ -24,6 +501,9 @@ class KivyMediaBase(Configurable):
     It provides methods for the kivy and internal threads to interact safely.
     Specifically, for the internal threads to schedule code to be executed in
     the kivy thread.
+
+    When running headless (see :mod:`cpl_media.clock`), the kivy thread is the
+    thread that executes the :attr:`cpl_media.clock.Clock` callbacks.
     """
 
     trigger_run_in_kivy = None
@@ -36,11 +516,45 @@ class KivyMediaBase(Configurable):
     """The queue that the kivy thread will read from and process messages.
     """
 
+    kivy_thread_stats: KivyThreadStats = None
+    """The :class:`KivyThreadStats` that coalesces the per-frame statistics
+    updated from the internal threads with
+    :meth:`increment_stat_in_kivy_thread` and
+    :meth:`set_stats_in_kivy_thread`.
+    """
+
+    thread_timers = {}
+    """Maps the name of each internal thread, e.g. ``'play'`` or
+    ``'record'``, to the :class:`ThreadTimers` of its loop.
+    """
+
     def __init__(self, **kwargs):
         super(KivyMediaBase, self).__init__(**kwargs)
         self.kivy_thread_queue = Queue()
         self.trigger_run_in_kivy = Clock.create_trigger(
             self.process_queue_in_kivy_thread)
+        self.kivy_thread_stats = KivyThreadStats(
+            trigger=self.trigger_run_in_kivy)
+        self.thread_timers = {}
+
+    def add_thread_timers(self, name):
+        """Creates a :class:`ThreadTimers` for the internal thread and adds it
+        to :attr:`thread_timers`.
+
+        :param name: The name of the thread, e.g. ``'play'``.
+        :return: The :class:`ThreadTimers`.
+        """
+        timers = self.thread_timers[name] = ThreadTimers(
+            '{} {}'.format(self.__class__.__name__, name))
+        return timers
+
+    def get_thread_timers_snapshot(self):
+        """Returns a dict mapping the name of each of the
+        :attr:`thread_timers` to its :meth:`ThreadTimers.snapshot`.
+        """
+        return {
+            name: timers.snapshot()
+            for name, timers in self.thread_timers.items()}
 
     @error_guard
     def process_queue_in_kivy_thread(self, *largs):
@@ -48,6 +562,8 @@ class KivyMediaBase(Configurable):
         :attr:`trigger_run_in_kivy` is triggered. It reads messages from the
         thread.
         """
+        self.kivy_thread_stats.apply(self)
+
         while self.kivy_thread_queue is not None:
             try:
                 msg, value = self.kivy_thread_queue.get(block=False)
@@ -98,6 +614,28 @@ class KivyMediaBase(Configurable):
         self.kivy_thread_queue.put(('increment', (prop, value)))
         self.trigger_run_in_kivy()
 
+    def increment_stat_in_kivy_thread(self, prop, value=1):
+        """Like :meth:`increment_in_kivy_thread`, but the increments are
+        accumulated in :attr:`kivy_thread_stats` and applied together once per
+        kivy frame rather than queued individually.
+
+        Should be used for statistics that are updated for every frame, e.g.
+        the number of frames played.
+
+        :param prop: The instance property name to increment.
+        :param value: The value by which it will be incremented.
+        """
+        self.kivy_thread_stats.increment(prop, value)
+
+    def set_stats_in_kivy_thread(self, **kwargs):
+        """Like :meth:`setattrs_in_kivy_thread`, but only the latest value of
+        each property is kept in :attr:`kivy_thread_stats` and applied once
+        per kivy frame rather than queued individually.
+
+        :param kwargs: The dict of values.
+        """
+        self.kivy_thread_stats.set(**kwargs)
+
     def call_in_kivy_thread(self, f, *args, **kwargs):
         """Schedules Kivy to call the function in the Kivy thread.
 
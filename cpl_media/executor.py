@@ -0,0 +1,305 @@
+"""Frame process executor
+==========================
+
+Provides :class:`FrameProcessExecutor`, which runs a CPU heavy analysis
+function on the frames of a player in a pool of worker processes, so that the
+analysis doesn't compete with the player's threads for the GIL. E.g.::
+
+    def count_bright(image, metadata):
+        # called in a worker process
+        y = get_image_arrays(image)[0]
+        return int((y > 200).sum())
+
+    def show(result, metadata):
+        # called in the kivy thread
+        print(metadata['t'], result)
+
+    executor = FrameProcessExecutor(
+        player, count_bright, show, workers=4, max_in_flight=8)
+    executor.start()
+
+The frames are passed to the workers through a
+:class:`~cpl_media.shared_memory.SharedMemoryRing` rather than being pickled.
+The function must be picklable, e.g. defined at the top level of a module, and
+its result is pickled back to the parent process.
+"""
+
+import traceback
+from collections import deque
+from itertools import count
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from threading import Lock
+
+from cpl_media.clock import Clock
+from cpl_media.shared_memory import SharedMemoryRing
+import cpl_media
+
+__all__ = ('FrameProcessExecutor', )
+
+_worker_rings = {}
+
+_ring_count = count()
+
+
+def _process_frame_in_worker(ring_name, seq, function):
+    """Runs in the worker process to read the frame from the ring and call
+    the function with it.
+    """
+    ring = _worker_rings.get(ring_name)
+    if ring is None:
+        ring = _worker_rings[ring_name] = SharedMemoryRing(ring_name)
+
+    item = ring.read(seq)
+    if item is None:
+        raise ValueError('Frame {} was overwritten in the ring'.format(seq))
+    return function(*item)
+
+
+class FrameProcessExecutor(object):
+    """Calls :attr:`function` with the frames of :attr:`player` in a pool of
+    worker processes and delivers the results to :attr:`callback`.
+
+    Each frame is copied from
+    :attr:`~cpl_media.player.BasePlayer.frame_callbacks` into a free slot of a
+    :class:`~cpl_media.shared_memory.SharedMemoryRing` with
+    :attr:`max_in_flight` slots. If all the slots are used by frames that are
+    still being processed, the frame is dropped and counted in
+    :attr:`frames_dropped`, so a slow pool never blocks the player.
+
+    Functions that raise an exception are reported to
+    :attr:`cpl_media.error_callback` and counted in :attr:`frames_failed`.
+    """
+
+    player = None
+    """The :class:`~cpl_media.player.BasePlayer` whose frames are processed.
+    """
+
+    function = None
+    """The function called in the worker process with the ``image`` and
+    ``metadata`` of each frame. It must be picklable.
+    """
+
+    callback = None
+    """The function called with the ``result`` of :attr:`function` and the
+    frame ``metadata`` for each processed frame, or None.
+    """
+
+    workers = 2
+    """The number of worker processes.
+    """
+
+    max_in_flight = 4
+    """The maximum number of frames being processed at once.
+    """
+
+    ordered = True
+    """Whether the results are delivered in the order of the frames. If
+    False, they are delivered as soon as they're ready.
+    """
+
+    deliver_in_clock = True
+    """Whether :attr:`callback` is called from the
+    :attr:`~cpl_media.clock.Clock` (kivy) thread. If False, it's called from
+    the thread of the pool that handles the results.
+    """
+
+    frames_submitted = 0
+    """The number of frames sent to the workers.
+    """
+
+    frames_completed = 0
+    """The number of frames whose result was delivered.
+    """
+
+    frames_dropped = 0
+    """The number of frames dropped because :attr:`max_in_flight` frames were
+    already being processed, or that were too large for the ring.
+    """
+
+    frames_failed = 0
+    """The number of frames for which the function raised an exception.
+    """
+
+    pool: ProcessPoolExecutor = None
+    """The :class:`concurrent.futures.ProcessPoolExecutor`, while started.
+    """
+
+    ring: SharedMemoryRing = None
+    """The :class:`~cpl_media.shared_memory.SharedMemoryRing` through which
+    the frames are sent, once created.
+    """
+
+    _lock = None
+
+    _deliver_lock = None
+
+    _in_flight = {}
+
+    _pending = None
+
+    _results = None
+
+    _trigger = None
+
+    _ring_name = ''
+
+    def __init__(
+            self, player, function, callback=None, workers=2,
+            max_in_flight=4, ordered=True, deliver_in_clock=True, **kwargs):
+        super(FrameProcessExecutor, self).__init__(**kwargs)
+        self.player = player
+        self.function = function
+        self.callback = callback
+        self.workers = workers
+        self.max_in_flight = max_in_flight
+        self.ordered = ordered
+        self.deliver_in_clock = deliver_in_clock
+        self._lock = Lock()
+        self._deliver_lock = Lock()
+        self._in_flight = {}
+        self._pending = deque()
+        self._results = deque()
+        self._trigger = Clock.create_trigger(self._deliver_in_clock)
+
+    @property
+    def in_flight(self):
+        """The number of frames currently being processed.
+        """
+        return len(self._in_flight)
+
+    def get_stats(self):
+        """Returns a dict with the frame counts of the executor.
+        """
+        return {
+            'submitted': self.frames_submitted,
+            'completed': self.frames_completed,
+            'dropped': self.frames_dropped, 'failed': self.frames_failed,
+            'in_flight': self.in_flight}
+
+    def start(self):
+        """Starts the worker processes and starts processing the player's
+        frames. May be called from the kivy thread only.
+        """
+        if self.pool is not None:
+            return
+
+        self.frames_submitted = self.frames_completed = 0
+        self.frames_dropped = self.frames_failed = 0
+        self._ring_name = 'cpl_media_exec_{}_{}'.format(
+            id(self), next(_ring_count))
+        self.pool = ProcessPoolExecutor(
+            max_workers=self.workers, mp_context=get_context('spawn'))
+        self.player.frame_callbacks.append(self._submit_frame)
+
+    def stop(self, wait=False):
+        """Stops processing the player's frames and shuts down the worker
+        processes. Results of frames still being processed are discarded.
+        May be called from the kivy thread only.
+
+        :param wait: Whether to wait for the worker processes to exit.
+        """
+        pool = self.pool
+        if pool is None:
+            return
+
+        self.player.frame_callbacks.remove(self._submit_frame)
+        with self._lock:
+            self.pool = None
+            ring, self.ring = self.ring, None
+            self._in_flight = {}
+            self._pending.clear()
+
+        pool.shutdown(wait=wait, cancel_futures=True)
+        if ring is not None:
+            ring.close()
+            ring.unlink()
+
+    def _submit_frame(self, item):
+        image, metadata = item
+        with self._lock:
+            pool = self.pool
+            if pool is None:
+                return
+
+            ring = self.ring
+            if ring is None:
+                ring = self.ring = SharedMemoryRing(
+                    self._ring_name, create=True, n_slots=self.max_in_flight,
+                    slot_size=sum(image.get_buffer_size(keep_align=True)))
+
+            # the next frame's slot is still used by an older frame
+            seq = ring.write_seq + 1
+            in_flight = self._in_flight
+            if len(in_flight) >= self.max_in_flight or \
+                    seq - ring.n_slots in in_flight:
+                self.frames_dropped += 1
+                return
+
+            seq = ring.write(image, metadata)
+            if not seq:
+                self.frames_dropped += 1
+                return
+
+            future = pool.submit(
+                _process_frame_in_worker, self._ring_name, seq, self.function)
+            in_flight[seq] = metadata
+            self._pending.append((seq, future))
+            self.frames_submitted += 1
+
+        future.add_done_callback(self._frame_done)
+
+    def _frame_done(self, future):
+        # it may be called from the player's and the pool's threads, so the
+        # results are delivered with the lock held to keep their order
+        with self._deliver_lock:
+            self._deliver_done(future)
+
+    def _deliver_done(self, future):
+        with self._lock:
+            if future.cancelled():
+                return
+
+            pending = self._pending
+            results = []
+            if self.ordered:
+                while pending and pending[0][1].done():
+                    results.append(pending.popleft())
+            else:
+                for item in pending:
+                    if item[1] is future:
+                        pending.remove(item)
+                        results.append(item)
+                        break
+
+            items = []
+            for seq, item_future in results:
+                metadata = self._in_flight.pop(seq, None)
+                if metadata is not None:
+                    items.append((item_future, metadata))
+
+        for item_future, metadata in items:
+            e = item_future.exception()
+            if e is not None:
+                self.frames_failed += 1
+                cpl_media.error_callback(
+                    e, exc_info=''.join(traceback.format_exception(
+                        type(e), e, e.__traceback__)), threaded=True)
+                continue
+
+            self.frames_completed += 1
+            if self.callback is None:
+                continue
+            if self.deliver_in_clock:
+                self._results.append((item_future.result(), metadata))
+                self._trigger()
+            else:
+                self.callback(item_future.result(), metadata)
+
+    def _deliver_in_clock(self, *largs):
+        results = self._results
+        callback = self.callback
+        while results:
+            result, metadata = results.popleft()
+            if callback is not None:
+                callback(result, metadata)
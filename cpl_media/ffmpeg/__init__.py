@@ -10,25 +10,39 @@ import time
 from collections import defaultdict
 from functools import partial
 from time import perf_counter as clock
-from os.path import splitext, join, exists, isdir, abspath, dirname
+from os.path import splitext, exists, isdir, abspath
 
 from ffpyplayer.player import MediaPlayer
 from ffpyplayer.pic import get_image_size
 from ffpyplayer.tools import list_dshow_devices, set_log_callback
 
-from kivy.clock import Clock
+from cpl_media.clock import Clock
 from kivy.logger import Logger
 from kivy.properties import StringProperty, DictProperty, BooleanProperty, \
     NumericProperty
-from kivy.uix.boxlayout import BoxLayout
-from kivy.lang import Builder
 
-from cpl_media.player import BasePlayer, VideoMetadata
+from cpl_media.player import BasePlayer, VideoMetadata, FrameMetadata
 from cpl_media import error_guard
+from cpl_media.common import lazy_module_getattr
 
-__all__ = ('FFmpegPlayer', 'FFmpegSettingsWidget', 'LogFilter')
+__all__ = ('FFmpegPlayer', 'LogFilter', 'install_log_callback')
 
-set_log_callback(logger=Logger, default_only=True)
+_log_callback_installed = False
+
+
+def install_log_callback():
+    """Forwards the FFmpeg log messages to the Kivy logger, unless a log
+    callback was already installed, e.g. with :meth:`LogFilter.start_filter`.
+
+    It's called when the first :class:`FFmpegPlayer` is created rather than
+    when the module is imported.
+    """
+    global _log_callback_installed
+    if _log_callback_installed:
+        return
+
+    _log_callback_installed = True
+    set_log_callback(logger=Logger, default_only=True)
 
 
 def eat_first(f, val, *largs, **kwargs):
@@ -42,7 +56,7 @@ class FFmpegPlayer(BasePlayer):
     _config_props_ = (
         'play_filename', 'file_fmt', 'icodec',
         'dshow_true_filename', 'dshow_opt', 'use_dshow', 'dshow_rate',
-        'dshow_filename')
+        'dshow_filename', 'unthrottled')
 
     play_filename = StringProperty('')
     '''The filename of the media being played. Can be e.g. a filename etc.
@@ -66,6 +80,15 @@ class FFmpegPlayer(BasePlayer):
     """The frame rate to request from the dshow camera.
     """
 
+    unthrottled = BooleanProperty(False)
+    """Whether media files are played as fast as they can be decoded, rather
+    than at the video frame rate. E.g. to process a video file offline with
+    :meth:`~cpl_media.player.BasePlayer.iter_frames`. No frames are dropped in
+    this mode.
+
+    It is ignored when using dshow (:attr:`use_dshow`).
+    """
+
     dshow_filename = StringProperty('')
     """The name of the dshow camera to open.
     """
@@ -94,6 +117,7 @@ class FFmpegPlayer(BasePlayer):
 
     def __init__(self, **kw):
         super(FFmpegPlayer, self).__init__(**kw)
+        install_log_callback()
 
         self.fbind('play_filename', self._update_summary)
         self.fbind('dshow_filename', self._update_summary)
@@ -254,6 +278,9 @@ class FFmpegPlayer(BasePlayer):
 
         ifmt, icodec = self.file_fmt, self.icodec
         use_dshow = self.use_dshow
+        unthrottled = self.unthrottled and not use_dshow
+        if unthrottled:
+            ff_opts['framedrop'] = False
         if ifmt:
             ff_opts['f'] = ifmt
         if use_dshow:
@@ -341,22 +368,20 @@ class FFmpegPlayer(BasePlayer):
         Clock.schedule_once(self.complete_start)
 
         # started
-        process_frame(img[0], {'t': ivl_start if use_rt else img[1]})
+        process_frame(
+            img[0], FrameMetadata(
+                ivl_start if use_rt else img[1], host_t=ivl_start))
 
         min_sleep = 1 / (rate * 8.)
         self.setattr_in_kivy_thread('ts_play', ivl_start)
-        self.setattr_in_kivy_thread('frames_played', 1)
-        count = 1
+        timers = self.thread_timers['play']
+        timers.start()
+        mark = timers.mark
 
         while self.play_state != 'stopping':
+            ts = clock()
             img, val = ffplayer.get_frame()
-            ivl_end = clock()
-
-            if ivl_end - ivl_start >= 1.:
-                real_rate = count / (ivl_end - ivl_start)
-                self.setattr_in_kivy_thread('real_rate', real_rate)
-                count = 0
-                ivl_start = ivl_end
+            ivl_end = mark('acquire', ts)
 
             if val == 'paused':
                 raise ValueError("Player {} got {}".format(self, val))
@@ -365,42 +390,25 @@ class FFmpegPlayer(BasePlayer):
 
             if not img:
                 time.sleep(min(val, min_sleep) if val else min_sleep)
+                mark('sleep', ivl_end)
+                timers.tick()
                 continue
-            elif val:
-                ts = clock()
+
+            # the frame is acquired when it's due to be presented
+            host_t = ivl_end
+            if val and not unthrottled:
                 leftover = val
                 while leftover > min_sleep and \
                         self.play_state != 'stopping':
                     time.sleep(min_sleep)
-                    leftover = max(val - (clock() - ts), 0)
-
-            count += 1
-            self.increment_in_kivy_thread('frames_played')
-            process_frame(img[0], {'t': ivl_end if use_rt else img[1]})
-
-
-class FFmpegSettingsWidget(BoxLayout):
-    """Settings widget for :class:`FFmpegPlayer`.
-    """
-
-    player: FFmpegPlayer = None
-    """The player.
-    """
-
-    def __init__(self, player=None, **kwargs):
-        if player is None:
-            player = FFmpegPlayer()
-        self.player = player
-        super(FFmpegSettingsWidget, self).__init__(**kwargs)
-
-    def set_filename(self, text_wid, paths):
-        """Called by the GUI to set the filename.
-        """
-        if not paths:
-            return
+                    leftover = max(val - (clock() - ivl_end), 0)
+                host_t = mark('sleep', ivl_end)
 
-        self.player.play_filename = paths[0]
-        text_wid.text = paths[0]
+            process_frame(
+                img[0], FrameMetadata(
+                    ivl_end if use_rt else img[1], host_t=host_t))
+            mark('callbacks', host_t)
+            timers.tick()
 
 
 class LogFilter:
@@ -427,6 +435,8 @@ class LogFilter:
     def start_filter(self):
         """Start the filter.
         """
+        global _log_callback_installed
+        _log_callback_installed = True
         set_log_callback(self._callback)
 
     def _callback(self, message: str, level: str):
@@ -440,4 +450,7 @@ class LogFilter:
         self._logger_func[level](f'ffpyplayer: {message}')
 
 
-Builder.load_file(join(dirname(__file__), 'ffmpeg_player.kv'))
+# the settings widgets are only imported from their own module when they
+# are used, so Kivy widgets and kv files are not loaded when headless
+__getattr__ = lazy_module_getattr(
+    __name__, {'FFmpegSettingsWidget': 'cpl_media.ffmpeg.widgets'})
@@ -0,0 +1,41 @@
+"""FFmpeg player widgets
+=======================
+
+The settings widget for :class:`~cpl_media.ffmpeg.FFmpegPlayer`.
+"""
+
+from os.path import join, dirname
+
+from kivy.uix.boxlayout import BoxLayout
+from kivy.lang import Builder
+
+from cpl_media.ffmpeg import FFmpegPlayer
+
+__all__ = ('FFmpegSettingsWidget', )
+
+
+class FFmpegSettingsWidget(BoxLayout):
+    """Settings widget for :class:`~cpl_media.ffmpeg.FFmpegPlayer`.
+    """
+
+    player: FFmpegPlayer = None
+    """The player.
+    """
+
+    def __init__(self, player=None, **kwargs):
+        if player is None:
+            player = FFmpegPlayer()
+        self.player = player
+        super(FFmpegSettingsWidget, self).__init__(**kwargs)
+
+    def set_filename(self, text_wid, paths):
+        """Called by the GUI to set the filename.
+        """
+        if not paths:
+            return
+
+        self.player.play_filename = paths[0]
+        text_wid.text = paths[0]
+
+
+Builder.load_file(join(dirname(__file__), 'ffmpeg_player.kv'))
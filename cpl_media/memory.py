@@ -0,0 +1,268 @@
+"""Memory governor
+=================
+
+Provides :attr:`memory_governor`, the :class:`MemoryGovernor` that limits the
+memory used by the frames waiting in all the frame queues of the package,
+e.g. the :attr:`~cpl_media.recorder.BaseRecorder.image_queue` of the
+recorders or the queue of the images received by the
+:class:`~cpl_media.remote.client.RemoteVideoPlayer`.
+
+Each queue reports the bytes of the frames it holds to its own
+:class:`MemoryAccount` of the governor. Once the total bytes held by all the
+queues reaches :attr:`MemoryGovernor.budget`, the :attr:`MemoryAccount.policy`
+of each queue decides whether a new frame is dropped, e.g. for previews, or
+waits until memory is released, e.g. for recorders. E.g.::
+
+    from cpl_media.memory import memory_governor
+    memory_governor.budget = 2 * 1024 ** 3
+
+The budget can also be set in MiB with the ``CPL_MEDIA_MEMORY_BUDGET_MB``
+environment variable before :mod:`cpl_media` is imported. By default there's
+no budget, but the bytes in flight and their high-water marks are still
+tracked, see :meth:`MemoryGovernor.get_stats`.
+"""
+
+import os
+import logging
+from threading import Condition
+from time import perf_counter as clock
+from weakref import WeakSet
+
+__all__ = (
+    'MemoryGovernor', 'MemoryAccount', 'memory_governor', 'get_frame_nbytes')
+
+
+def get_frame_nbytes(item):
+    """Returns the number of bytes of the image of the frame.
+
+    :param item: Either the ``(image, metadata)`` tuple or the
+        :class:`ffpyplayer.pic.Image`.
+    """
+    if isinstance(item, tuple):
+        item = item[0]
+    try:
+        return sum(item.get_buffer_size(keep_align=True))
+    except AttributeError:
+        return 0
+
+
+class MemoryAccount(object):
+    """The bytes held by one queue, created with
+    :meth:`MemoryGovernor.create_account`.
+
+    The queue calls :meth:`reserve` before it adds a frame and :meth:`release`
+    once the frame left the queue. An account that holds no bytes may always
+    reserve a frame, even above the budget, so every queue can make progress
+    and a blocked queue never waits on itself.
+    """
+
+    policies = ('drop', 'block')
+    """The supported policies.
+    """
+
+    governor: 'MemoryGovernor' = None
+    """The :class:`MemoryGovernor` of the account.
+    """
+
+    name = ''
+    """A name describing the queue.
+    """
+
+    policy = 'drop'
+    """What happens to a new frame when the governor is over budget. Can be
+    one of:
+
+    * ``'drop'``: The frame is dropped. For previews and the network.
+    * ``'block'``: :meth:`reserve` waits until enough memory was released. For
+      recorders.
+    """
+
+    nbytes = 0
+    """The number of bytes currently held by the queue.
+    """
+
+    high_water = 0
+    """The largest number of bytes held by the queue at once.
+    """
+
+    dropped = 0
+    """The number of frames dropped because the governor was over budget.
+    """
+
+    blocked = 0
+    """The number of times :meth:`reserve` waited for memory.
+    """
+
+    blocked_time = 0
+    """The total time in seconds that :meth:`reserve` waited for memory.
+    """
+
+    def __init__(self, governor, name='', policy='drop', **kwargs):
+        super(MemoryAccount, self).__init__(**kwargs)
+        if policy not in self.policies:
+            raise ValueError('Unknown memory policy "{}"'.format(policy))
+        self.governor = governor
+        self.name = name
+        self.policy = policy
+
+    def reserve(self, nbytes, abort=None):
+        """Adds the bytes to the account, applying :attr:`policy` if the
+        governor would be over budget.
+
+        :param nbytes: The number of bytes of the frame.
+        :param abort: For the ``'block'`` policy, an optional function that
+            returns True when the wait should be aborted, e.g. because the
+            queue was closed. It's checked whenever
+            :meth:`MemoryGovernor.wake` is called.
+        :return: Whether the bytes were added. If False, the frame should be
+            dropped.
+        """
+        return self.governor._reserve(self, nbytes, abort)
+
+    def release(self, nbytes):
+        """Removes the bytes from the account, once the frame left the queue.
+        """
+        self.governor._release(self, nbytes)
+
+    def exceeds_budget(self, nbytes):
+        """Returns whether :meth:`reserve` would apply :attr:`policy` to a
+        frame with this many bytes, because the governor is over budget.
+        """
+        governor = self.governor
+        with governor._cond:
+            return bool(
+                governor.budget and self.nbytes and
+                governor._in_flight() + nbytes > governor.budget)
+
+    def get_stats(self):
+        """Returns a dict with the name, policy and statistics of the account.
+        """
+        return {
+            'name': self.name, 'policy': self.policy, 'nbytes': self.nbytes,
+            'high_water': self.high_water, 'dropped': self.dropped,
+            'blocked': self.blocked, 'blocked_time': self.blocked_time}
+
+
+class MemoryGovernor(object):
+    """Limits the total bytes of the frames held by all its
+    :class:`MemoryAccount`.
+
+    The accounts are only referenced weakly, so the bytes of a queue that is
+    no longer used are no longer counted once the queue is garbage collected.
+    """
+
+    budget = 0
+    """The maximum number of bytes that all the queues may hold together.
+    Zero means unlimited. It may be changed at any time.
+    """
+
+    high_water = 0
+    """The largest number of bytes held by all the queues at once.
+    """
+
+    _accounts = None
+
+    _cond = None
+
+    def __init__(self, budget=0, **kwargs):
+        super(MemoryGovernor, self).__init__(**kwargs)
+        self.budget = budget
+        self._accounts = WeakSet()
+        self._cond = Condition()
+
+    @property
+    def in_flight(self):
+        """The number of bytes currently held by all the queues.
+        """
+        with self._cond:
+            return self._in_flight()
+
+    def _in_flight(self):
+        return sum(account.nbytes for account in self._accounts)
+
+    def create_account(self, name='', policy='drop'):
+        """Creates a :class:`MemoryAccount` for a queue.
+
+        :param name: A name describing the queue.
+        :param policy: One of :attr:`MemoryAccount.policies`.
+        :return: The :class:`MemoryAccount`. The caller must keep a reference
+            to it for as long as the queue is used.
+        """
+        account = MemoryAccount(self, name=name, policy=policy)
+        with self._cond:
+            self._accounts.add(account)
+        return account
+
+    def get_accounts(self):
+        """Returns the list of the :class:`MemoryAccount` still in use.
+        """
+        with self._cond:
+            return list(self._accounts)
+
+    def _reserve(self, account, nbytes, abort):
+        with self._cond:
+            in_flight = self._in_flight()
+            budget = self.budget
+            if budget and account.nbytes and in_flight + nbytes > budget:
+                if account.policy == 'drop':
+                    account.dropped += 1
+                    return False
+
+                ts = clock()
+                account.blocked += 1
+                try:
+                    while True:
+                        if abort is not None and abort():
+                            return False
+                        self._cond.wait()
+
+                        in_flight = self._in_flight()
+                        budget = self.budget
+                        if not budget or not account.nbytes or \
+                                in_flight + nbytes <= budget:
+                            break
+                finally:
+                    account.blocked_time += clock() - ts
+
+            account.nbytes += nbytes
+            if account.nbytes > account.high_water:
+                account.high_water = account.nbytes
+            if in_flight + nbytes > self.high_water:
+                self.high_water = in_flight + nbytes
+            return True
+
+    def _release(self, account, nbytes):
+        with self._cond:
+            account.nbytes -= nbytes
+            self._cond.notify_all()
+
+    def wake(self):
+        """Wakes up all the queues waiting in :meth:`MemoryAccount.reserve` so
+        they check again whether there's memory or whether to abort, e.g.
+        after the budget was increased or a queue was closed.
+        """
+        with self._cond:
+            self._cond.notify_all()
+
+    def get_stats(self):
+        """Returns a dict with the ``budget``, the ``in_flight`` bytes, the
+        ``high_water`` bytes and the list of the
+        :meth:`MemoryAccount.get_stats` of the ``accounts``.
+        """
+        with self._cond:
+            accounts = list(self._accounts)
+            return {
+                'budget': self.budget, 'in_flight': self._in_flight(),
+                'high_water': self.high_water,
+                'accounts': [account.get_stats() for account in accounts]}
+
+
+memory_governor = MemoryGovernor()
+"""The :class:`MemoryGovernor` used by all the frame queues of the package.
+"""
+
+if os.environ.get('CPL_MEDIA_MEMORY_BUDGET_MB'):
+    memory_governor.budget = int(
+        float(os.environ['CPL_MEDIA_MEMORY_BUDGET_MB']) * 1024 ** 2)
+    logging.debug('cpl_media: Using a memory budget of {} bytes'.format(
+        memory_governor.budget))
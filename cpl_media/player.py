@@ -5,31 +5,1213 @@ Provides the base class for video players.
 """
 
 import logging
-from threading import Thread
-from collections import namedtuple
+import sys
+from threading import Thread, Lock, Condition
+from collections import namedtuple, deque, OrderedDict
+from collections.abc import MutableMapping
+from functools import partial
+from queue import Empty
+from time import monotonic, perf_counter as clock
 
-from ffpyplayer.pic import get_image_size
+from ffpyplayer.pic import get_image_size, Image, SWScale
 
-from kivy.clock import Clock
+from .clock import Clock, call_in_clock, tick_clock, run_clock_until
 from kivy.properties import (
-    NumericProperty, ObjectProperty, StringProperty, BooleanProperty)
+    NumericProperty, ObjectProperty, StringProperty, BooleanProperty,
+    DictProperty, ListProperty)
 from kivy.event import EventDispatcher
 
 from cpl_media import error_guard
-from .common import KivyMediaBase
+from .common import KivyMediaBase, LatencyHistogram
+from .memory import MemoryAccount, memory_governor, get_frame_nbytes
 
-__all__ = ('BasePlayer', 'VideoMetadata')
+try:
+    import numpy as np
+except ImportError as err:
+    np = None
+    logging.debug('cpl_media: Could not import numpy: {}'.format(err))
+
+__all__ = (
+    'BasePlayer', 'VideoMetadata', 'FrameMetadata', 'FrameBufferPool',
+    'SWScaleCache',
+    'sws_cache', 'FrameQueue',
+    'FrameSubscriber', 'FrameRateEstimator', 'AsyncFrameQueue',
+    'plane_layouts',
+    'FramePlaneArray', 'get_image_arrays', 'get_buffer_arrays',
+    'image_from_arrays')
 
 VideoMetadata = namedtuple('VideoMetadata', ['fmt', 'w', 'h', 'rate'])
 """Namedtuple type describing a video stream.
 """
 
 
+class FrameMetadata(MutableMapping):
+    """The metadata of a frame, that the players pass along with each image
+    (see :attr:`BasePlayer.frame_callbacks`).
+
+    It stores the common keys ``'t'``, ``'count'``, ``'host_t'`` and
+    ``'seq'`` in slots, so creating it is cheaper than a dict, and any other
+    key in :attr:`extras`. It behaves like a dict, so the consumers can use it
+    like the dicts the players used to pass, e.g. ``metadata['t']``,
+    ``metadata.get('count')`` or ``'count' in metadata``. A common key whose
+    value is None is treated as missing. E.g.::
+
+        >>> metadata = FrameMetadata(t=1.5, count=12, exposure=.01)
+        >>> metadata['t'], metadata.get('host_t'), dict(metadata)
+        (1.5, None, {'t': 1.5, 'count': 12, 'exposure': 0.01})
+    """
+
+    __slots__ = ('t', 'count', 'host_t', 'seq', 'extras')
+
+    slot_keys = ('t', 'count', 'host_t', 'seq')
+    """The keys stored in slots rather than in :attr:`extras`.
+    """
+
+    def __init__(
+            self, t=None, count=None, host_t=None, seq=None, extras=None,
+            **kwargs):
+        self.t = t
+        self.count = count
+        self.host_t = host_t
+        self.seq = seq
+        if kwargs:
+            extras = dict(extras or {}, **kwargs)
+        self.extras = extras or None
+
+    @classmethod
+    def from_dict(cls, metadata):
+        """Creates a :class:`FrameMetadata` from a dict or mapping.
+        """
+        metadata = dict(metadata)
+        return cls(
+            metadata.pop('t', None), metadata.pop('count', None),
+            metadata.pop('host_t', None), metadata.pop('seq', None),
+            metadata)
+
+    def __getitem__(self, key):
+        if key in self.slot_keys:
+            value = getattr(self, key)
+            if value is None:
+                raise KeyError(key)
+            return value
+        if self.extras is None:
+            raise KeyError(key)
+        return self.extras[key]
+
+    def get(self, key, default=None):
+        if key in self.slot_keys:
+            value = getattr(self, key)
+            return default if value is None else value
+        if self.extras is None:
+            return default
+        return self.extras.get(key, default)
+
+    def __setitem__(self, key, value):
+        if key in self.slot_keys:
+            setattr(self, key, value)
+            return
+        if self.extras is None:
+            self.extras = {}
+        self.extras[key] = value
+
+    def __delitem__(self, key):
+        if key in self.slot_keys:
+            if getattr(self, key) is None:
+                raise KeyError(key)
+            setattr(self, key, None)
+            return
+        if self.extras is None:
+            raise KeyError(key)
+        del self.extras[key]
+
+    def __contains__(self, key):
+        if key in self.slot_keys:
+            return getattr(self, key) is not None
+        return self.extras is not None and key in self.extras
+
+    def __iter__(self):
+        for key in self.slot_keys:
+            if getattr(self, key) is not None:
+                yield key
+        if self.extras is not None:
+            yield from self.extras
+
+    def __len__(self):
+        n = sum(getattr(self, key) is not None for key in self.slot_keys)
+        if self.extras is not None:
+            n += len(self.extras)
+        return n
+
+    def __repr__(self):
+        return 'FrameMetadata({})'.format(', '.join(
+            '{}={!r}'.format(key, value) for key, value in self.items()))
+
+    def __reduce__(self):
+        return self.__class__, (
+            self.t, self.count, self.host_t, self.seq, self.extras)
+
+    def copy(self):
+        """Returns a shallow copy of the metadata.
+        """
+        return self.__class__(
+            self.t, self.count, self.host_t, self.seq,
+            None if self.extras is None else dict(self.extras))
+
+
+plane_layouts = {
+    'gray': ('u1', ((1, 1, 0, 1), )),
+    'gray8': ('u1', ((1, 1, 0, 1), )),
+    'gray16le': ('<u2', ((1, 1, 0, 1), )),
+    'rgb24': ('u1', ((1, 1, 3, 1), )),
+    'bgr24': ('u1', ((1, 1, 3, 1), )),
+    'rgba': ('u1', ((1, 1, 4, 1), )),
+    'bgra': ('u1', ((1, 1, 4, 1), )),
+    'yuv420p': ('u1', ((1, 1, 0, 1), (2, 2, 0, 1), (2, 2, 0, 1))),
+    'yuv444p': ('u1', ((1, 1, 0, 1), (1, 1, 0, 1), (1, 1, 0, 1))),
+    'uyvy422': ('u1', ((1, 1, 2, 2), )),
+}
+"""The layout of the planes of the pixel formats supported by
+:func:`get_image_arrays` and :func:`get_buffer_arrays`.
+
+Maps the pixel format to a 2-tuple of the numpy dtype of the pixel
+components and a tuple with the ``(x_div, y_div, channels, x_align)`` of
+each plane. The plane is ``ceil(w / x_div)`` pixels wide, rounded up to a
+multiple of ``x_align``, and ``ceil(h / y_div)`` pixels high, and each pixel
+has ``channels`` components. If ``channels`` is zero, the plane's array is
+2-dimensional.
+
+E.g. for ``uyvy422`` each pixel is represented by the 2 bytes that
+alternate between U and Y or V and Y. Pixels come in pairs sharing the U and
+V, so for odd widths the plane has an additional pixel holding the V and Y of
+the last pair.
+"""
+
+if np is not None:
+    class FramePlaneArray(np.ndarray):
+        """A numpy array that is a view of a plane of a
+        :class:`ffpyplayer.pic.Image`, as returned by
+        :func:`get_image_arrays`.
+
+        It keeps a reference to the image in :attr:`image`, as does every
+        array derived from it, so the image buffers remain valid as long as
+        the array is used.
+        """
+
+        image = None
+        """The :class:`ffpyplayer.pic.Image` whose plane this array views.
+        """
+
+        def __array_finalize__(self, obj):
+            self.image = getattr(obj, 'image', None)
+else:
+    FramePlaneArray = None
+
+
+def _plane_arrays(buffers, pix_fmt, size, linesize):
+    if np is None:
+        raise TypeError('numpy is required to get the image arrays')
+    if pix_fmt not in plane_layouts:
+        raise ValueError(
+            'Pixel format "{}" is not supported'.format(pix_fmt))
+
+    w, h = size
+    dtype, planes = plane_layouts[pix_fmt]
+    dtype = np.dtype(dtype)
+    item = dtype.itemsize
+
+    arrays = []
+    for i, (x_div, y_div, channels, x_align) in enumerate(planes):
+        pw = (w + x_div - 1) // x_div
+        pw = (pw + x_align - 1) // x_align * x_align
+        ph = (h + y_div - 1) // y_div
+        line = linesize[i] if linesize and linesize[i] else \
+            pw * max(channels, 1) * item
+
+        if channels:
+            shape = ph, pw, channels
+            strides = line, channels * item, item
+        else:
+            shape = ph, pw
+            strides = line, item
+        arrays.append(np.ndarray(
+            shape, dtype, buffer=buffers[i], strides=strides))
+    return arrays
+
+
+def get_image_arrays(image):
+    """Returns read only numpy arrays that view the planes of the image,
+    without copying the data.
+
+    The strides of the arrays are computed from the image's linesizes, so
+    padded lines are skipped. The arrays keep a reference to the image (see
+    :class:`FramePlaneArray`).
+
+    E.g. for a ``rgb24`` image it returns a list with a single
+    ``(h, w, 3)`` array and for a ``yuv420p`` image it returns the three
+    ``(h, w)``, ``(h / 2, w / 2)``, and ``(h / 2, w / 2)`` arrays. See
+    :attr:`plane_layouts` for the supported formats.
+
+    :param image: The :class:`ffpyplayer.pic.Image`.
+    :return: A list of arrays, one for each plane.
+    """
+    linesize = image.get_linesizes(keep_align=True)
+    arrays = _plane_arrays(
+        image.to_memoryview(keep_align=True), image.get_pixel_format(),
+        image.get_size(), linesize)
+
+    views = []
+    for arr in arrays:
+        view = arr.view(FramePlaneArray)
+        view.image = image
+        view.flags.writeable = False
+        views.append(view)
+    return views
+
+
+def get_buffer_arrays(buffers, pix_fmt, size, linesize=None):
+    """Returns writable numpy arrays that view the plane buffers, e.g. the
+    buffers returned by :meth:`FrameBufferPool.get_image_buffers`.
+
+    This lets producers write the image data using numpy directly into the
+    buffers and then create the image from the same buffers, without any
+    additional copies. E.g.::
+
+        buffers = pool.get_image_buffers('yuv444p', w, h)
+        for arr, i in zip(get_buffer_arrays(buffers, 'yuv444p', (w, h)),
+                          (1, 0, 2)):
+            arr[:, :] = data[:, :, i]
+        img = Image(plane_buffers=buffers, pix_fmt='yuv444p', size=(w, h))
+
+    :param buffers: The list of buffers, one for each plane.
+    :param pix_fmt: The pixel format, one of :attr:`plane_layouts`.
+    :param size: The image size as ``(w, h)``.
+    :param linesize: The optional linesize of each plane, if the lines are
+        padded.
+    :return: A list of arrays, one for each plane.
+    """
+    return _plane_arrays(buffers, pix_fmt, size, linesize)
+
+
+def _get_array_buffer(arr):
+    # returns the bytearray that the array exactly covers, if any
+    if not arr.flags.c_contiguous:
+        return None
+
+    base = arr
+    while isinstance(base, np.ndarray):
+        base = base.base
+    if isinstance(base, memoryview):
+        base = base.obj
+
+    if not isinstance(base, bytearray) or len(base) != arr.nbytes or \
+            not len(base):
+        return None
+    if np.frombuffer(base, dtype=np.uint8).ctypes.data != arr.ctypes.data:
+        return None
+    return base
+
+
+def image_from_arrays(arrays, pix_fmt, size, pool=None):
+    """Creates a :class:`ffpyplayer.pic.Image` from numpy arrays, one for
+    each plane.
+
+    If the arrays are contiguous views over whole ``bytearray`` buffers, e.g.
+    when created with :func:`get_buffer_arrays` or with
+    ``numpy.frombuffer(bytearray(...))``, the image uses the buffers directly
+    without copying. Otherwise, the data is copied into new buffers.
+
+    :param arrays: The list of arrays, one for each plane. Their data must
+        not be padded.
+    :param pix_fmt: The pixel format of the image.
+    :param size: The image size as ``(w, h)``.
+    :param pool: An optional :class:`FrameBufferPool` from which to get the
+        buffers when the data needs to be copied.
+    :return: The :class:`ffpyplayer.pic.Image`.
+    """
+    if np is None:
+        raise TypeError('numpy is required to create the image from arrays')
+
+    buffers = [_get_array_buffer(arr) for arr in arrays]
+    if any(buf is None for buf in buffers):
+        sizes = [arr.nbytes for arr in arrays]
+        if pool is not None:
+            buffers = pool.get_buffers(sizes)
+        else:
+            buffers = [bytearray(n) for n in sizes]
+
+        for buf, arr in zip(buffers, arrays):
+            np.frombuffer(buf, dtype=arr.dtype).reshape(arr.shape)[...] = arr
+
+    return Image(plane_buffers=buffers, pix_fmt=pix_fmt, size=size)
+
+
+class FrameBufferPool(object):
+    """A pool of reusable image plane buffers, keyed by the size of the planes.
+
+    Players check out plane buffers with :meth:`get_buffers` or
+    :meth:`get_image_buffers`, fill them, and create a
+    :class:`ffpyplayer.pic.Image` from them with ``plane_buffers``. The
+    ``Image`` uses the buffers directly and keeps a reference to them.
+
+    A buffer is only reused once no one else holds a reference to it. I.e.
+    once the image using it was released by the display, every
+    :attr:`BasePlayer.frame_callbacks` consumer (e.g. recorders) and
+    :attr:`BasePlayer.last_image`. This relies on Python's reference counting,
+    so no explicit release is required. If no buffer is free, a new one is
+    allocated and it's kept for reuse, unless :attr:`max_buffers` buffers of
+    that size are already resident.
+
+    The pool is thread safe.
+    """
+
+    max_buffers = 8
+    """The maximum number of buffers of a given size kept for reuse.
+    """
+
+    _lock = None
+
+    _buffers = {}
+
+    _hits = 0
+
+    _misses = 0
+
+    _resident_bytes = 0
+
+    def __init__(self, max_buffers=8, **kwargs):
+        super(FrameBufferPool, self).__init__(**kwargs)
+        self.max_buffers = max_buffers
+        self._lock = Lock()
+        self._buffers = {}
+
+    @property
+    def hits(self):
+        """The number of times a free buffer was reused.
+        """
+        return self._hits
+
+    @property
+    def misses(self):
+        """The number of times a new buffer had to be allocated.
+        """
+        return self._misses
+
+    @property
+    def resident_bytes(self):
+        """The number of bytes of all the buffers kept by the pool, whether
+        currently in use or free.
+        """
+        return self._resident_bytes
+
+    def get_buffers(self, sizes):
+        """Returns a list of ``bytearray`` buffers, one for each plane.
+
+        :param sizes: A list of the size in bytes of each plane.
+        :return: A list of ``bytearray``, one for each plane. The content of the
+            buffers is undefined.
+        """
+        sizes = tuple(sizes)
+        getrefcount = sys.getrefcount
+        with self._lock:
+            buffers = self._buffers.get(sizes)
+            if buffers is None:
+                buffers = self._buffers[sizes] = []
+
+            for planes in buffers:
+                # referenced only by planes, plane, and getrefcount's argument
+                for plane in planes:
+                    if getrefcount(plane) > 3:
+                        break
+                else:
+                    self._hits += 1
+                    return list(planes)
+
+            planes = [bytearray(size) for size in sizes]
+            self._misses += 1
+            if len(buffers) < self.max_buffers:
+                buffers.append(planes)
+                self._resident_bytes += sum(sizes)
+            return list(planes)
+
+    def get_image_buffers(self, pix_fmt, w, h):
+        """Returns a list of ``bytearray`` buffers, one for each plane of an
+        image of the given format and size, without any line alignment.
+
+        :param pix_fmt: The pixel format of the image.
+        :param w: The image width.
+        :param h: The image height.
+        :return: A list of ``bytearray``, similar to :meth:`get_buffers`.
+        """
+        return self.get_buffers(
+            [size for size in get_image_size(pix_fmt, w, h) if size])
+
+    def clear(self):
+        """Removes all the buffers from the pool. Buffers still in use are
+        not affected, they are just not reused.
+        """
+        with self._lock:
+            self._buffers = {}
+            self._resident_bytes = 0
+
+
+class SWScaleCache(object):
+    """A thread safe LRU cache of :class:`ffpyplayer.pic.SWScale` conversion
+    contexts, keyed by the input size and pixel format and the output size and
+    pixel format.
+
+    Creating a ``SWScale`` is relatively slow, so converting every frame of a
+    stream with :meth:`scale` only creates the context once for the stream.
+    Use the process wide :attr:`sws_cache` instance rather than creating new
+    caches.
+    """
+
+    max_entries = 16
+    """The maximum number of contexts kept. When exceeded, the least recently
+    used context is removed.
+    """
+
+    _lock = None
+
+    _entries = {}
+
+    _hits = 0
+
+    _misses = 0
+
+    def __init__(self, max_entries=16, **kwargs):
+        super(SWScaleCache, self).__init__(**kwargs)
+        self.max_entries = max_entries
+        self._lock = Lock()
+        self._entries = OrderedDict()
+
+    @property
+    def hits(self):
+        """The number of times a cached context was reused.
+        """
+        return self._hits
+
+    @property
+    def misses(self):
+        """The number of times a new context had to be created.
+        """
+        return self._misses
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, iw, ih, ifmt, ow=0, oh=0, ofmt=''):
+        """Returns the cached context for the conversion, creating it if
+        needed.
+
+        :param iw: The input image width.
+        :param ih: The input image height.
+        :param ifmt: The input pixel format.
+        :param ow: The output width. If zero, it's ``iw``.
+        :param oh: The output height. If zero, it's ``ih``.
+        :param ofmt: The output pixel format. If empty, it's ``ifmt``.
+        :return: A 2-tuple of a :class:`threading.Lock` and the
+            :class:`ffpyplayer.pic.SWScale`. A context may not be used from
+            multiple threads at once, so the lock must be held while it's
+            used.
+        """
+        key = iw, ih, ifmt, ow or iw, oh or ih, ofmt or ifmt
+        with self._lock:
+            entries = self._entries
+            entry = entries.get(key)
+            if entry is not None:
+                entries.move_to_end(key)
+                self._hits += 1
+                return entry
+
+            self._misses += 1
+
+        # create it outside the lock, a duplicate is created at worst
+        entry = Lock(), SWScale(*key[:3], ow=key[3], oh=key[4], ofmt=key[5])
+        with self._lock:
+            entries[key] = entry
+            while len(entries) > self.max_entries:
+                entries.popitem(last=False)
+        return entry
+
+    def scale(self, image, ow=0, oh=0, ofmt=''):
+        """Converts the image to the given size and pixel format using a
+        cached context.
+
+        :param image: The :class:`ffpyplayer.pic.Image` to convert.
+        :param ow: The output width. If zero, the image width is used.
+        :param oh: The output height. If zero, the image height is used.
+        :param ofmt: The output pixel format. If empty, the image pixel format
+            is used.
+        :return: The converted :class:`ffpyplayer.pic.Image`, or ``image``
+            itself if no conversion is needed.
+        """
+        ifmt = image.get_pixel_format()
+        iw, ih = image.get_size()
+        if (ow or iw, oh or ih, ofmt or ifmt) == (iw, ih, ifmt):
+            return image
+
+        lock, sws = self.get(iw, ih, ifmt, ow, oh, ofmt)
+        with lock:
+            return sws.scale(image)
+
+    def clear(self):
+        """Removes all the contexts from the cache.
+        """
+        with self._lock:
+            self._entries = OrderedDict()
+
+
+sws_cache = SWScaleCache()
+"""The process wide :class:`SWScaleCache` used by the players and recorders
+to convert images.
+"""
+
+
+class FrameRateEstimator(object):
+    """Estimates the frame rate, the jitter of the inter-frame intervals, and
+    the number of frames dropped by the source, from the frames as they
+    arrive.
+
+    The rate and jitter are computed from the local time at which the frames
+    arrived, either over a sliding time window, or as an exponentially
+    weighted moving average (EWMA) of the intervals, depending on
+    :attr:`mode`.
+
+    Dropped frames are detected from gaps in the frame ``count`` provided by
+    the camera, if available. Otherwise, they are detected from gaps in the
+    source timestamps larger than :attr:`drop_factor` times the typical
+    interval between frames.
+
+    :meth:`add` must be called from a single thread, while the estimates may be
+    read from any thread.
+    """
+
+    modes = ('window', 'ewma')
+    """The supported estimation modes.
+    """
+
+    mode = 'window'
+    """The estimation mode, one of :attr:`modes`.
+    """
+
+    window = 1.
+    """In ``'window'`` mode, the duration in seconds of the sliding window
+    over which the rate and jitter are computed.
+    """
+
+    alpha = .1
+    """In ``'ewma'`` mode, the weight of each new interval.
+    """
+
+    drop_factor = 1.5
+    """The source timestamp gap, in multiples of the typical interval, above
+    which frames are considered dropped when there's no frame ``count``.
+    """
+
+    rate = 0
+    """The estimated frame rate in Hz.
+    """
+
+    jitter = 0
+    """The estimated standard deviation of the inter-frame intervals, in
+    seconds.
+    """
+
+    dropped = 0
+    """The total number of frames detected as dropped by the source.
+    """
+
+    frames = 0
+    """The total number of frames added.
+    """
+
+    _times = None
+
+    _sum = 0
+
+    _sum_sq = 0
+
+    _last_t = None
+
+    _interval = 0
+
+    _var = 0
+
+    _last_source_t = None
+
+    _source_interval = 0
+
+    _last_count = None
+
+    def __init__(
+            self, mode='window', window=1., alpha=.1, drop_factor=1.5,
+            **kwargs):
+        super(FrameRateEstimator, self).__init__(**kwargs)
+        if mode not in self.modes:
+            raise ValueError('Unknown mode "{}"'.format(mode))
+        self.mode = mode
+        self.window = window
+        self.alpha = alpha
+        self.drop_factor = drop_factor
+        self.reset()
+
+    def reset(self):
+        """Resets the estimates and counters.
+        """
+        self.rate = self.jitter = 0
+        self.dropped = self.frames = 0
+        self._times = deque()
+        self._sum = self._sum_sq = 0
+        self._last_t = self._last_source_t = self._last_count = None
+        self._interval = self._var = self._source_interval = 0
+
+    def add(self, t, source_t=None, count=None):
+        """Adds a frame and updates the estimates.
+
+        :param t: The local time when the frame arrived, in seconds. E.g. the
+            metadata ``'host_t'``.
+        :param source_t: The optional timestamp of the frame provided by the
+            source, in seconds. E.g. the metadata ``'t'``.
+        :param count: The optional frame number provided by the source.
+        :return: The number of frames that were dropped right before this
+            frame.
+        """
+        self.frames += 1
+        dropped = self._add_dropped(source_t, count)
+        self.dropped += dropped
+
+        last_t = self._last_t
+        self._last_t = t
+        if last_t is None:
+            return dropped
+
+        dt = t - last_t
+        if self.mode == 'ewma':
+            if not self._interval:
+                self._interval = dt
+            else:
+                alpha = self.alpha
+                diff = dt - self._interval
+                self._interval += alpha * diff
+                self._var = (1 - alpha) * (self._var + alpha * diff * diff)
+            interval = self._interval
+            self.jitter = self._var ** .5
+        else:
+            times = self._times
+            times.append((t, dt))
+            self._sum += dt
+            self._sum_sq += dt * dt
+            while len(times) > 1 and t - times[0][0] > self.window:
+                _, old = times.popleft()
+                self._sum -= old
+                self._sum_sq -= old * old
+
+            n = len(times)
+            interval = self._sum / n
+            self.jitter = max(self._sum_sq / n - interval * interval, 0) ** .5
+
+        self.rate = 1 / interval if interval > 0 else 0
+        return dropped
+
+    def _add_dropped(self, source_t, count):
+        if count is not None:
+            last_count = self._last_count
+            self._last_count = count
+            if last_count is None:
+                return 0
+            return max(count - last_count - 1, 0)
+
+        if source_t is None:
+            return 0
+
+        last_t = self._last_source_t
+        self._last_source_t = source_t
+        if last_t is None:
+            return 0
+
+        dt = source_t - last_t
+        interval = self._source_interval
+        if not interval:
+            if dt > 0:
+                self._source_interval = dt
+            return 0
+
+        if dt > self.drop_factor * interval:
+            return max(int(round(dt / interval)) - 1, 0)
+
+        if dt > 0:
+            self._source_interval += self.alpha * (dt - interval)
+        return 0
+
+
+class FrameQueue(object):
+    """A thread safe, bounded queue of frames with a policy that determines
+    what happens when a frame is added while the queue is full.
+
+    The policy can be one of:
+
+    * ``'block'``: :meth:`put` blocks until there's space in the queue.
+    * ``'drop_oldest'``: The oldest frame in the queue is dropped.
+    * ``'drop_newest'``: The new frame is dropped.
+    * ``'latest'``: Like ``'drop_oldest'``, but the queue holds at most one
+      frame so the consumer always gets the latest frame.
+
+    Once :meth:`put_eof` is called, no more frames are accepted and once the
+    remaining frames have been read, :meth:`get` returns ``'eof'``.
+
+    The bytes of the queued frames are also reported to :attr:`memory`, so
+    that the :class:`~cpl_media.memory.MemoryGovernor` can limit the memory
+    of all the queues together. Frames dropped by the governor are counted
+    in :attr:`dropped` as well.
+    """
+
+    policies = ('block', 'drop_oldest', 'drop_newest', 'latest')
+    """The supported policies.
+    """
+
+    maxsize = 0
+    """The maximum number of frames in the queue. Zero means unbounded.
+    """
+
+    policy = 'block'
+    """The policy used when the queue is full. See :class:`FrameQueue`.
+    """
+
+    on_drop = None
+    """If not None, a callback that is called with the dropped frame whenever
+    a frame is dropped. It's called from the thread that called :meth:`put`.
+    """
+
+    delivered = 0
+    """The number of frames read from the queue with :meth:`get`.
+    """
+
+    dropped = 0
+    """The number of frames dropped because the queue was full.
+    """
+
+    high_water = 0
+    """The largest number of frames that have been in the queue at once.
+    """
+
+    memory: MemoryAccount = None
+    """The :class:`~cpl_media.memory.MemoryAccount` to which the bytes of the
+    queued frames are reported.
+    """
+
+    _items = None
+
+    _closed = False
+
+    _not_empty = None
+
+    _not_full = None
+
+    def __init__(
+            self, maxsize=0, policy='block', on_drop=None,
+            memory_policy='drop', name='', governor=None, **kwargs):
+        super(FrameQueue, self).__init__(**kwargs)
+        if policy not in self.policies:
+            raise ValueError('Unknown frame queue policy "{}"'.format(policy))
+        if policy == 'latest':
+            maxsize = 1
+
+        self.maxsize = maxsize
+        self.policy = policy
+        self.on_drop = on_drop
+        if governor is None:
+            governor = memory_governor
+        self.memory = governor.create_account(name, memory_policy)
+        self._items = deque()
+        lock = Lock()
+        self._not_empty = Condition(lock)
+        self._not_full = Condition(lock)
+
+    def qsize(self):
+        """Returns the number of frames currently in the queue.
+        """
+        return len(self._items)
+
+    def put(self, item):
+        """Adds the frame to the queue, applying :attr:`policy` if the queue
+        is full.
+
+        :param item: The frame to add, typically the ``(image, metadata)``
+            tuple.
+        :return: Whether the frame was added to the queue.
+        """
+        memory = self.memory
+        nbytes = get_frame_nbytes(item)
+        if not memory.reserve(nbytes, abort=self._is_closed):
+            if not self._closed:
+                with self._not_full:
+                    self.dropped += 1
+                if self.on_drop is not None:
+                    self.on_drop(item)
+            return False
+
+        dropped = None
+        with self._not_full:
+            if self._closed:
+                memory.release(nbytes)
+                return False
+
+            items = self._items
+            maxsize = self.maxsize
+            if maxsize and len(items) >= maxsize:
+                policy = self.policy
+                if policy == 'block':
+                    while len(items) >= maxsize and not self._closed:
+                        self._not_full.wait()
+                    if self._closed:
+                        memory.release(nbytes)
+                        return False
+                elif policy == 'drop_newest':
+                    dropped = item
+                else:
+                    dropped = items.popleft()
+
+                if dropped is not None:
+                    self.dropped += 1
+
+            if dropped is not item:
+                items.append(item)
+                if len(items) > self.high_water:
+                    self.high_water = len(items)
+                self._not_empty.notify()
+
+        if dropped is not None:
+            memory.release(
+                nbytes if dropped is item else get_frame_nbytes(dropped))
+        if dropped is not None and self.on_drop is not None:
+            self.on_drop(dropped)
+        return dropped is not item
+
+    def put_eof(self):
+        """Closes the queue so no more frames are accepted. Any thread blocked
+        in :meth:`put` returns and :meth:`get` returns ``'eof'`` once the
+        queue is empty.
+        """
+        with self._not_full:
+            self._closed = True
+            self._not_full.notify_all()
+            self._not_empty.notify_all()
+        # wake up a put waiting for memory
+        self.memory.governor.wake()
+
+    def _is_closed(self):
+        return self._closed
+
+    def get(self, block=True, timeout=None):
+        """Removes and returns the oldest frame in the queue.
+
+        :param block: Whether to wait for a frame if the queue is empty.
+        :param timeout: If ``block``, the maximum time to wait for a frame.
+            None means to wait forever.
+        :return: The frame or ``'eof'`` if :meth:`put_eof` was called and the
+            queue is empty. If no frame is available after waiting,
+            :class:`queue.Empty` is raised.
+        """
+        with self._not_empty:
+            items = self._items
+            if not items and not self._closed:
+                if not block:
+                    raise Empty
+                if timeout is None:
+                    while not items and not self._closed:
+                        self._not_empty.wait()
+                else:
+                    end = monotonic() + timeout
+                    while not items and not self._closed:
+                        remaining = end - monotonic()
+                        if remaining <= 0:
+                            raise Empty
+                        self._not_empty.wait(remaining)
+
+            if not items:
+                return 'eof'
+
+            self.delivered += 1
+            item = items.popleft()
+            self._not_full.notify()
+
+        self.memory.release(get_frame_nbytes(item))
+        return item
+
+
+class _AsyncWaiter(object):
+    """A single use event that is waited on in an asyncio or trio event loop
+    and that can be set from any thread.
+    """
+
+    wake = None
+    """Sets the event. May be called from any thread.
+    """
+
+    wait = None
+    """Coroutine function that waits until the event is set.
+    """
+
+    def __init__(self, async_lib='asyncio', **kwargs):
+        super(_AsyncWaiter, self).__init__(**kwargs)
+        if async_lib == 'asyncio':
+            import asyncio
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+
+            def set_result():
+                if not future.done():
+                    future.set_result(None)
+
+            def wake():
+                try:
+                    loop.call_soon_threadsafe(set_result)
+                except RuntimeError:  # loop closed
+                    pass
+
+            async def wait():
+                await future
+        elif async_lib == 'trio':
+            import trio
+            token = trio.lowlevel.current_trio_token()
+            event = trio.Event()
+
+            def wake():
+                try:
+                    token.run_sync_soon(event.set)
+                except trio.RunFinishedError:
+                    pass
+
+            wait = event.wait
+        else:
+            raise ValueError('Unknown async library "{}"'.format(async_lib))
+
+        self.wake = wake
+        self.wait = wait
+
+
+async def _await_in_clock(async_lib, f, *args, **kwargs):
+    """Calls the function from the :attr:`~cpl_media.clock.Clock` thread with
+    :func:`~cpl_media.clock.call_in_clock` and waits for it in the asyncio or
+    trio event loop, without blocking it.
+
+    :return: The return value of the function.
+    """
+    waiter = _AsyncWaiter(async_lib)
+    future = call_in_clock(f, *args, **kwargs)
+    future.add_done_callback(lambda future: waiter.wake())
+    await waiter.wait()
+    return future.result()
+
+
+class AsyncFrameQueue(FrameQueue):
+    """A :class:`FrameQueue` that can also be read from an asyncio or trio
+    event loop with :meth:`aget`.
+
+    The internal thread adds frames without blocking, so the ``'block'``
+    policy is not supported. The event loop is only woken up when a consumer
+    is waiting for a frame in :meth:`aget`.
+    """
+
+    async_lib = 'asyncio'
+    """The async library of the event loop in which :meth:`aget` is called.
+    Either ``'asyncio'`` or ``'trio'``.
+    """
+
+    _waiter = None
+
+    def __init__(self, maxsize=8, policy='drop_oldest', async_lib='asyncio',
+                 **kwargs):
+        if policy == 'block' or kwargs.get('memory_policy') == 'block':
+            raise ValueError(
+                'AsyncFrameQueue cannot use the "block" policy')
+        super(AsyncFrameQueue, self).__init__(
+            maxsize=maxsize, policy=policy, **kwargs)
+        self.async_lib = async_lib
+
+    def put(self, item):
+        added = super(AsyncFrameQueue, self).put(item)
+        self._wake()
+        return added
+
+    def put_eof(self):
+        super(AsyncFrameQueue, self).put_eof()
+        self._wake()
+
+    def _wake(self):
+        with self._not_empty:
+            waiter = self._waiter
+            self._waiter = None
+        if waiter is not None:
+            waiter.wake()
+
+    async def aget(self):
+        """Removes and returns the oldest frame in the queue, waiting in the
+        event loop for a frame if the queue is empty.
+
+        :return: The frame or ``'eof'`` if :meth:`put_eof` was called and the
+            queue is empty.
+        """
+        while True:
+            try:
+                return self.get(block=False)
+            except Empty:
+                pass
+
+            waiter = _AsyncWaiter(self.async_lib)
+            with self._not_empty:
+                if self._items or self._closed:
+                    continue
+                self._waiter = waiter
+
+            try:
+                await waiter.wait()
+            finally:
+                with self._not_empty:
+                    if self._waiter is waiter:
+                        self._waiter = None
+
+
+class FrameSubscriber(object):
+    """A subscriber to the frames of a :class:`BasePlayer`, created with
+    :meth:`BasePlayer.subscribe`.
+
+    Each subscriber has its own :class:`FrameQueue`, into which the player
+    adds the frames. If a callback is provided, the subscriber has its own
+    delivery thread that reads the frames from the queue and calls the
+    callback, so a slow subscriber does not delay the player or the other
+    subscribers. Otherwise, the consumer reads the frames directly from
+    :attr:`queue`.
+    """
+
+    name = ''
+    """A name describing the subscriber.
+    """
+
+    callback = None
+    """The callback called with the ``(image, metadata)`` tuple from the
+    delivery thread, or None if :attr:`queue` is read directly.
+    """
+
+    queue: FrameQueue = None
+    """The :class:`FrameQueue` into which the frames are added.
+    """
+
+    thread = None
+    """The delivery thread, if there's a :attr:`callback`.
+    """
+
+    exception = None
+    """A function called with the exception if the callback raises one.
+    """
+
+    latency: LatencyHistogram = None
+    """The :class:`~cpl_media.common.LatencyHistogram` of the time from when
+    the frame was acquired (the metadata ``'host_t'``) until the callback
+    returned.
+
+    When there's no :attr:`callback`, the consumer reading the :attr:`queue`
+    may add its own latencies to it.
+    """
+
+    def __init__(
+            self, callback=None, maxsize=0, policy='block', name='',
+            on_drop=None, exception=None, queue=None, memory_policy='drop',
+            **kwargs):
+        super(FrameSubscriber, self).__init__(**kwargs)
+        self.callback = callback
+        self.name = name
+        self.exception = exception
+        self.latency = LatencyHistogram()
+        if queue is None:
+            queue = FrameQueue(
+                maxsize=maxsize, policy=policy, on_drop=on_drop,
+                memory_policy=memory_policy, name=name)
+        self.queue = queue
+
+    @property
+    def delivered(self):
+        """The number of frames delivered to the subscriber.
+        """
+        return self.queue.delivered
+
+    @property
+    def dropped(self):
+        """The number of frames dropped because the subscriber was too slow.
+        """
+        return self.queue.dropped
+
+    @property
+    def high_water(self):
+        """The largest number of frames that were waiting in the queue.
+        """
+        return self.queue.high_water
+
+    def get_stats(self):
+        """Returns a dict with the name and statistics of the subscriber.
+        """
+        queue = self.queue
+        memory = queue.memory
+        return {
+            'name': self.name, 'policy': queue.policy,
+            'maxsize': queue.maxsize, 'queued': queue.qsize(),
+            'delivered': queue.delivered, 'dropped': queue.dropped,
+            'high_water': queue.high_water,
+            'memory_policy': memory.policy, 'queued_bytes': memory.nbytes,
+            'high_water_bytes': memory.high_water,
+            'memory_dropped': memory.dropped,
+            'latency': self.latency.summary()}
+
+    def start(self):
+        """Starts the delivery thread, if there's a callback.
+        """
+        if self.callback is None:
+            return
+
+        thread = self.thread = Thread(
+            target=self.delivery_run,
+            name='Frame delivery thread {}'.format(self.name))
+        thread.start()
+
+    def stop(self, join=False):
+        """Stops accepting frames and stops the delivery thread once it
+        delivered the remaining frames.
+
+        :param join: Whether to wait for the delivery thread to exit.
+        """
+        self.queue.put_eof()
+        if join and self.thread is not None:
+            self.thread.join()
+
+    def delivery_run(self):
+        """The method that runs in the delivery thread.
+        """
+        queue = self.queue
+        callback = self.callback
+        latency = self.latency
+        while True:
+            item = queue.get()
+            if item == 'eof':
+                break
+
+            try:
+                callback(item)
+            except Exception as e:
+                if self.exception is not None:
+                    self.exception(e)
+            else:
+                host_t = item[1].get('host_t')
+                if host_t is not None:
+                    latency.add(clock() - host_t)
+
+
 class BasePlayer(EventDispatcher, KivyMediaBase):
     """Base class for every player.
     """
 
-    _config_props_ = ('metadata_play', 'metadata_play_used')
+    _config_props_ = (
+        'metadata_play', 'metadata_play_used', 'display_max_fps',
+        'display_max_size', 'display_pix_fmt')
 
     display_frame = None
     """Called from kivy thread to display the frame whenever a new image
@@ -39,6 +1221,50 @@ class BasePlayer(EventDispatcher, KivyMediaBase):
     This callback takes two arguments: ``(image, metadata)``, where ``image``
     is the :class:`ffpyplayer.pic.Image`, and ``metadata`` is a dict with
     metadata.
+
+    If any of :attr:`display_max_fps`, :attr:`display_max_size`, or
+    :attr:`display_pix_fmt` is set, ``image`` is the preview image instead of
+    the original image. See :attr:`display_image`.
+    """
+
+    display_max_fps = NumericProperty(0)
+    """The maximum rate at which new frames are passed to
+    :attr:`display_frame`. Zero means no limit.
+
+    It's read when the player starts playing.
+    """
+
+    display_max_size = ListProperty([0, 0])
+    """The maximum ``[width, height]`` of the image passed to
+    :attr:`display_frame`. Larger images are downscaled, keeping their aspect
+    ratio. Zero means no limit in that dimension.
+
+    It's read when the player starts playing.
+    """
+
+    display_pix_fmt = StringProperty('')
+    """The pixel format to which the image passed to :attr:`display_frame` is
+    converted, e.g. ``'rgb24'`` to match the texture. If empty, the image's
+    pixel format is kept.
+
+    It's read when the player starts playing.
+    """
+
+    display_image = None
+    """The last preview :class:`ffpyplayer.pic.Image` to be displayed, when
+    a preview is used.
+
+    If any of :attr:`display_max_fps`, :attr:`display_max_size`, or
+    :attr:`display_pix_fmt` is set when the player starts playing, a
+    ``'display'`` :class:`FrameSubscriber` with the ``'latest'`` policy
+    scales and converts the frames with :attr:`sws_cache` in its own thread,
+    so that :attr:`display_frame` gets a ready to upload image and the kivy
+    thread doesn't convert the full size image. Otherwise, it's None and the
+    :attr:`last_image` is displayed.
+    """
+
+    display_image_metadata = {'t': 0}
+    """The metadata of :attr:`display_image`.
     """
 
     display_trigger = None
@@ -49,15 +1275,32 @@ class BasePlayer(EventDispatcher, KivyMediaBase):
     """A list of callbacks that are called from the internal thread whenever
     a new image is available.
 
+    These callbacks are called inline, so they delay the internal thread and
+    any subsequent callbacks. Slow consumers should instead use
+    :meth:`subscribe`.
+
     All the callbacks are called with a single tuple argument
     ``(image, metadata)``, where ``image`` is the
-    :class:`ffpyplayer.pic.Image`, and ``metadata`` is a dict with metadata.
+    :class:`ffpyplayer.pic.Image`, and ``metadata`` is a
+    :class:`FrameMetadata`, or a dict for players that create their own
+    metadata.
 
     It always contains at least the key ``'t'`` indicating the timestamp of the
-    image, but it may also contains other metadata keys specific to the player
+    image, ``'host_t'`` indicating the local
+    :func:`time.perf_counter` time when the image was acquired by the player,
+    which is used to measure the latencies (see :attr:`frame_latency`), and
+    ``'seq'``, the index of the frame since the player started playing.
+    It may also contains other metadata keys specific to the player
     such as ``'count'`` for the frame number, when sent by the camera.
     """
 
+    frame_subscribers = []
+    """The list of :class:`FrameSubscriber` added with :meth:`subscribe`.
+
+    The list is replaced rather than modified when subscribers are added or
+    removed, so it can be safely read from the internal thread.
+    """
+
     play_thread = None
     """The thread that plays the camera.
     """
@@ -80,6 +1323,8 @@ class BasePlayer(EventDispatcher, KivyMediaBase):
     """The metadata of the last image received by the camera.
     """
 
+    _frame_seq = 0
+
     use_real_time = False
     """Whether the video should use the current real time when we got the
     image, e.g. when the camera provided timestamp is not reliable.
@@ -104,7 +1349,28 @@ class BasePlayer(EventDispatcher, KivyMediaBase):
     '''
 
     real_rate = NumericProperty(0)
-    """The estimated real fps of the video source being played.
+    """The estimated real fps of the video source being played, as estimated
+    by :attr:`rate_estimator`.
+    """
+
+    frame_jitter = NumericProperty(0)
+    """The estimated standard deviation, in seconds, of the intervals between
+    frames, as estimated by :attr:`rate_estimator`.
+    """
+
+    frames_dropped_source = NumericProperty(0)
+    """The number of frames that were dropped by the source since :meth:`play`
+    was called, as detected by :attr:`rate_estimator` from gaps in the frame
+    ``count`` or timestamps.
+    """
+
+    rate_estimator: FrameRateEstimator = None
+    """The :class:`FrameRateEstimator` used to compute :attr:`real_rate`,
+    :attr:`frame_jitter`, and :attr:`frames_dropped_source` from the frames
+    passed to :meth:`process_frame`. It is reset by :meth:`play`.
+
+    It can be replaced by an estimator with different settings while not
+    playing.
     """
 
     frames_played = NumericProperty(0)
@@ -124,15 +1390,55 @@ class BasePlayer(EventDispatcher, KivyMediaBase):
     """The estimated rate in B/s at which the camera is playing.
     """
 
+    frame_pool: FrameBufferPool = None
+    """The :class:`FrameBufferPool` from which the player allocates the plane
+    buffers of the images it plays, when it needs to allocate them.
+
+    It's cleared when the player stops playing.
+    """
+
+    latency_histograms = {}
+    """A dict of :class:`~cpl_media.common.LatencyHistogram`, measuring the
+    latencies relative to when the frame was acquired (the metadata
+    ``'host_t'``).
+
+    ``'process'`` is the time until the frame reached :meth:`process_frame`
+    and ``'display'`` is the time until it was displayed in the kivy thread.
+
+    They are reset by :meth:`play`.
+    """
+
+    frame_latency = DictProperty({})
+    """A dict with the :meth:`~cpl_media.common.LatencyHistogram.summary` of
+    each of the :attr:`latency_histograms`. It's periodically updated while
+    playing.
+
+    Read only.
+    """
+
+    _latency_trigger = None
+
+    _display_subscriber = None
+
+    _display_last_t = None
+
     def __init__(self, **kwargs):
         self.frame_callbacks = []
+        self.frame_subscribers = []
+        self.frame_pool = FrameBufferPool()
+        self.rate_estimator = FrameRateEstimator()
+        self.latency_histograms = {
+            'process': LatencyHistogram(), 'display': LatencyHistogram()}
         self.metadata_play = VideoMetadata(
             *kwargs.pop('metadata_play', ('', 0, 0, 0)))
         self.metadata_play_used = VideoMetadata(
             *kwargs.pop('metadata_play_used', ('', 0, 0, 0)))
 
         super(BasePlayer, self).__init__(**kwargs)
+        self.add_thread_timers('play')
         self.display_trigger = Clock.create_trigger(self._display_frame, 0)
+        self._latency_trigger = Clock.create_trigger(
+            self._update_frame_latency, .5, True)
 
         self.fbind('metadata_play', self._update_data_rate)
         self.fbind('metadata_play_used', self._update_data_rate)
@@ -148,23 +1454,383 @@ class BasePlayer(EventDispatcher, KivyMediaBase):
         else:
             self.data_rate = sum(get_image_size(fmt, w, h)) * rate
 
+    def _update_frame_latency(self, *largs):
+        self.frame_latency = {
+            name: hist.summary()
+            for name, hist in self.latency_histograms.items()}
+
     def _display_frame(self, *largs):
         if self.display_frame is not None:
-            self.display_frame(self.last_image, self.last_image_metadata)
+            if self._display_subscriber is not None:
+                image = self.display_image
+                metadata = self.display_image_metadata
+            else:
+                image = self.last_image
+                metadata = self.last_image_metadata
+            if image is None:
+                return
+            self.display_frame(image, metadata)
+
+            host_t = metadata.get('host_t')
+            if host_t is not None:
+                self.latency_histograms['display'].add(clock() - host_t)
+
+    def get_latency_snapshot(self):
+        """Returns a dict with the current
+        :meth:`~cpl_media.common.LatencyHistogram.summary` of each of the
+        :attr:`latency_histograms`, as well as a ``'subscribers'`` dict mapping
+        the name of each of the :attr:`frame_subscribers` to the summary of its
+        :attr:`FrameSubscriber.latency`.
+
+        Unlike :attr:`frame_latency`, it is computed when called.
+        """
+        snapshot = {
+            name: hist.summary()
+            for name, hist in self.latency_histograms.items()}
+        snapshot['subscribers'] = {
+            s.name: s.latency.summary() for s in self.frame_subscribers}
+        return snapshot
 
     def process_frame(self, frame, metadata):
         """Called from internal thread to process a new image frame received.
 
         :param frame: The :class:`ffpyplayer.pic.Image`.
         :param metadata: The metadata of the image. See
-            :attr:`frame_callbacks`.
+            :attr:`frame_callbacks`. If it doesn't have a ``'host_t'`` key,
+            it's set to the current time. If it doesn't have a ``'seq'`` key,
+            it's set to the index of the frame.
+
+        It also updates :attr:`frames_played` and the :attr:`rate_estimator`
+        statistics, so players should not update them directly.
         """
+        host_t = metadata.get('host_t')
+        if host_t is None:
+            host_t = metadata['host_t'] = clock()
+        else:
+            self.latency_histograms['process'].add(clock() - host_t)
+        if metadata.get('seq') is None:
+            metadata['seq'] = self._frame_seq
+        self._frame_seq += 1
+
+        estimator = self.rate_estimator
+        dropped = estimator.add(
+            host_t, metadata.get('t'), metadata.get('count'))
+        self.set_stats_in_kivy_thread(
+            real_rate=estimator.rate, frame_jitter=estimator.jitter)
+        self.increment_stat_in_kivy_thread('frames_played')
+        if dropped:
+            self.increment_stat_in_kivy_thread(
+                'frames_dropped_source', dropped)
+
         self.last_image = frame
         self.last_image_metadata = metadata
         for callback in self.frame_callbacks:
             callback((frame, metadata))
+        for subscriber in self.frame_subscribers:
+            subscriber.queue.put((frame, metadata))
+        if self._display_subscriber is None:
+            self.display_trigger()
+
+    def _start_display_preview(self):
+        """Subscribes the preview subscriber if any of the display options are
+        set. See :attr:`display_image`.
+        """
+        self.display_image = None
+        self.display_image_metadata = {'t': 0}
+        max_w, max_h = self.display_max_size
+        if not self.display_max_fps and not max_w and not max_h and \
+                not self.display_pix_fmt:
+            return
+
+        self._display_last_t = None
+        self._display_subscriber = self.subscribe(
+            callback=partial(
+                self._preview_frame, self.display_max_fps, max_w, max_h,
+                self.display_pix_fmt),
+            policy='latest', name='display')
+
+    def _stop_display_preview(self):
+        subscriber = self._display_subscriber
+        if subscriber is not None:
+            self._display_subscriber = None
+            self.unsubscribe(subscriber)
+
+    def _preview_frame(self, max_fps, max_w, max_h, pix_fmt, item):
+        """Called from the preview subscriber's thread to create the
+        :attr:`display_image` from the frame.
+        """
+        image, metadata = item
+        if max_fps:
+            t = clock()
+            last_t = self._display_last_t
+            if last_t is not None and t - last_t < 1 / max_fps:
+                return
+            self._display_last_t = t
+
+        iw, ih = image.get_size()
+        scale = 1
+        if max_w and iw > max_w:
+            scale = max_w / iw
+        if max_h and ih > max_h:
+            scale = min(scale, max_h / ih)
+        ow = max(int(iw * scale), 1)
+        oh = max(int(ih * scale), 1)
+
+        self.display_image = sws_cache.scale(image, ow, oh, pix_fmt)
+        self.display_image_metadata = metadata
         self.display_trigger()
 
+    def subscribe(
+            self, callback=None, maxsize=0, policy='block', name='',
+            on_drop=None, queue=None, memory_policy='drop'):
+        """Adds a :class:`FrameSubscriber` that receives every new frame
+        through its own bounded :class:`FrameQueue`.
+
+        Unlike :attr:`frame_callbacks`, the frames are delivered to the
+        callback from the subscriber's own thread, so a slow subscriber does
+        not delay the player.
+
+        :param callback: If not None, a callback that is called from the
+            subscriber's delivery thread with the ``(image, metadata)`` tuple
+            (see :attr:`frame_callbacks`). If None, the consumer is responsible
+            for reading the frames from :attr:`FrameSubscriber.queue`.
+        :param maxsize: The maximum number of frames waiting to be delivered.
+            Zero means unbounded.
+        :param policy: What to do when the queue is full. One of
+            :attr:`FrameQueue.policies`.
+        :param name: A name describing the subscriber.
+        :param on_drop: A callback called from the internal thread with the
+            dropped frame whenever a frame is dropped.
+        :param queue: An optional :class:`FrameQueue` to use, instead of
+            creating one from ``maxsize``, ``policy``, ``on_drop``, and
+            ``memory_policy``.
+        :param memory_policy: What to do with new frames when the
+            :class:`~cpl_media.memory.MemoryGovernor` is over budget. One of
+            :attr:`~cpl_media.memory.MemoryAccount.policies`.
+        :return: The :class:`FrameSubscriber`. Pass it to :meth:`unsubscribe`
+            to stop receiving frames.
+        """
+        subscriber = FrameSubscriber(
+            callback=callback, maxsize=maxsize, policy=policy, name=name,
+            on_drop=on_drop, exception=self.exception, queue=queue,
+            memory_policy=memory_policy)
+        subscriber.start()
+        self.frame_subscribers = self.frame_subscribers + [subscriber]
+        return subscriber
+
+    async def aframes(
+            self, maxsize=8, policy='drop_oldest', name='aframes',
+            async_lib='asyncio'):
+        """Async generator that yields the ``(image, metadata)`` tuple (see
+        :attr:`frame_callbacks`) of every new frame, until the player stops.
+        E.g.::
+
+            async for image, metadata in player.aframes():
+                ...
+
+        The frames are buffered in a :class:`AsyncFrameQueue`, which the
+        internal thread fills without blocking. The iteration ends when
+        :attr:`play_state` becomes ``'none'``, or right away if the player is
+        already stopped. If the loop is exited early,
+        the generator should be closed with ``aclose()`` (e.g. using
+        ``contextlib.aclosing``) to stop receiving frames right away.
+
+        The subscription is made from the :attr:`~cpl_media.clock.Clock`
+        thread, so the clock must be running, e.g. in a Kivy app or with
+        :func:`~cpl_media.clock.set_headless`.
+
+        :param maxsize: The maximum number of frames waiting to be read.
+        :param policy: What to do when the queue is full. One of
+            :attr:`FrameQueue.policies`, except ``'block'``.
+        :param name: A name describing the subscriber.
+        :param async_lib: The async library of the event loop, either
+            ``'asyncio'`` or ``'trio'``.
+        """
+        queue = AsyncFrameQueue(
+            maxsize=maxsize, policy=policy, async_lib=async_lib, name=name)
+
+        def close_queue(*largs):
+            if self.play_state == 'none':
+                queue.put_eof()
+
+        def bind():
+            subscriber = self.subscribe(name=name, queue=queue)
+            uid = self.fbind('play_state', close_queue)
+            # the player may have stopped before it was subscribed to
+            close_queue()
+            return subscriber, uid
+
+        def unbind():
+            self.unbind_uid('play_state', uid)
+            self.unsubscribe(subscriber)
+
+        subscriber, uid = await _await_in_clock(async_lib, bind)
+        latency = subscriber.latency
+
+        try:
+            while True:
+                item = await queue.aget()
+                if item == 'eof':
+                    break
+
+                host_t = item[1].get('host_t')
+                if host_t is not None:
+                    latency.add(clock() - host_t)
+                yield item
+        finally:
+            call_in_clock(unbind)
+
+    def iter_frames(
+            self, timeout=None, max_frames=0, maxsize=8, policy='block',
+            name='iter_frames'):
+        """Generator that yields the ``(image, metadata)`` tuple (see
+        :attr:`frame_callbacks`) of every new frame, until the player stops,
+        e.g. at the end of a file. E.g.::
+
+            player = FFmpegPlayer(
+                play_filename='video.mp4', use_dshow=False, unthrottled=True)
+            for image, metadata in player.iter_frames(timeout=5):
+                ...
+
+        It's meant for scripts that don't run a Kivy app. If the player is not
+        playing, it is started, and it is stopped when the iteration ends.
+        While waiting, the :attr:`~cpl_media.clock.Clock` callbacks are
+        executed from the calling thread with
+        :func:`~cpl_media.clock.tick_clock`, unless the headless dispatcher
+        thread runs them. So it must not be called while a Kivy app is
+        running.
+
+        :param timeout: The maximum duration in seconds to wait for each
+            frame, or None to wait forever. :class:`TimeoutError` is raised if
+            it elapsed.
+        :param max_frames: If not zero, the iteration ends after this number of
+            frames.
+        :param maxsize: The maximum number of frames waiting to be read.
+        :param policy: What to do when the queue is full. One of
+            :attr:`FrameQueue.policies`. With the default ``'block'``, no frame
+            is dropped and the player is paced by the consumer.
+        :param name: A name describing the subscriber.
+        """
+        subscriber = self.subscribe(maxsize=maxsize, policy=policy, name=name)
+        queue = subscriber.queue
+        latency = subscriber.latency
+        started = False
+        # don't tick more often than the Kivy clock so it doesn't sleep
+        tick_interval = 1 / 30.
+        last_tick = clock()
+
+        try:
+            if self.play_state == 'none':
+                future = call_in_clock(self.play)
+                run_clock_until(future.done)
+                if not future.result():
+                    raise ValueError('Failed to start playing')
+                started = True
+
+            n = 0
+            while not max_frames or n < max_frames:
+                end = None if timeout is None else clock() + timeout
+                while True:
+                    now = clock()
+                    if now - last_tick >= tick_interval:
+                        tick_clock()
+                        last_tick = now
+
+                    wait = tick_interval
+                    if end is not None:
+                        if now >= end:
+                            raise TimeoutError(
+                                'No frame received in {}s'.format(timeout))
+                        wait = min(wait, end - now)
+
+                    try:
+                        item = queue.get(timeout=wait)
+                        break
+                    except Empty:
+                        if self.play_state == 'none' and not queue.qsize():
+                            return
+
+                host_t = item[1].get('host_t')
+                if host_t is not None:
+                    latency.add(clock() - host_t)
+                n += 1
+                yield item
+        finally:
+            self.unsubscribe(subscriber)
+            if started and self.play_state != 'none':
+                call_in_clock(self.stop)
+                run_clock_until(lambda: self.play_state == 'none')
+
+    async def _wait_play_state(self, f, states, async_lib):
+        """Calls ``f`` from the :attr:`~cpl_media.clock.Clock` thread and
+        waits until :attr:`play_state` is one of ``states``. Returns the
+        return value of ``f`` and that state.
+        """
+        waiter = _AsyncWaiter(async_lib)
+        state = []
+
+        def check_state(*largs):
+            if self.play_state in states and not state:
+                state.append(self.play_state)
+                waiter.wake()
+
+        def start():
+            res = f()
+            uid = self.fbind('play_state', check_state)
+            check_state()
+            return res, uid
+
+        res, uid = await _await_in_clock(async_lib, start)
+        try:
+            await waiter.wait()
+        finally:
+            call_in_clock(self.unbind_uid, 'play_state', uid)
+        return res, state[0]
+
+    async def aplay(self, async_lib='asyncio'):
+        """Like :meth:`play`, but waits until the player is ``'playing'``.
+
+        :meth:`play` is called from the :attr:`~cpl_media.clock.Clock` thread,
+        so the clock must be running, e.g. in a Kivy app or with
+        :func:`~cpl_media.clock.set_headless`.
+
+        :param async_lib: The async library of the event loop, either
+            ``'asyncio'`` or ``'trio'``.
+        :return: Whether the player is playing. False if it failed to start
+            or it was stopped before it started playing.
+        """
+        started, state = await self._wait_play_state(
+            self.play, ('playing', 'none'), async_lib)
+        return bool(started) and state == 'playing'
+
+    async def astop(self, async_lib='asyncio'):
+        """Like :meth:`stop`, but waits until the player's
+        :attr:`play_state` is ``'none'``. Like :meth:`aplay`, :meth:`stop` is
+        called from the :attr:`~cpl_media.clock.Clock` thread.
+
+        :param async_lib: The async library of the event loop, either
+            ``'asyncio'`` or ``'trio'``.
+        """
+        await self._wait_play_state(self.stop, ('none', ), async_lib)
+
+    def unsubscribe(self, subscriber, join=False):
+        """Removes the subscriber added with :meth:`subscribe`. It stops the
+        subscriber's delivery thread once it delivered the frames already in
+        its queue.
+
+        :param subscriber: The :class:`FrameSubscriber`.
+        :param join: Whether to wait for the delivery thread to exit.
+        """
+        self.frame_subscribers = [
+            s for s in self.frame_subscribers if s is not subscriber]
+        subscriber.stop(join=join)
+
+    def get_subscriber_stats(self):
+        """Returns a list with the :meth:`FrameSubscriber.get_stats` dict of
+        each of the :attr:`frame_subscribers`.
+        """
+        return [s.get_stats() for s in self.frame_subscribers]
+
     def get_config_property(self, name):
         """(internal) used by the config system to get the special config data
         of the player.
@@ -204,8 +1870,15 @@ class BasePlayer(EventDispatcher, KivyMediaBase):
                 'Asked to play while {} or disabled'.format(self.play_state))
 
         self.play_state = 'starting'
-        self.ts_play = self.real_rate = 0.
-        self.frames_played = 0
+        self.kivy_thread_stats.clear()
+        for hist in self.latency_histograms.values():
+            hist.reset()
+        self.frame_latency = {}
+        self.ts_play = self.real_rate = self.frame_jitter = 0.
+        self.frames_played = self.frames_dropped_source = 0
+        self._frame_seq = 0
+        self.rate_estimator.reset()
+        self._start_display_preview()
         self._start_play_thread()
         return True
 
@@ -271,6 +1944,7 @@ class BasePlayer(EventDispatcher, KivyMediaBase):
         assert self.play_state != 'playing'
         if self.play_state == 'starting':  # not stopping
             self.play_state = 'playing'
+            self._latency_trigger()
 
     def complete_stop(self, *largs):
         """After :meth:`stop`, this is called to set the player into `none`
@@ -283,6 +1957,10 @@ class BasePlayer(EventDispatcher, KivyMediaBase):
 
         self.play_thread = None
         self.play_state = 'none'
+        self.frame_pool.clear()
+        self._stop_display_preview()
+        self._latency_trigger.cancel()
+        self._update_frame_latency()
 
     def play_thread_run(self):
         """The method that runs in the internal play thread.
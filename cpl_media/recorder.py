@@ -3,36 +3,440 @@
 
 Provides the base class for video recorders.
 """
-from threading import Thread
+import os
+import struct
+import logging
+import tempfile
+from collections import deque
+from threading import Thread, Lock
 from fractions import Fraction
 from time import perf_counter as clock
-from queue import Queue
-from os.path import expanduser, join, exists, isdir, abspath, dirname
+from os.path import expanduser, join, exists, isdir, abspath, splitext
 
-from ffpyplayer.pic import get_image_size, Image, SWScale
+from ffpyplayer.pic import get_image_size, Image
 from ffpyplayer.tools import get_supported_pixfmts, get_format_codec
 from ffpyplayer.writer import MediaWriter
 
-from kivy.clock import Clock
+from .clock import Clock
 from kivy.properties import (
-    NumericProperty, ObjectProperty, StringProperty, BooleanProperty)
+    NumericProperty, ObjectProperty, StringProperty, BooleanProperty,
+    DictProperty)
 from kivy.event import EventDispatcher
-from kivy.uix.boxlayout import BoxLayout
-from kivy.lang import Builder
 
-from .player import VideoMetadata, BasePlayer
+from .player import VideoMetadata, BasePlayer, FrameSubscriber, \
+    FrameQueue, sws_cache
 from cpl_media import error_guard
-from .common import KivyMediaBase
+from .common import KivyMediaBase, LatencyHistogram, lazy_module_getattr
+from .memory import get_frame_nbytes
+
+__all__ = (
+    'BaseRecorder', 'ImageFileRecorder', 'VideoRecorder', 'SpillFrameQueue',
+    'TimestampSidecar', 'timestamp_dtype', 'load_timestamps')
+
+timestamp_dtype = [
+    ('index', '<u8'), ('t', '<f8'), ('count', '<i8'), ('host_t', '<f8'),
+    ('offset', '<u8')]
+"""The numpy dtype description of the rows of a :class:`TimestampSidecar`.
+Each row is a recorded frame with its index in the recording, the device
+``'t'``, the ``'count'`` and ``'host_t'`` of its metadata and the
+:attr:`~BaseRecorder.size_recorded` before the frame was recorded, i.e. its
+byte offset in the recorded data.
+
+Missing times are NaN and a missing count is -1.
+"""
+
+_timestamp_row = struct.Struct('<QdqdQ')
+
+_npy_header_size = 256
+
+
+def load_timestamps(filename, mmap=True):
+    """Loads the :class:`TimestampSidecar` file of a recording as a numpy
+    structured array with the :attr:`timestamp_dtype` fields. Requires numpy.
+    E.g.::
+
+        ts = load_timestamps('video0_timestamps.npy')
+        i = np.searchsorted(ts['t'], 12.5)
+        print(ts['count'][i], ts['offset'][i])
+
+    :param filename: The sidecar filename.
+    :param mmap: Whether to memory map the file rather than read it.
+    """
+    import numpy as np
+    return np.load(filename, mmap_mode='r' if mmap else None)
+
+
+class TimestampSidecar(object):
+    """Writes the timestamps of the recorded frames to a ``.npy`` file, that
+    can be read or memory mapped with :func:`load_timestamps` or
+    :func:`numpy.load` as a structured array of :attr:`timestamp_dtype`.
+
+    Rows are added by the recording thread with :meth:`add` and written to the
+    file in batches. The header is updated with the number of rows after each
+    batch, so the file is readable even if recording stopped unexpectedly.
+    Writing doesn't require numpy.
+    """
+
+    filename = ''
+    """The filename of the sidecar.
+    """
+
+    batch_size = 256
+    """The number of rows buffered before they are written to the file.
+    """
+
+    rows = 0
+    """The number of rows written to the file so far.
+    """
+
+    _file = None
+
+    _buffer = None
+
+    _buffered = 0
+
+    def __init__(self, filename, batch_size=256, **kwargs):
+        super(TimestampSidecar, self).__init__(**kwargs)
+        self.filename = filename
+        self.batch_size = batch_size
+        self._buffer = bytearray()
+        self._file = open(filename, 'wb')
+        self._file.write(self._header(0))
+
+    @staticmethod
+    def _header(rows):
+        header = "{{'descr': {!r}, 'fortran_order': False, 'shape': ({},), }}"
+        header = header.format(timestamp_dtype, rows).encode('latin1')
+        # a fixed size, so it can be rewritten in place as rows are added
+        n = _npy_header_size - 10
+        return b'\x93NUMPY\x01\x00' + struct.pack('<H', n) + \
+            header.ljust(n - 1) + b'\n'
+
+    def add(self, index, metadata, offset):
+        """Adds the row of a recorded frame.
+
+        :param index: The index of the frame in the recording.
+        :param metadata: The frame metadata.
+        :param offset: The byte offset of the frame in the recording.
+        """
+        t = metadata.get('t')
+        count = metadata.get('count')
+        host_t = metadata.get('host_t')
+        self._buffer += _timestamp_row.pack(
+            index, float('nan') if t is None else t,
+            -1 if count is None else count,
+            float('nan') if host_t is None else host_t, offset)
+        self._buffered += 1
+        if self._buffered >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Writes the buffered rows to the file and updates its header.
+        """
+        if not self._buffered:
+            return
+
+        f = self._file
+        f.write(self._buffer)
+        self.rows += self._buffered
+        self._buffer = bytearray()
+        self._buffered = 0
+
+        f.seek(0)
+        f.write(self._header(self.rows))
+        f.seek(0, os.SEEK_END)
+        f.flush()
+
+    def close(self):
+        """Writes the remaining rows and closes the file.
+        """
+        if self._file is None:
+            return
+        self.flush()
+        self._file.close()
+        self._file = None
+
+
+class _SpilledFrame(object):
+    """A frame of a :class:`SpillFrameQueue` whose planes are in the scratch
+    file.
+
+    The frame is also the region of the file holding its planes, starting at
+    ``offset``. ``freed`` is set once the planes are no longer needed, so the
+    region can be reused.
+    """
+
+    __slots__ = (
+        'offset', 'nbytes', 'sizes', 'pix_fmt', 'size', 'linesizes',
+        'metadata', 'freed')
+
+    def __init__(self, sizes, pix_fmt, size, linesizes, metadata):
+        self.offset = None
+        self.sizes = sizes
+        self.nbytes = sum(sizes)
+        self.pix_fmt = pix_fmt
+        self.size = size
+        self.linesizes = linesizes
+        self.metadata = metadata
+        self.freed = False
+
+
+class SpillFrameQueue(FrameQueue):
+    """A :class:`~cpl_media.player.FrameQueue` that writes the frames to a
+    scratch file, instead of keeping them in memory, once
+    :attr:`spill_threshold` frames are waiting in memory or the
+    :class:`~cpl_media.memory.MemoryGovernor` is over budget.
+
+    The scratch file is preallocated with :attr:`spill_size` bytes when the
+    queue is created and is used as a ring buffer. Frames are read back from
+    it by :meth:`get` in the order they were added, so the consumer sees the
+    same frames as with a :class:`~cpl_media.player.FrameQueue`. Once the file
+    is full, new frames are kept in memory, subject to the queue's
+    :attr:`~cpl_media.player.FrameQueue.policy` and memory policy.
+
+    The file is deleted by :meth:`close`, which is called when :meth:`get`
+    returns ``'eof'``.
+    """
+
+    spill_threshold = 8
+    """The number of frames waiting in memory beyond which new frames are
+    written to the scratch file.
+    """
+
+    spill_size = 0
+    """The size in bytes of the scratch file.
+    """
+
+    filename = ''
+    """The path of the scratch file.
+    """
+
+    spilled = 0
+    """The number of frames that were written to the scratch file.
+    """
+
+    recovered = 0
+    """The number of frames that were read back from the scratch file.
+    """
+
+    spill_high_water = 0
+    """The largest number of bytes used in the scratch file at once.
+    """
+
+    on_spill = None
+    """If not None, a callback that is called with the frame whenever a frame
+    is written to the scratch file. It's called from the thread that called
+    :meth:`put`.
+    """
+
+    on_recover = None
+    """If not None, a callback that is called with the frame whenever a frame
+    is read back from the scratch file. It's called from the thread that
+    called :meth:`get`.
+    """
+
+    _file = None
+
+    _file_lock = None
+
+    _spill_lock = None
+
+    _regions = None
+
+    _n_spilled = 0
+
+    _user_on_drop = None
+
+    def __init__(
+            self, spill_threshold=8, spill_size=1024 ** 3,
+            spill_directory='', on_spill=None, on_recover=None, **kwargs):
+        self._user_on_drop = kwargs.pop('on_drop', None)
+        super(SpillFrameQueue, self).__init__(
+            on_drop=self._drop_frame, **kwargs)
+        self.spill_threshold = spill_threshold
+        self.spill_size = spill_size
+        self.on_spill = on_spill
+        self.on_recover = on_recover
+        self._file_lock = Lock()
+        self._spill_lock = Lock()
+        self._regions = deque()
+
+        fd, filename = tempfile.mkstemp(
+            prefix='cpl_media_spill_', suffix='.bin',
+            dir=spill_directory or None)
+        try:
+            try:
+                os.posix_fallocate(fd, 0, spill_size)
+            except (AttributeError, OSError):
+                # not supported by the platform or file system
+                os.ftruncate(fd, spill_size)
+            self._file = os.fdopen(fd, 'r+b', buffering=0)
+        except BaseException:
+            os.close(fd)
+            os.remove(filename)
+            raise
+        self.filename = filename
+
+    @property
+    def spilled_queued(self):
+        """The number of frames waiting in the scratch file.
+        """
+        return self._n_spilled
+
+    def _drop_frame(self, item):
+        if isinstance(item, _SpilledFrame):
+            self._free_region(item)
+            item = None, item.metadata
+        if self._user_on_drop is not None:
+            self._user_on_drop(item)
+
+    def _allocate_region(self, frame):
+        """Sets the offset in the file where to write the frame and returns
+        it, or returns None if there's not enough space. Must be called with
+        the queue lock.
+        """
+        size = self.spill_size
+        nbytes = frame.nbytes
+        regions = self._regions
+        if not regions:
+            offset = 0 if nbytes <= size else None
+        else:
+            head = regions[0].offset
+            last = regions[-1].offset
+            tail = last + regions[-1].nbytes
+            if last >= head:
+                if tail + nbytes <= size:
+                    offset = tail
+                elif nbytes <= head:
+                    offset = 0
+                else:
+                    offset = None
+            else:
+                offset = tail if tail + nbytes <= head else None
+
+        if offset is not None:
+            frame.offset = offset
+            regions.append(frame)
+            used = offset + nbytes - regions[0].offset
+            if used <= 0:
+                used += size
+            if used > self.spill_high_water:
+                self.spill_high_water = used
+        return offset
+
+    def _release_region(self, frame):
+        """Marks the region of the frame as free. The space is only reused
+        once all the regions before it, or after it, are also free. Must be
+        called with the queue lock.
+        """
+        frame.freed = True
+        regions = self._regions
+        while regions and regions[0].freed:
+            regions.popleft()
+        while regions and regions[-1].freed:
+            regions.pop()
+
+    def _free_region(self, frame):
+        with self._not_full:
+            self._release_region(frame)
+            self._n_spilled -= 1
+
+    def put(self, item):
+        image, metadata = item
+        with self._not_full:
+            maxsize = self.maxsize
+            spill = not self._closed and \
+                (not maxsize or len(self._items) < maxsize) and (
+                    len(self._items) - self._n_spilled >=
+                    self.spill_threshold or
+                    self.memory.exceeds_budget(get_frame_nbytes(item)))
+        if not spill:
+            return super(SpillFrameQueue, self).put(item)
+
+        planes = [
+            plane for plane in image.to_memoryview(keep_align=True)
+            if plane is not None]
+        sizes = [len(plane) for plane in planes]
+        # only one thread writes to the file at a time, so the frames are
+        # added in the order of their regions
+        frame = _SpilledFrame(
+            sizes, image.get_pixel_format(), image.get_size(),
+            image.get_linesizes(keep_align=True), metadata)
+        with self._spill_lock:
+            with self._not_full:
+                offset = self._allocate_region(frame)
+            if offset is None:
+                return super(SpillFrameQueue, self).put(item)
+
+            with self._file_lock:
+                self._file.seek(offset)
+                for plane in planes:
+                    self._file.write(plane)
+
+            with self._not_full:
+                if self._closed:
+                    self._release_region(frame)
+                    return False
+
+                items = self._items
+                items.append(frame)
+                self._n_spilled += 1
+                self.spilled += 1
+                if len(items) > self.high_water:
+                    self.high_water = len(items)
+                self._not_empty.notify()
+
+        if self.on_spill is not None:
+            self.on_spill(item)
+        return True
 
-__all__ = ('BaseRecorder', 'ImageFileRecorder', 'VideoRecorder',
-           'ImageFileRecordSettingsWidget', 'VideoRecordSettingsWidget')
+    def get(self, block=True, timeout=None):
+        item = super(SpillFrameQueue, self).get(block=block, timeout=timeout)
+        if isinstance(item, _SpilledFrame):
+            return self._recover_frame(item)
+        if isinstance(item, str) and item == 'eof':
+            self.close()
+        return item
+
+    def _recover_frame(self, frame):
+        planes = [bytearray(n) for n in frame.sizes]
+        with self._file_lock:
+            self._file.seek(frame.offset)
+            for plane in planes:
+                self._file.readinto(plane)
+        # only now that it was read can the region be overwritten
+        self._free_region(frame)
+
+        image = Image(
+            plane_buffers=planes, pix_fmt=frame.pix_fmt, size=frame.size,
+            linesize=frame.linesizes)
+        item = image, frame.metadata
+        self.recovered += 1
+        if self.on_recover is not None:
+            self.on_recover(item)
+        return item
+
+    def close(self):
+        """Closes and deletes the scratch file. Frames still in the file are
+        lost.
+        """
+        with self._file_lock:
+            if self._file is None:
+                return
+            self._file.close()
+            self._file = None
+        os.remove(self.filename)
 
 
 class BaseRecorder(EventDispatcher, KivyMediaBase):
     """Records images from :class:cpl_media.player.BasePlayer` to a recorder.
     """
 
-    _config_props_ = ('metadata_record', 'requested_record_duration')
+    _config_props_ = (
+        'metadata_record', 'requested_record_duration', 'image_queue_size',
+        'image_queue_policy', 'image_queue_memory_policy',
+        'image_queue_spill_threshold', 'image_queue_spill_size',
+        'image_queue_spill_directory', 'record_timestamps')
 
     player: BasePlayer = None
     """The :class:cpl_media.player.BasePlayer` this is being recorded from.
@@ -59,7 +463,79 @@ class BaseRecorder(EventDispatcher, KivyMediaBase):
     '''
 
     image_queue = None
-    """The queue used to communicate with the internal recording thread.
+    """The :class:`~cpl_media.player.FrameQueue` of :attr:`frame_subscriber`,
+    used to communicate with the internal recording thread.
+    """
+
+    frame_subscriber: FrameSubscriber = None
+    """The :class:`~cpl_media.player.FrameSubscriber` through which we
+    receive the frames from the :attr:`player` while recording.
+    """
+
+    image_queue_size = NumericProperty(0)
+    """The maximum number of frames that may be waiting in
+    :attr:`image_queue` to be recorded. Zero means unbounded.
+    """
+
+    image_queue_policy = StringProperty('block')
+    """What to do when :attr:`image_queue` is full. Can be one of
+    :attr:`cpl_media.player.FrameQueue.policies`.
+
+    Dropped frames are counted in :attr:`frames_skipped`.
+    """
+
+    image_queue_memory_policy = StringProperty('block')
+    """What to do with new frames when the
+    :attr:`~cpl_media.memory.memory_governor` is over its budget. Can be one
+    of :attr:`cpl_media.memory.MemoryAccount.policies`.
+
+    Dropped frames are counted in :attr:`frames_skipped`.
+    """
+
+    image_queue_spill_threshold = NumericProperty(0)
+    """If non-zero, :attr:`image_queue` is a :class:`SpillFrameQueue` and
+    once this many frames are waiting in memory to be recorded, or the memory
+    governor is over budget, new frames are written to a scratch file until
+    the recorder catches up, instead of growing the memory, blocking, or
+    dropping frames.
+
+    Spilled frames are counted in :attr:`frames_spilled` and
+    :attr:`frames_recovered`.
+    """
+
+    image_queue_spill_size = NumericProperty(1024 ** 3)
+    """The size in bytes of the scratch file preallocated when recording with
+    :attr:`image_queue_spill_threshold`. Once it's full, frames are queued in
+    memory.
+    """
+
+    image_queue_spill_directory = StringProperty('')
+    """The directory of the scratch file used with
+    :attr:`image_queue_spill_threshold`, ideally on a fast local drive other
+    than the one recorded to. If empty, the system's temporary directory is
+    used.
+    """
+
+    frames_spilled = NumericProperty(0)
+    """The number of frames written to the scratch file since :meth:`record`.
+    See :attr:`image_queue_spill_threshold`.
+    """
+
+    frames_recovered = NumericProperty(0)
+    """The number of frames read back from the scratch file to be recorded
+    since :meth:`record`.
+    """
+
+    record_timestamps = BooleanProperty(True)
+    """Whether to write the timestamps of the recorded frames to a
+    :class:`TimestampSidecar` file next to the recording.
+    """
+
+    timestamps_filename = StringProperty('')
+    """The filename of the :class:`TimestampSidecar` of the current or last
+    recording, or empty if there's none.
+
+    Read only.
     """
 
     can_record = BooleanProperty(True)
@@ -132,8 +608,26 @@ class BaseRecorder(EventDispatcher, KivyMediaBase):
     """The frame time of the device of the last recorded frame.
     """
 
+    latency_histogram: LatencyHistogram = None
+    """The :class:`~cpl_media.common.LatencyHistogram` of the time from when
+    the frame was acquired by the player (the metadata ``'host_t'``) until it
+    was recorded.
+
+    It is also the :attr:`~cpl_media.player.FrameSubscriber.latency` of the
+    recorder's subscription to the player. It's reset by :meth:`record`.
+    """
+
+    record_latency = DictProperty({})
+    """The :meth:`~cpl_media.common.LatencyHistogram.summary` of
+    :attr:`latency_histogram`. It's periodically updated while recording.
+
+    Read only.
+    """
+
     _elapsed_record_trigger = None
 
+    _timestamp_sidecar = None
+
     def __init__(self, **kwargs):
         self.metadata_record_used = VideoMetadata('', 0, 0, 0)
         self.metadata_player = VideoMetadata(
@@ -141,6 +635,8 @@ class BaseRecorder(EventDispatcher, KivyMediaBase):
         self.metadata_record = VideoMetadata(
             *kwargs.pop('metadata_record', ('', 0, 0, 0)))
         super(BaseRecorder, self).__init__(**kwargs)
+        self.latency_histogram = LatencyHistogram()
+        self.add_thread_timers('record')
 
         self._elapsed_record_trigger = Clock.create_trigger(
             self._update_elapsed_record, .2, True)
@@ -158,6 +654,24 @@ class BaseRecorder(EventDispatcher, KivyMediaBase):
                 self.elapsed_record_time = max(d - (clock() - ts), 0)
             else:
                 self.elapsed_record_time = clock() - ts
+        self.record_latency = self.latency_histogram.summary()
+
+    def add_record_latency(self, metadata):
+        """Adds the latency of the frame, from when it was acquired until now,
+        to :attr:`latency_histogram`. Called from the internal thread after
+        the frame was recorded.
+
+        :param metadata: The metadata of the frame.
+        """
+        host_t = metadata.get('host_t')
+        if host_t is not None:
+            self.latency_histogram.add(clock() - host_t)
+
+    def get_latency_snapshot(self):
+        """Returns the current summary of :attr:`latency_histogram`. Unlike
+        :attr:`record_latency`, it is computed when called.
+        """
+        return self.latency_histogram.summary()
 
     def _update_data_rate(self, *largs):
         fmt = self.metadata_record_used.fmt
@@ -219,8 +733,7 @@ class BaseRecorder(EventDispatcher, KivyMediaBase):
         else:
             ofmt = get_supported_pixfmts(codec, pix_fmt or fmt)[0]
         if ofmt != fmt:
-            sws = SWScale(w, h, fmt, ofmt=ofmt)
-            img = sws.scale(img)
+            img = sws_cache.scale(img, ofmt=ofmt)
             fmt = ofmt
 
         out_opts = {'pix_fmt_in': fmt, 'width_in': w, 'height_in': h,
@@ -255,13 +768,66 @@ class BaseRecorder(EventDispatcher, KivyMediaBase):
 
         self.record_state = 'starting'
         self.player = player
+        self.kivy_thread_stats.clear()
         self.size_recorded = self.ts_record = 0
         self.frames_recorded = self.frames_skipped = 0
+        self.frames_spilled = self.frames_recovered = 0
+        self.timestamps_filename = ''
         self.frame_ts_record = 0
+        self.latency_histogram.reset()
+        self.record_latency = {}
         self.metadata_player = player.metadata_play_used
-        self.image_queue = Queue()
+        subscriber = self.frame_subscriber = self.subscribe_to_player(player)
+        subscriber.latency = self.latency_histogram
+        self.image_queue = subscriber.queue
         self._start_recording()
 
+    def subscribe_to_player(self, player: BasePlayer) -> FrameSubscriber:
+        """Subscribes to the player's frames with
+        :meth:`cpl_media.player.BasePlayer.subscribe` when we start recording.
+        The frames are read by the internal thread from the queue of the
+        returned subscriber.
+        """
+        if not self.image_queue_spill_threshold:
+            return player.subscribe(
+                maxsize=self.image_queue_size, policy=self.image_queue_policy,
+                name=self.recorder_summery, on_drop=self._drop_frame,
+                memory_policy=self.image_queue_memory_policy)
+
+        queue = SpillFrameQueue(
+            maxsize=self.image_queue_size, policy=self.image_queue_policy,
+            name=self.recorder_summery, on_drop=self._drop_frame,
+            memory_policy=self.image_queue_memory_policy,
+            spill_threshold=self.image_queue_spill_threshold,
+            spill_size=int(self.image_queue_spill_size),
+            spill_directory=self.image_queue_spill_directory,
+            on_spill=self._spill_frame, on_recover=self._recover_frame)
+        return player.subscribe(name=self.recorder_summery, queue=queue)
+
+    def open_timestamp_sidecar(self, filename):
+        """Creates the :class:`TimestampSidecar` of the recording if
+        :attr:`record_timestamps`. Called from the internal thread when it
+        starts recording. The sidecar is closed by :meth:`complete_stop`.
+
+        :param filename: The filename of the sidecar.
+        :return: The :class:`TimestampSidecar`, or None.
+        """
+        if not self.record_timestamps:
+            return None
+
+        sidecar = self._timestamp_sidecar = TimestampSidecar(filename)
+        self.setattr_in_kivy_thread('timestamps_filename', filename)
+        return sidecar
+
+    def _drop_frame(self, item):
+        self.increment_stat_in_kivy_thread('frames_skipped')
+
+    def _spill_frame(self, item):
+        self.increment_stat_in_kivy_thread('frames_spilled')
+
+    def _recover_frame(self, item):
+        self.increment_stat_in_kivy_thread('frames_recovered')
+
     def _start_recording(self):
         thread = self.record_thread = Thread(
             target=self.record_thread_run, name='Record thread')
@@ -292,7 +858,7 @@ class BaseRecorder(EventDispatcher, KivyMediaBase):
                 self.record_thread.join()
             return False
 
-        self.image_queue.put('eof')
+        self.player.unsubscribe(self.frame_subscriber)
         self.record_state = 'stopping'
         self._elapsed_record_trigger.cancel()
         if join:
@@ -319,9 +885,23 @@ class BaseRecorder(EventDispatcher, KivyMediaBase):
         """
         assert self.record_state != 'none'
 
+        if self.frame_subscriber in self.player.frame_subscribers:
+            self.player.unsubscribe(self.frame_subscriber)
+        if isinstance(self.image_queue, SpillFrameQueue):
+            # in case the thread exited before reading the remaining frames
+            self.image_queue.close()
+
+        sidecar, self._timestamp_sidecar = self._timestamp_sidecar, None
+        if sidecar is not None:
+            try:
+                sidecar.close()
+            except Exception as e:
+                self.exception(e)
+
         self.record_thread = None
-        self.image_queue = None
+        self.image_queue = self.frame_subscriber = None
         self.record_state = 'none'
+        self.record_latency = self.latency_histogram.summary()
 
     def record_thread_run(self, *largs):
         """The method that runs in the internal record thread.
@@ -335,6 +915,11 @@ class BaseRecorder(EventDispatcher, KivyMediaBase):
 
 class ImageFileRecorder(BaseRecorder):
     """Records images as files to disk.
+
+    The timestamps of the images are also written to the
+    :class:`TimestampSidecar` ``{record_prefix}timestamps.npy``, if
+    :attr:`~BaseRecorder.record_timestamps`. An image's filename contains its
+    ``t`` relative to the ``t`` of the first image.
     """
 
     _config_props_ = (
@@ -372,6 +957,9 @@ class ImageFileRecorder(BaseRecorder):
     def send_image_to_recorder(self, image):
         """Sends the image to the recorder queue to save the image.
 
+        Frames from the player are already added to the queue while recording,
+        so this only needs to be called for additional frames.
+
         :param image: A tuple of the image and metadata as provided to
             :attr:`cpl_media.player.BasePlayer.frame_callbacks`.
         """
@@ -387,12 +975,6 @@ class ImageFileRecorder(BaseRecorder):
                 'Can only record from player once the fps is known')
 
         super(ImageFileRecorder, self).record(player=player)
-        self.player.frame_callbacks.append(self.send_image_to_recorder)
-
-    @error_guard
-    def stop(self, *largs, join=False):
-        if super(ImageFileRecorder, self).stop(join=join):
-            self.player.frame_callbacks.remove(self.send_image_to_recorder)
 
     def _start_recording(self):
         self.record_directory = expanduser(self.record_directory)
@@ -402,11 +984,6 @@ class ImageFileRecorder(BaseRecorder):
                   self.extension, self.requested_record_duration))
         thread.start()
 
-    def complete_stop(self, *largs):
-        super(ImageFileRecorder, self).complete_stop()
-        if self.send_image_to_recorder in self.player.frame_callbacks:
-            self.player.frame_callbacks.remove(self.send_image_to_recorder)
-
     def record_thread_run(
             self, record_directory, record_prefix, compression, extension,
             requested_record_duration):
@@ -414,9 +991,16 @@ class ImageFileRecorder(BaseRecorder):
         last_img = None
         t0 = None
         finished = False
+        sidecar = None
+        index = offset = 0
+        timers = self.thread_timers['record']
+        timers.start()
+        mark = timers.mark
 
         while self.record_state != 'stopping':
+            ts = clock()
             item = queue.get()
+            ts = mark('wait', ts)
             if item == 'eof':
                 break
             image, metadata = item
@@ -430,6 +1014,16 @@ class ImageFileRecorder(BaseRecorder):
                         metadata_record_used=self.player.metadata_play_used)
                     Clock.schedule_once(self.complete_start)
 
+                    filename = join(
+                        record_directory, record_prefix + 'timestamps.npy')
+                    counter = 0
+                    while exists(filename):
+                        counter += 1
+                        filename = join(
+                            record_directory, record_prefix +
+                            'timestamps-{}.npy'.format(counter))
+                    sidecar = self.open_timestamp_sidecar(filename)
+
                 if finished:
                     continue
 
@@ -461,12 +1055,20 @@ class ImageFileRecorder(BaseRecorder):
                 size = self.save_image(
                     filename, image, codec=extension,
                     pix_fmt=image.get_pixel_format(), lib_opts=lib_opts)
-                self.setattrs_in_kivy_thread(frame_last_t_record=metadata['t'])
-                self.increment_in_kivy_thread('size_recorded', size)
-                self.increment_in_kivy_thread('frames_recorded')
+                mark('write', ts)
+                timers.tick()
+                if sidecar is not None:
+                    sidecar.add(index, metadata, offset)
+                index += 1
+                offset += size
+                self.set_stats_in_kivy_thread(
+                    frame_last_t_record=metadata['t'])
+                self.increment_stat_in_kivy_thread('size_recorded', size)
+                self.increment_stat_in_kivy_thread('frames_recorded')
+                self.add_record_latency(metadata)
             except Exception as e:
                 self.exception(e)
-                self.increment_in_kivy_thread('frames_skipped')
+                self.increment_stat_in_kivy_thread('frames_skipped')
 
         Clock.schedule_once(self.complete_stop)
 
@@ -476,11 +1078,16 @@ class VideoRecorder(BaseRecorder):
 
     Cannot start recording until the player fps is known. Otherwise, an error
     is raised.
+
+    The timestamps of the frames are also written to the
+    :class:`TimestampSidecar` with the name of the video followed by
+    ``_timestamps.npy``, if :attr:`~BaseRecorder.record_timestamps`.
     """
 
     _config_props_ = (
         'record_directory', 'record_fname', 'record_fname_count',
-        'estimate_record_rate')
+        'estimate_record_rate', 'codec', 'codec_preset', 'codec_crf',
+        'encoder_threads', 'lib_opts', 'check_encode_rate')
 
     record_directory = StringProperty(expanduser('~'))
     '''The directory into which videos should be saved.
@@ -512,6 +1119,88 @@ class VideoRecorder(BaseRecorder):
     configuration options of the instance.
     """
 
+    codec = StringProperty('rawvideo')
+    """The FFmpeg codec used to encode the frames. E.g. ``'rawvideo'`` for
+    uncompressed frames, ``'ffv1'`` for lossless compression, or ``'libx264'``
+    or ``'mjpeg'`` for lossy compression.
+
+    The recorded pixel format is converted to one supported by the codec, if
+    needed.
+    """
+
+    codec_preset = StringProperty('')
+    """The ``'libx264'`` preset, e.g. ``'ultrafast'`` or ``'medium'``. If
+    empty, the codec's default is used.
+    """
+
+    codec_crf = NumericProperty(-1)
+    """The ``'libx264'`` constant rate factor, the lower the better the
+    quality, with zero being lossless. If negative, the codec's default is
+    used.
+    """
+
+    encoder_threads = NumericProperty(0)
+    """The number of threads the codec uses to encode the frames, in addition
+    to the record thread that passes them to the codec. If zero, the codec's
+    default is used.
+    """
+
+    lib_opts = DictProperty({})
+    """Options passed as is to the codec, e.g. ``{'g': '1'}``. They override
+    the options set by :attr:`codec_preset`, :attr:`codec_crf` and
+    :attr:`encoder_threads`. See :meth:`get_codec_opts`.
+    """
+
+    check_encode_rate = BooleanProperty(True)
+    """Whether to check, when recording starts, whether the codec can encode
+    the frames at the rate of the player. See :meth:`estimate_encode_rate`.
+    It's not checked for ``'rawvideo'``, which is limited by the disk rather
+    than by encoding.
+
+    The check runs in its own thread with the player's
+    :attr:`~cpl_media.player.BasePlayer.last_image`, so it doesn't delay the
+    frames being recorded.
+
+    If it cannot keep up, a warning is logged and
+    :attr:`encode_can_keep_up` is False, but it still records.
+    """
+
+    encode_rate_estimate = NumericProperty(0)
+    """The rate in frames per second at which the codec was estimated to
+    encode the frames by :meth:`estimate_encode_rate`, or zero if not checked
+    (yet).
+
+    Read only.
+    """
+
+    encode_can_keep_up = BooleanProperty(True)
+    """Whether :attr:`encode_rate_estimate` is at least the rate of the
+    player, or True if not checked.
+
+    Read only.
+    """
+
+    encode_time_per_frame = NumericProperty(0)
+    """The mean time in seconds that the record thread spent encoding and
+    writing each frame since :meth:`record`. Frames encoded by the
+    :attr:`encoder_threads` may only be accounted for in later frames.
+
+    Read only.
+    """
+
+    compression_ratio = NumericProperty(0)
+    """The size of the frames passed to the codec divided by the
+    :attr:`~BaseRecorder.size_recorded` so far since :meth:`record`. Codecs
+    buffer frames before writing them, so it's only approximate until stopped.
+
+    Read only.
+    """
+
+    encode_check_thread = None
+    """The internal thread that runs :meth:`estimate_encode_rate` when
+    recording starts, if :attr:`check_encode_rate`.
+    """
+
     def __init__(self, **kwargs):
         super(VideoRecorder, self).__init__(**kwargs)
 
@@ -521,10 +1210,12 @@ class VideoRecorder(BaseRecorder):
         self._update_record_fname()
 
         self.fbind('record_filename', self._update_summary)
+        self.fbind('codec', self._update_summary)
         self._update_summary()
 
     def _update_summary(self, *largs):
-        self.recorder_summery = 'FFmpeg "{}"'.format(self.record_filename)
+        self.recorder_summery = 'FFmpeg "{}" ({})'.format(
+            self.record_filename, self.codec)
 
     def compute_recording_opts(self, ifmt=None, iw=None, ih=None):
         """Computes the recording metadata to use, from the provided options
@@ -541,11 +1232,19 @@ class VideoRecorder(BaseRecorder):
         ih = ih or 480
         assert irate
 
-        if self.record_fname.endswith('mkv'):
+        codec = self.codec
+        if codec == 'rawvideo' and self.record_fname.endswith('mkv'):
             ifmt = get_supported_pixfmts('libx264', ifmt)[0]
 
         ofmt, ow, oh, orate = self.metadata_record
         ofmt = ofmt or ifmt
+        if codec != 'rawvideo':
+            supported = get_supported_pixfmts(codec, ofmt)
+            # mjpeg only accepts full range yuv by default
+            if codec == 'mjpeg' and 'yuvj' + ofmt[3:] in supported:
+                ofmt = 'yuvj' + ofmt[3:]
+            else:
+                ofmt = supported[0]
         ow = ow or iw
         oh = oh or ih
         if self.estimate_record_rate:
@@ -554,6 +1253,132 @@ class VideoRecorder(BaseRecorder):
 
         return (ifmt, iw, ih, irate), (ofmt, ow, oh, orate)
 
+    def _get_stream(self, ipix_fmt, iw, ih):
+        """Returns the stream dict passed to
+        :class:`ffpyplayer.writer.MediaWriter` for frames of this format and
+        size, the player's rate, and the recorded :class:`VideoMetadata`.
+        """
+        (ifmt, iw, ih, irate), (opix_fmt, ow, oh, orate) = \
+            self.compute_recording_opts(ipix_fmt, iw, ih)
+        metadata = VideoMetadata(opix_fmt, ow, oh, orate)
+
+        orate = Fraction(orate)
+        if orate >= 1.:
+            orate = Fraction(orate.denominator, orate.numerator)
+            orate = orate.limit_denominator(2 ** 30 - 1)
+            orate = (orate.denominator, orate.numerator)
+        else:
+            orate = orate.limit_denominator(2 ** 30 - 1)
+            orate = (orate.numerator, orate.denominator)
+
+        stream = {
+            'pix_fmt_in': ipix_fmt, 'pix_fmt_out': opix_fmt,
+            'width_in': iw, 'height_in': ih, 'width_out': ow,
+            'height_out': oh, 'codec': self.codec,
+            'frame_rate': orate}
+        return stream, irate, metadata
+
+    def get_codec_opts(self):
+        """Returns the dict of options passed to the codec, computed from
+        :attr:`codec_preset`, :attr:`codec_crf`, :attr:`encoder_threads` and
+        :attr:`lib_opts`.
+        """
+        opts = {}
+        if self.encoder_threads:
+            opts['threads'] = str(int(self.encoder_threads))
+        if self.codec == 'libx264':
+            if self.codec_preset:
+                opts['preset'] = self.codec_preset
+            if self.codec_crf >= 0:
+                opts['crf'] = str(self.codec_crf)
+        opts.update({str(k): str(v) for k, v in self.lib_opts.items()})
+        return opts
+
+    def measure_encode_rate(self, image, stream, lib_opts, n_frames=16):
+        """Estimates the rate at which frames like the image can be encoded,
+        by encoding ``n_frames`` shifted copies of it to a temporary file in
+        the system's temporary directory. Only one copy is held in memory at a
+        time.
+
+        :param image: The :class:`ffpyplayer.pic.Image` to encode.
+        :param stream: The stream dict passed to
+            :class:`ffpyplayer.writer.MediaWriter`.
+        :param lib_opts: The codec options, see :meth:`get_codec_opts`.
+        :param n_frames: The number of frames to encode.
+        :return: The estimated number of frames encoded per second.
+        """
+        fmt = image.get_pixel_format()
+        size = image.get_size()
+        planes = [plane for plane in image.to_bytearray() if plane]
+
+        num, den = stream['frame_rate']
+        fd, filename = tempfile.mkstemp(
+            suffix='.mkv', prefix='cpl_media_encode_')
+        os.close(fd)
+        elapsed = 0
+        try:
+            ts = clock()
+            writer = MediaWriter(
+                filename, [stream], fmt='matroska', lib_opts=lib_opts,
+                overwrite=True)
+            elapsed += clock() - ts
+
+            for i in range(n_frames):
+                # shift the data so the codec cannot just repeat the previous
+                # frame, without timing the copy
+                shifted = []
+                for plane in planes:
+                    k = i * 7 % len(plane)
+                    shifted.append(plane[k:] + plane[:k])
+                frame = Image(plane_buffers=shifted, pix_fmt=fmt, size=size)
+                del shifted
+
+                ts = clock()
+                writer.write_frame(frame, i * den / num)
+                elapsed += clock() - ts
+                del frame
+
+            ts = clock()
+            writer.close()
+            elapsed += clock() - ts
+        finally:
+            os.remove(filename)
+
+        return n_frames / max(elapsed, 1e-6)
+
+    def estimate_encode_rate(self, image):
+        """Estimates with :meth:`measure_encode_rate` whether the codec can
+        encode frames like the image at the rate of the player we record
+        from, and sets :attr:`encode_rate_estimate` and
+        :attr:`encode_can_keep_up`. A warning is logged if it cannot keep up.
+
+        It's called from the :attr:`encode_check_thread` when recording
+        starts, if :attr:`check_encode_rate`. It takes as long as encoding a
+        few frames, so it must not be called from the record thread.
+
+        :param image: The :class:`ffpyplayer.pic.Image` to encode.
+        :return: The estimated number of frames encoded per second.
+        """
+        iw, ih = image.get_size()
+        stream, irate, _ = self._get_stream(image.get_pixel_format(), iw, ih)
+        encode_rate = self.measure_encode_rate(
+            image, stream, self.get_codec_opts())
+
+        can_keep_up = encode_rate >= irate
+        self.setattrs_in_kivy_thread(
+            encode_rate_estimate=encode_rate, encode_can_keep_up=can_keep_up)
+        if not can_keep_up:
+            logging.warning(
+                'cpl_media: "{}" can only encode {:.1f} of the {} frames per '
+                'second of the player'.format(self.codec, encode_rate, irate))
+        return encode_rate
+
+    def encode_check_thread_run(self, image):
+        try:
+            self.estimate_encode_rate(image)
+        except Exception as e:
+            self.exception(e)
+
     def _set_metadata_record(self, fmt, w, h, rate):
         self.metadata_record = VideoMetadata(fmt, w, h, rate)
 
@@ -566,6 +1391,9 @@ class VideoRecorder(BaseRecorder):
         """Sends the image to the recorder queue to save the image in the
         video.
 
+        Frames from the player are already added to the queue while recording,
+        so this only needs to be called for additional frames.
+
         :param image: A tuple of the image and metadata as provided to
             :attr:`cpl_media.player.BasePlayer.frame_callbacks`.
         """
@@ -581,34 +1409,45 @@ class VideoRecorder(BaseRecorder):
                 'Can only record from player once the fps is known')
 
         super(VideoRecorder, self).record(player=player)
-        self.player.frame_callbacks.append(self.send_image_to_recorder)
-
-    @error_guard
-    def stop(self, *largs, join=False):
-        if super(VideoRecorder, self).stop(join=join):
-            self.player.frame_callbacks.remove(self.send_image_to_recorder)
 
     def _start_recording(self):
         self.record_directory = expanduser(self.record_directory)
+        self.encode_rate_estimate = 0
+        self.encode_can_keep_up = True
+        self.encode_time_per_frame = self.compression_ratio = 0
         thread = self.record_thread = Thread(
             target=self.record_thread_run, name='Record thread',
             args=(self.record_filename, self.requested_record_duration))
         thread.start()
 
+        image = self.player.last_image
+        if self.check_encode_rate and self.codec != 'rawvideo' and \
+                image is not None:
+            thread = self.encode_check_thread = Thread(
+                target=self.encode_check_thread_run,
+                name='Encode check thread', args=(image, ))
+            thread.start()
+
     def complete_stop(self, *largs):
         super(VideoRecorder, self).complete_stop()
         self.record_fname_count += 1
-        if self.send_image_to_recorder in self.player.frame_callbacks:
-            self.player.frame_callbacks.remove(self.send_image_to_recorder)
 
     def record_thread_run(self, filename, requested_record_duration):
         queue = self.image_queue
         recorder = None
         t0 = None
         finished = False
+        sidecar = None
+        index = offset = 0
+        raw_size = frame_size = encode_time = 0
+        timers = self.thread_timers['record']
+        timers.start()
+        mark = timers.mark
 
         while self.record_state != 'stopping':
+            ts = clock()
             item = queue.get()
+            ts = mark('wait', ts)
             if item == 'eof':
                 break
             img, metadata = item
@@ -621,32 +1460,21 @@ class VideoRecorder(BaseRecorder):
                     iw, ih = img.get_size()
                     ipix_fmt = img.get_pixel_format()
 
-                    (ifmt, iw, ih, irate), (opix_fmt, ow, oh, orate) = \
-                        self.compute_recording_opts(ipix_fmt, iw, ih)
-
+                    stream, _, record_metadata = self._get_stream(
+                        ipix_fmt, iw, ih)
                     self.setattr_in_kivy_thread(
-                        'metadata_record_used',
-                        VideoMetadata(opix_fmt, ow, oh, orate))
-
-                    orate = Fraction(orate)
-                    if orate >= 1.:
-                        orate = Fraction(orate.denominator, orate.numerator)
-                        orate = orate.limit_denominator(2 ** 30 - 1)
-                        orate = (orate.denominator, orate.numerator)
-                    else:
-                        orate = orate.limit_denominator(2 ** 30 - 1)
-                        orate = (orate.numerator, orate.denominator)
-
-                    stream = {
-                        'pix_fmt_in': ipix_fmt, 'pix_fmt_out': opix_fmt,
-                        'width_in': iw, 'height_in': ih, 'width_out': ow,
-                        'height_out': oh, 'codec': 'rawvideo',
-                        'frame_rate': orate}
+                        'metadata_record_used', record_metadata)
+
                     fmt = ''
                     if filename.endswith('mkv'):
                         fmt = 'matroska'
+                    frame_size = sum(get_image_size(ipix_fmt, iw, ih))
 
-                    recorder = MediaWriter(filename, [stream], fmt=fmt)
+                    recorder = MediaWriter(
+                        filename, [stream], fmt=fmt,
+                        lib_opts=self.get_codec_opts())
+                    sidecar = self.open_timestamp_sidecar(
+                        splitext(filename)[0] + '_timestamps.npy')
                 except Exception as e:
                     self.exception(e)
                     Clock.schedule_once(self.complete_stop)
@@ -664,14 +1492,25 @@ class VideoRecorder(BaseRecorder):
                     finished = True
                     Clock.schedule_once(self.stop)
 
+                te = clock()
                 size = recorder.write_frame(img, elapsed)
-                self.setattrs_in_kivy_thread(
-                    size_recorded=size, frame_last_t_record=metadata['t']
+                encode_time += mark('write', ts) - te
+                timers.tick()
+                if sidecar is not None:
+                    sidecar.add(index, metadata, offset)
+                index += 1
+                offset = size
+                raw_size += frame_size
+                self.set_stats_in_kivy_thread(
+                    size_recorded=size, frame_last_t_record=metadata['t'],
+                    encode_time_per_frame=encode_time / index,
+                    compression_ratio=raw_size / size if size else 0
                 )
-                self.increment_in_kivy_thread('frames_recorded')
+                self.increment_stat_in_kivy_thread('frames_recorded')
+                self.add_record_latency(metadata)
             except Exception as e:
                 self.exception(e)
-                self.increment_in_kivy_thread('frames_skipped')
+                self.increment_stat_in_kivy_thread('frames_skipped')
 
         if recorder is not None:
             try:
@@ -682,60 +1521,8 @@ class VideoRecorder(BaseRecorder):
         Clock.schedule_once(self.complete_stop)
 
 
-class ImageFileRecordSettingsWidget(BoxLayout):
-    """Settings widget for :class:`ImageFileRecorder`.
-    """
-
-    recorder: ImageFileRecorder = None
-    """The recorder.
-    """
-
-    def __init__(self, recorder=None, **kwargs):
-        if recorder is None:
-            recorder = ImageFileRecorder()
-        self.recorder = recorder
-        super(ImageFileRecordSettingsWidget, self).__init__(**kwargs)
-
-    def set_filename(self, text_wid, paths):
-        """Called by the GUI to set the directory.
-        """
-        if not paths:
-            return
-
-        p = paths[0]
-        if not isdir(p):
-            p = expanduser('~')
-
-        self.recorder.record_directory = p
-        text_wid.text = p
-
-
-class VideoRecordSettingsWidget(BoxLayout):
-    """Settings widget for :class:`VideoRecorder`.
-    """
-
-    recorder: VideoRecorder = None
-    """The recorder.
-    """
-
-    def __init__(self, recorder=None, **kwargs):
-        if recorder is None:
-            recorder = VideoRecorder()
-        self.recorder = recorder
-        super(VideoRecordSettingsWidget, self).__init__(**kwargs)
-
-    def set_filename(self, text_wid, paths):
-        """Called by the GUI to set the directory.
-        """
-        if not paths:
-            return
-
-        p = paths[0]
-        if not isdir(p):
-            p = expanduser('~')
-
-        self.recorder.record_directory = p
-        text_wid.text = p
-
-
-Builder.load_file(join(dirname(__file__), 'recorder.kv'))
+# the settings widgets are only imported from their own module when they
+# are used, so Kivy widgets and kv files are not loaded when headless
+__getattr__ = lazy_module_getattr(__name__, {
+    'ImageFileRecordSettingsWidget': 'cpl_media.recorder_widgets',
+    'VideoRecordSettingsWidget': 'cpl_media.recorder_widgets'})
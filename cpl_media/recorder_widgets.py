@@ -0,0 +1,74 @@
+"""Recorder widgets
+==================
+
+The settings widgets for the recorders in :mod:`cpl_media.recorder`.
+"""
+
+from os.path import expanduser, join, isdir, dirname
+
+from kivy.uix.boxlayout import BoxLayout
+from kivy.lang import Builder
+
+from cpl_media.recorder import ImageFileRecorder, VideoRecorder
+
+__all__ = (
+    'ImageFileRecordSettingsWidget', 'VideoRecordSettingsWidget')
+
+
+class ImageFileRecordSettingsWidget(BoxLayout):
+    """Settings widget for :class:`~cpl_media.recorder.ImageFileRecorder`.
+    """
+
+    recorder: ImageFileRecorder = None
+    """The recorder.
+    """
+
+    def __init__(self, recorder=None, **kwargs):
+        if recorder is None:
+            recorder = ImageFileRecorder()
+        self.recorder = recorder
+        super(ImageFileRecordSettingsWidget, self).__init__(**kwargs)
+
+    def set_filename(self, text_wid, paths):
+        """Called by the GUI to set the directory.
+        """
+        if not paths:
+            return
+
+        p = paths[0]
+        if not isdir(p):
+            p = expanduser('~')
+
+        self.recorder.record_directory = p
+        text_wid.text = p
+
+
+class VideoRecordSettingsWidget(BoxLayout):
+    """Settings widget for :class:`~cpl_media.recorder.VideoRecorder`.
+    """
+
+    recorder: VideoRecorder = None
+    """The recorder.
+    """
+
+    def __init__(self, recorder=None, **kwargs):
+        if recorder is None:
+            recorder = VideoRecorder()
+        self.recorder = recorder
+        super(VideoRecordSettingsWidget, self).__init__(**kwargs)
+
+    def set_filename(self, text_wid, paths):
+        """Called by the GUI to set the directory.
+        """
+        if not paths:
+            return
+
+        p = paths[0]
+        if not isdir(p):
+            p = expanduser('~')
+
+        self.recorder.record_directory = p
+        text_wid.text = p
+
+
+Builder.load_file(join(dirname(__file__), 'recorder.kv'))
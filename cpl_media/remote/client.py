@@ -12,24 +12,24 @@ from time import perf_counter as clock
 import socket
 import sys
 from queue import Queue, Empty
-from os.path import splitext, join, exists, isdir, abspath, dirname
+from os.path import splitext, exists, isdir, abspath
 import traceback
 import select
 
-from ffpyplayer.pic import Image, SWScale
+from ffpyplayer.pic import Image
 
 from kivy.logger import Logger
 from kivy.properties import StringProperty, NumericProperty, BooleanProperty
-from kivy.clock import Clock
-from kivy.uix.boxlayout import BoxLayout
-from kivy.lang import Builder
+from cpl_media.clock import Clock
 
 from cpl_media import error_guard
+from cpl_media.common import lazy_module_getattr
+from cpl_media.memory import MemoryAccount, memory_governor
 from cpl_media.player import BasePlayer, VideoMetadata
 import cpl_media
 from .server import RemoteData
 
-__all__ = ('RemoteVideoPlayer', 'ClientPlayerSettingsWidget')
+__all__ = ('RemoteVideoPlayer', )
 
 
 class RemoteVideoPlayer(BasePlayer, RemoteData):
@@ -64,6 +64,15 @@ class RemoteVideoPlayer(BasePlayer, RemoteData):
     """The queue that sends messages to Kivy.
     """
 
+    image_memory: MemoryAccount = None
+    """The :class:`~cpl_media.memory.MemoryAccount` of the images received
+    from the server that are waiting in :attr:`to_kivy_queue`, while the
+    client is running.
+
+    Images received while the :attr:`~cpl_media.memory.memory_governor` is
+    over budget are dropped, and show up as gaps in the frame ``count``.
+    """
+
     _kivy_trigger = None
     """Trigger for kivy thread to read the queue - to be called after adding
     something to the queue.
@@ -73,10 +82,6 @@ class RemoteVideoPlayer(BasePlayer, RemoteData):
     """The client thread instance.
     """
 
-    _frame_count = 0
-
-    _ivl_start = 0
-
     def __init__(self, **kwargs):
         super(RemoteVideoPlayer, self).__init__(**kwargs)
         self._kivy_trigger = Clock.create_trigger(self.process_in_kivy_thread)
@@ -88,7 +93,7 @@ class RemoteVideoPlayer(BasePlayer, RemoteData):
     def _update_summary(self, *largs):
         self.player_summery = 'Network "{}:{}"'.format(self.server, self.port)
 
-    def listener_run(self, from_kivy_queue, to_kivy_queue):
+    def listener_run(self, from_kivy_queue, to_kivy_queue, image_memory):
         """Client method, that is executed in the internal client thread.
         """
         trigger = self._kivy_trigger
@@ -114,7 +119,13 @@ class RemoteVideoPlayer(BasePlayer, RemoteData):
                 if r:
                     msg_len, msg_buff, msg, value = self.read_msg(
                         sock, msg_len, msg_buff)
+                    if msg == 'image' and not image_memory.reserve(
+                            sum(map(len, value[0]))):
+                        msg = None
                     if msg is not None:
+                        if msg == 'image':
+                            # the server's host_t is from another clock
+                            value[4]['host_t'] = clock()
                         to_kivy_queue.put((msg, value))
                         trigger()
 
@@ -156,8 +167,11 @@ class RemoteVideoPlayer(BasePlayer, RemoteData):
         self.client_active = True
         from_kivy_queue = self.from_kivy_queue = Queue()
         to_kivy_queue = self.to_kivy_queue = Queue()
+        image_memory = self.image_memory = memory_governor.create_account(
+            'RemoteVideoPlayer images', 'drop')
         thread = self.listener_thread = Thread(
-            target=self.listener_run, args=(from_kivy_queue, to_kivy_queue))
+            target=self.listener_run,
+            args=(from_kivy_queue, to_kivy_queue, image_memory))
         thread.start()
 
     @error_guard
@@ -179,8 +193,7 @@ class RemoteVideoPlayer(BasePlayer, RemoteData):
                         self.complete_stop()
                 elif msg == 'started_recording':
                     if self.play_state == 'starting':
-                        self.ts_play = self._ivl_start = clock()
-                        self._frame_count = 0
+                        self.ts_play = clock()
 
                         self.metadata_play_used = VideoMetadata(*value)
                         self.complete_start()
@@ -189,25 +202,19 @@ class RemoteVideoPlayer(BasePlayer, RemoteData):
                 elif msg == 'stopped_playing':
                     self.complete_stop()
                 elif msg == 'image':
+                    plane_buffers, pix_fmt, size, linesize, metadata = value
+                    self.image_memory.release(sum(map(len, plane_buffers)))
                     if self.play_state != 'playing':
                         continue
 
-                    t = clock()
-                    if t - self._ivl_start >= 1.:
-                        self.real_rate = self._frame_count / (
-                            t - self._ivl_start)
-                        self._frame_count = 0
-                        self._ivl_start = t
-
-                    self._frame_count += 1
-                    self.frames_played += 1
-
-                    plane_buffers, pix_fmt, size, linesize, metadata = value
-                    sws = SWScale(*size, pix_fmt, ofmt=pix_fmt)
+                    planes = self.frame_pool.get_buffers(
+                        map(len, plane_buffers))
+                    for plane, buffer in zip(planes, plane_buffers):
+                        plane[:] = buffer
                     img = Image(
-                        plane_buffers=plane_buffers, pix_fmt=pix_fmt,
+                        plane_buffers=planes, pix_fmt=pix_fmt,
                         size=size, linesize=linesize)
-                    self.process_frame(sws.scale(img), metadata)
+                    self.process_frame(img, metadata)
                 else:
                     print('Got unknown RemoteVideoPlayer message', msg, value)
             except Empty:
@@ -226,6 +233,8 @@ class RemoteVideoPlayer(BasePlayer, RemoteData):
             self.listener_thread.join()
 
         self.listener_thread = self.to_kivy_queue = self.from_kivy_queue = None
+        # the bytes of any images left in the queue are no longer counted
+        self.image_memory = None
         self.client_active = False
 
     @error_guard
@@ -250,19 +259,8 @@ class RemoteVideoPlayer(BasePlayer, RemoteData):
         self.stop_listener(join=join)
 
 
-class ClientPlayerSettingsWidget(BoxLayout):
-    """Settings widget for :class:`RemoteVideoPlayer`.
-    """
-
-    player: RemoteVideoPlayer = None
-    """The player.
-    """
-
-    def __init__(self, player=None, **kwargs):
-        if player is None:
-            player = RemoteVideoPlayer()
-        self.player = player
-        super(ClientPlayerSettingsWidget, self).__init__(**kwargs)
-
-
-Builder.load_file(join(dirname(__file__), 'client_player.kv'))
+# the settings widgets are only imported from their own module when they
+# are used, so Kivy widgets and kv files are not loaded when headless
+__getattr__ = lazy_module_getattr(
+    __name__,
+    {'ClientPlayerSettingsWidget': 'cpl_media.remote.client_widgets'})
@@ -0,0 +1,33 @@
+"""Remote client player widgets
+===============================
+
+The settings widget for
+:class:`~cpl_media.remote.client.RemoteVideoPlayer`.
+"""
+
+from os.path import join, dirname
+
+from kivy.uix.boxlayout import BoxLayout
+from kivy.lang import Builder
+
+from cpl_media.remote.client import RemoteVideoPlayer
+
+__all__ = ('ClientPlayerSettingsWidget', )
+
+
+class ClientPlayerSettingsWidget(BoxLayout):
+    """Settings widget for :class:`~cpl_media.remote.client.RemoteVideoPlayer`.
+    """
+
+    player: RemoteVideoPlayer = None
+    """The player.
+    """
+
+    def __init__(self, player=None, **kwargs):
+        if player is None:
+            player = RemoteVideoPlayer()
+        self.player = player
+        super(ClientPlayerSettingsWidget, self).__init__(**kwargs)
+
+
+Builder.load_file(join(dirname(__file__), 'client_player.kv'))
@@ -10,27 +10,28 @@ from itertools import accumulate
 from threading import Thread
 import socket
 import sys
+import json
 import struct
 from time import perf_counter as clock
 from queue import Queue, Empty
 import traceback
-from os.path import splitext, join, exists, isdir, abspath, dirname
+from os.path import splitext, exists, isdir, abspath
 import select
 
 from kivy.properties import ObjectProperty, NumericProperty, StringProperty, \
     BooleanProperty, ListProperty
 from kivy.logger import Logger
-from kivy.clock import Clock
-from kivy.uix.boxlayout import BoxLayout
-from kivy.lang import Builder
+from cpl_media.clock import Clock
 
 from more_kivy_app.utils import yaml_dumps, yaml_loads
 
 from cpl_media import error_guard
+from cpl_media.common import lazy_module_getattr
 from cpl_media.recorder import BaseRecorder
+from cpl_media.player import FrameMetadata
 import cpl_media
 
-__all__ = ('RemoteVideoRecorder', 'RemoteRecordSettingsWidget', 'RemoteData',
+__all__ = ('RemoteVideoRecorder', 'RemoteData',
            'EndConnection')
 
 
@@ -41,7 +42,22 @@ class EndConnection(Exception):
 
 
 connection_errors = (
-    EndConnection, ConnectionAbortedError, ConnectionResetError)
+    EndConnection, ConnectionAbortedError, ConnectionResetError,
+    BrokenPipeError)
+
+_image_header = struct.Struct('<BBBB2I4i4IdqdqI')
+"""The binary header of image messages. It's the marker byte, the flags of
+which metadata fields are set, the number of planes, the length of the pixel
+format name, the image size, the 4 linesizes, the 4 plane sizes, the
+metadata ``t``, ``count``, ``host_t`` and ``seq`` and the length of the JSON
+encoded extra metadata. It's followed by the pixel format name and the extra
+metadata.
+
+The marker byte is zero, so it can't be confused with the YAML of the other
+messages.
+"""
+
+_image_marker = 0
 
 
 class RemoteData(object):
@@ -60,11 +76,8 @@ class RemoteData(object):
         # ts = time.monotonic()
         if msg == 'image':
             image, metadata = value
-            bin_data = image.to_bytearray()
-            data = yaml_dumps((
-                'image', (list(map(len, bin_data)), image.get_pixel_format(),
-                          image.get_size(), image.get_linesizes(), metadata)))
-            data = data.encode('utf8')
+            bin_data = [plane for plane in image.to_bytearray() if plane]
+            data = self.encode_image_header(image, metadata, bin_data)
         else:
             data = yaml_dumps((msg, value))
             data = data.encode('utf8')
@@ -77,6 +90,65 @@ class RemoteData(object):
             sock.sendall(item)
         # print('part1: {}, part2: {}'.format(ts2 - ts, time.monotonic() - ts2))
 
+    @staticmethod
+    def encode_image_header(image, metadata, bin_data):
+        """Encodes the header of an image message, which describes the image
+        and its metadata, into bytes.
+
+        The common metadata fields are packed in binary, and only any extra
+        metadata is JSON encoded.
+
+        :param image: The :class:`ffpyplayer.pic.Image`.
+        :param metadata: The :class:`~cpl_media.player.FrameMetadata` or
+            dict of the image.
+        :param bin_data: The list of the image's planes that are sent.
+        :return: The header bytes.
+        """
+        if not isinstance(metadata, FrameMetadata):
+            metadata = FrameMetadata.from_dict(metadata)
+        fields = metadata.t, metadata.count, metadata.host_t, metadata.seq
+        flags = 0
+        for i, value in enumerate(fields):
+            if value is not None:
+                flags |= 1 << i
+        t, count, host_t, seq = (value or 0 for value in fields)
+
+        extras = b''
+        if metadata.extras:
+            extras = json.dumps(metadata.extras, default=str).encode('utf8')
+        fmt = image.get_pixel_format().encode('ascii')
+        sizes = list(map(len, bin_data))
+        return _image_header.pack(
+            _image_marker, flags, len(sizes), len(fmt), *image.get_size(),
+            *image.get_linesizes(), *(sizes + [0] * (4 - len(sizes))),
+            t, count, host_t, seq, len(extras)) + fmt + extras
+
+    @staticmethod
+    def decode_image_header(data):
+        """Decodes the header encoded with :meth:`encode_image_header`.
+
+        :param data: The bytes of the header.
+        :return: A tuple of the ``(plane_sizes, pix_fmt, size, linesize,
+            metadata)``, where metadata is a
+            :class:`~cpl_media.player.FrameMetadata`.
+        """
+        (_, flags, n_planes, fmt_len, w, h, l0, l1, l2, l3, s0, s1, s2, s3,
+         t, count, host_t, seq, extras_len) = _image_header.unpack_from(data)
+        start = _image_header.size
+        pix_fmt = bytes(data[start:start + fmt_len]).decode('ascii')
+        start += fmt_len
+
+        extras = None
+        if extras_len:
+            extras = json.loads(
+                bytes(data[start:start + extras_len]).decode('utf8'))
+        metadata = FrameMetadata(
+            t if flags & 1 else None, count if flags & 2 else None,
+            host_t if flags & 4 else None, seq if flags & 8 else None,
+            extras)
+        return ([s0, s1, s2, s3][:n_planes], pix_fmt, (w, h),
+                (l0, l1, l2, l3), metadata)
+
     def decode_data(self, msg_buff, msg_len):
         """Decodes buffer data received from the network.
 
@@ -88,8 +160,11 @@ class RemoteData(object):
         """
         n, bin_n = msg_len
         assert n + bin_n == len(msg_buff)
-        data = msg_buff[:n].decode('utf8')
-        msg, value = yaml_loads(data)
+        if msg_buff[0] == _image_marker:
+            msg = 'image'
+            value = self.decode_image_header(msg_buff[:n])
+        else:
+            msg, value = yaml_loads(msg_buff[:n].decode('utf8'))
 
         if msg == 'image':
             bin_data = msg_buff[n:]
@@ -176,7 +251,8 @@ class RemoteVideoRecorder(BaseRecorder, RemoteData):
     """
 
     port = NumericProperty(10000)
-    """The server port on which to broadcast the data.
+    """The server port on which to broadcast the data. If zero, the system
+    picks a free port, see :attr:`listening_port`.
     """
 
     timeout = NumericProperty(.01)
@@ -188,16 +264,40 @@ class RemoteVideoRecorder(BaseRecorder, RemoteData):
     """Whether the server is currently running.
     """
 
+    listening_port = NumericProperty(0)
+    """The port on which the server is listening for clients, or zero while
+    it's not listening yet, e.g. right after :meth:`start_server`. It is
+    :attr:`port`, unless :attr:`port` is zero.
+
+    Read only.
+    """
+
     max_images_buffered = NumericProperty(5)
     """How many images the server should buffer before it starts dropping
     images, rather than queuing them to be sent to the client.
+
+    It is used as the size of
+    :attr:`~cpl_media.recorder.BaseRecorder.image_queue`, instead of
+    :attr:`~cpl_media.recorder.BaseRecorder.image_queue_size`.
+    """
+
+    image_queue_policy = StringProperty('drop_newest')
+    """Like :attr:`~cpl_media.recorder.BaseRecorder.image_queue_policy`, but
+    defaults to dropping new images while the queue is full.
+    """
+
+    image_queue_memory_policy = StringProperty('drop')
+    """Like :attr:`~cpl_media.recorder.BaseRecorder.image_queue_memory_policy`,
+    but defaults to dropping new images while the memory is over budget.
     """
 
     from_kivy_queue = None
     """The queue that receives messages from Kivy.
 
-    This queue can receive these messages: eof, image, started_recording,
-    or stopped_recording.
+    This queue can receive these messages: eof, started_recording,
+    or stopped_recording. The images are read from the
+    :attr:`~cpl_media.recorder.BaseRecorder.image_queue` sent with the
+    started_recording message.
     """
 
     to_kivy_queue = None
@@ -231,6 +331,12 @@ class RemoteVideoRecorder(BaseRecorder, RemoteData):
     May only be set from the server thread.
     """
 
+    _server_image_queue = None
+    """The image queue of the current recording.
+
+    May only be set from the server thread.
+    """
+
     _first_image_while_playing = False
     """If this is the first image right after we started recording.
 
@@ -243,6 +349,7 @@ class RemoteVideoRecorder(BaseRecorder, RemoteData):
 
     def __init__(self, **kwargs):
         super(RemoteVideoRecorder, self).__init__(**kwargs)
+        self.add_thread_timers('server')
         self._kivy_trigger = Clock.create_trigger(self.process_in_kivy_thread)
 
         self.fbind('server', self._update_summary)
@@ -258,6 +365,9 @@ class RemoteVideoRecorder(BaseRecorder, RemoteData):
         """
         trigger = self._kivy_trigger
         timeout = self.timeout
+        timers = self.thread_timers['server']
+        timers.start()
+        mark = timers.mark
 
         # Create a TCP/IP socket
         sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -270,18 +380,18 @@ class RemoteVideoRecorder(BaseRecorder, RemoteData):
         try:
             sock.bind(server_address)
             sock.listen(1)
+            self.setattr_in_kivy_thread(
+                'listening_port', sock.getsockname()[1])
 
             while True:
+                ts = clock()
                 r, _, _ = select.select([sock], [], [], timeout)
+                mark('select', ts)
                 if not r:
-                    try:
-                        while True:
-                            if 'eof' == self._server_message_from_queue(
-                                    None, from_kivy_queue):
-                                return
-                    except Empty:
-                        pass
-
+                    if 'eof' == self._server_process_queues(
+                            None, from_kivy_queue):
+                        return
+                    timers.tick()
                     continue
 
                 connection, client_address = sock.accept()
@@ -289,7 +399,9 @@ class RemoteVideoRecorder(BaseRecorder, RemoteData):
 
                 try:
                     while True:
+                        ts = clock()
                         r, _, _ = select.select([connection], [], [], timeout)
+                        ts = mark('select', ts)
                         if r:
                             msg_len, msg_buff, msg, value = self.read_msg(
                                 connection, msg_len, msg_buff)
@@ -298,14 +410,12 @@ class RemoteVideoRecorder(BaseRecorder, RemoteData):
                                         connection, msg, value):
                                     to_kivy_queue.put((msg, value))
                                     trigger()
+                            mark('receive', ts)
 
-                        try:
-                            while True:
-                                if 'eof' == self._server_message_from_queue(
-                                        connection, from_kivy_queue):
-                                    return
-                        except Empty:
-                            pass
+                        if 'eof' == self._server_process_queues(
+                                connection, from_kivy_queue):
+                            return
+                        timers.tick()
                 except connection_errors:
                     pass
                 finally:
@@ -325,6 +435,7 @@ class RemoteVideoRecorder(BaseRecorder, RemoteData):
         finally:
             Logger.info('closing socket')
             sock.close()
+            self.setattr_in_kivy_thread('listening_port', 0)
 
     def _server_message_from_client(self, connection, msg, value):
         """Processes message from the client.
@@ -356,6 +467,76 @@ class RemoteVideoRecorder(BaseRecorder, RemoteData):
             return True
         return False
 
+    def _server_process_queues(self, connection, from_kivy_queue):
+        """Processes all the messages from the kivy queue followed by all
+        the images from the image queue of the current recording.
+
+        Executed from the internal thread.
+        """
+        try:
+            while True:
+                if 'eof' == self._server_message_from_queue(
+                        connection, from_kivy_queue):
+                    return 'eof'
+        except Empty:
+            pass
+
+        self._server_images_from_queue(connection)
+
+    def _server_images_from_queue(self, connection):
+        """Processes all the images currently in the image queue.
+
+        Executed from the internal thread.
+        """
+        image_queue = self._server_image_queue
+        if image_queue is None:
+            return
+
+        while True:
+            try:
+                item = image_queue.get(block=False)
+            except Empty:
+                return
+
+            if item == 'eof':
+                self._server_image_queue = None
+                return
+            self._server_send_image(connection, item)
+
+    def _server_send_image(self, connection, value):
+        """Sends the image to the client, if it's playing.
+
+        Executed from the internal thread.
+        """
+        if self._first_image_while_playing:
+            t0 = clock()
+            self._record_time_start = t0
+            self.setattrs_in_kivy_thread(ts_record=t0, frame_ts_record=t0)
+            self._first_image_while_playing = False
+
+        if self._record_time_done:
+            return
+
+        d = self.requested_record_duration
+        t = clock()
+        if d and t - self._record_time_start >= d:
+            self._record_time_done = True
+            Clock.schedule_once(self.stop)
+
+        if self._server_client_playing:
+            assert connection is not None
+            self.set_stats_in_kivy_thread(frame_last_t_record=t)
+            self.increment_stat_in_kivy_thread(
+                'size_recorded', sum(value[0].get_buffer_size()))
+            self.increment_stat_in_kivy_thread('frames_recorded')
+
+            ts = clock()
+            self.send_msg(connection, 'image', value)
+            self.thread_timers['server'].mark('send', ts)
+            self.add_record_latency(value[1])
+        else:
+            self.increment_stat_in_kivy_thread('frames_skipped')
+
     def _server_message_from_queue(self, connection, from_kivy_queue):
         """Processes message from the kivy queue.
 
@@ -365,34 +546,9 @@ class RemoteVideoRecorder(BaseRecorder, RemoteData):
         if msg == 'eof':
             return 'eof'
 
-        if msg == 'image':
-            if self._first_image_while_playing:
-                t0 = clock()
-                self._record_time_start = t0
-                self.setattrs_in_kivy_thread(ts_record=t0, frame_ts_record=t0)
-                self._first_image_while_playing = False
-
-            if self._record_time_done:
-                return
-
-            d = self.requested_record_duration
-            t = clock()
-            if d and t - self._record_time_start >= d:
-                self._record_time_done = True
-                Clock.schedule_once(self.stop)
-
-            if self._server_client_playing:
-                assert connection is not None
-                self.setattrs_in_kivy_thread(frame_last_t_record=t)
-                self.increment_in_kivy_thread(
-                    'size_recorded', sum(value[0].get_buffer_size()))
-                self.increment_in_kivy_thread('frames_recorded')
-
-                self.send_msg(connection, msg, value)
-            else:
-                self.increment_in_kivy_thread('frames_skipped')
-        elif msg == 'started_recording':
-            self._server_recording = recording = tuple(value)
+        if msg == 'started_recording':
+            metadata, self._server_image_queue = value
+            self._server_recording = recording = tuple(metadata)
             # cannot be playing as it should at most be in requested_playing
             assert not self._server_client_playing
             self._first_image_while_playing = True
@@ -404,6 +560,9 @@ class RemoteVideoRecorder(BaseRecorder, RemoteData):
                 self.send_msg(connection, 'started_recording', recording)
         elif msg == 'stopped_recording':
             assert self._server_recording is not None
+            # send the images queued before we stopped
+            self._server_images_from_queue(connection)
+            self._server_image_queue = None
             self._server_recording = None
             if self._server_client_requested_playing or \
                     self._server_client_playing:
@@ -430,16 +589,20 @@ class RemoteVideoRecorder(BaseRecorder, RemoteData):
     def send_image_to_client(self, image):
         """Sends a image (tuple of image, metadata) to the client through the
         server.
+
+        Frames from the player are already sent while recording, so this only
+        needs to be called for additional frames.
         """
-        if self.from_kivy_queue is None:
+        if self.image_queue is None:
             return
-        image, metadata = image
 
-        if not self.max_images_buffered or \
-                self.from_kivy_queue.qsize() < self.max_images_buffered:
-            self.from_kivy_queue.put(('image', (image, metadata)))
-        else:
-            self.increment_in_kivy_thread('frames_skipped')
+        self.image_queue.put(image)
+
+    def subscribe_to_player(self, player):
+        return player.subscribe(
+            maxsize=self.max_images_buffered, policy=self.image_queue_policy,
+            name=self.recorder_summery, on_drop=self._drop_frame,
+            memory_policy=self.image_queue_memory_policy)
 
     @error_guard
     def process_in_kivy_thread(self, *largs):
@@ -466,9 +629,10 @@ class RemoteVideoRecorder(BaseRecorder, RemoteData):
             return
 
         self.server_active = True
+        self.listening_port = 0
         self._server_client_playing = False
         self._server_client_requested_playing = False
-        self._server_recording = None
+        self._server_recording = self._server_image_queue = None
         from_kivy_queue = self.from_kivy_queue = Queue()
         to_kivy_queue = self.to_kivy_queue = Queue()
 
@@ -498,16 +662,15 @@ class RemoteVideoRecorder(BaseRecorder, RemoteData):
         super(RemoteVideoRecorder, self).record(*largs, **kwargs)
 
         self.metadata_record_used = self.metadata_player
-        self.player.frame_callbacks.append(self.send_image_to_client)
         self.from_kivy_queue.put(
-            ('started_recording', self.metadata_record_used))
+            ('started_recording',
+             (self.metadata_record_used, self.image_queue)))
 
         self.complete_start()
 
     @error_guard
     def stop(self, *largs, join=False):
         if super(RemoteVideoRecorder, self).stop(join=join):
-            self.player.frame_callbacks.remove(self.send_image_to_client)
             self.from_kivy_queue.put(('stopped_recording', None))
             self.complete_stop()
 
@@ -519,19 +682,8 @@ class RemoteVideoRecorder(BaseRecorder, RemoteData):
         pass
 
 
-class RemoteRecordSettingsWidget(BoxLayout):
-    """Settings widget for :class:`RemoteVideoRecorder`.
-    """
-
-    recorder: RemoteVideoRecorder = None
-    """The recorder.
-    """
-
-    def __init__(self, recorder=None, **kwargs):
-        if recorder is None:
-            recorder = RemoteVideoRecorder()
-        self.recorder = recorder
-        super(RemoteRecordSettingsWidget, self).__init__(**kwargs)
-
-
-Builder.load_file(join(dirname(__file__), 'server_recorder.kv'))
+# the settings widgets are only imported from their own module when they
+# are used, so Kivy widgets and kv files are not loaded when headless
+__getattr__ = lazy_module_getattr(
+    __name__,
+    {'RemoteRecordSettingsWidget': 'cpl_media.remote.server_widgets'})
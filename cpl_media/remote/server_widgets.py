@@ -0,0 +1,34 @@
+"""Remote server recorder widgets
+================================
+
+The settings widget for
+:class:`~cpl_media.remote.server.RemoteVideoRecorder`.
+"""
+
+from os.path import join, dirname
+
+from kivy.uix.boxlayout import BoxLayout
+from kivy.lang import Builder
+
+from cpl_media.remote.server import RemoteVideoRecorder
+
+__all__ = ('RemoteRecordSettingsWidget', )
+
+
+class RemoteRecordSettingsWidget(BoxLayout):
+    """Settings widget for
+    :class:`~cpl_media.remote.server.RemoteVideoRecorder`.
+    """
+
+    recorder: RemoteVideoRecorder = None
+    """The recorder.
+    """
+
+    def __init__(self, recorder=None, **kwargs):
+        if recorder is None:
+            recorder = RemoteVideoRecorder()
+        self.recorder = recorder
+        super(RemoteRecordSettingsWidget, self).__init__(**kwargs)
+
+
+Builder.load_file(join(dirname(__file__), 'server_recorder.kv'))
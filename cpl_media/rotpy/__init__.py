@@ -4,7 +4,9 @@
 This player can play Flir cameras using :mod:`rotpy`.
 """
 
-from typing import List, Union, Dict, Optional, Tuple
+from __future__ import annotations
+
+from typing import List, Union, Dict, Optional, Tuple, TYPE_CHECKING
 import ipaddress
 from threading import Thread
 from collections import defaultdict
@@ -12,38 +14,32 @@ from time import perf_counter as clock
 from functools import partial
 import time
 from queue import Queue
-from os.path import splitext, join, exists, isdir, abspath, dirname
+from os.path import splitext, exists, isdir, abspath
 
 from ffpyplayer.pic import Image
 
-from kivy.clock import Clock
+from cpl_media.clock import Clock
 from kivy.properties import (
     NumericProperty, ReferenceListProperty,
     ObjectProperty, ListProperty, StringProperty, BooleanProperty,
     DictProperty, AliasProperty, OptionProperty, ConfigParserProperty)
-from kivy.uix.boxlayout import BoxLayout
 from kivy.logger import Logger
 from kivy.event import EventDispatcher
-from kivy.lang import Builder
 
-from cpl_media.player import BasePlayer, VideoMetadata
+from cpl_media.player import BasePlayer, VideoMetadata, FrameMetadata
 from cpl_media import error_guard
+from cpl_media.common import lazy_module_getattr, module_available
 
-try:
-    from rotpy.camera import Camera, CameraList
-    from rotpy.system import SpinSystem, SpinnakerAPIException
-    from rotpy.system_nodes import SystemNodes
-    from rotpy.camera_nodes import CameraNodes
+# rotpy is only imported by the configuration thread, when a player is
+# created, because loading Spinnaker is slow
+if TYPE_CHECKING:
+    from rotpy.camera import Camera
+    from rotpy.system import SpinSystem
     from rotpy.image import Image as RotPyImage
     from rotpy.node import SpinIntNode, SpinStrNode, SpinFloatNode, \
         SpinCommandNode, SpinBoolNode, SpinEnumDefNode, SpinValueNode
-except ImportError as e:
-    Logger.debug('cpl_media: Could not import RotPy: {}'.format(e))
-    Camera = CameraList = SpinSystem = SystemNodes = CameraNodes = \
-        RotPyImage = SpinIntNode = SpinStrNode = SpinFloatNode = \
-        SpinCommandNode = SpinBoolNode = SpinEnumDefNode = SpinValueNode = None
 
-__all__ = ('FlirPlayer', 'FlirSettingsWidget')
+__all__ = ('FlirPlayer', )
 
 
 class CameraSetting(EventDispatcher):
@@ -394,7 +390,7 @@ class FlirPlayer(BasePlayer):
 
     _config_props_ = ('serial', 'saved_nodes')
 
-    is_available = BooleanProperty(Camera is not None)
+    is_available = BooleanProperty(module_available('rotpy'))
     """Whether RotPy is available to play."""
 
     serial = StringProperty('')
@@ -575,7 +571,7 @@ ImageFormatControl.html
         super().__init__(**kwargs)
         self.active_settings_count = defaultdict(int)
 
-        if Camera is not None and open_thread:
+        if self.is_available and open_thread:
             self.start_config()
 
         self.fbind('serial', self.update_serial)
@@ -626,6 +622,10 @@ ImageFormatControl.html
         self.camera_inited = False
 
     def _do_update_serial(self, system: SpinSystem, serial):
+        from rotpy.camera import CameraList
+        from rotpy.node import SpinIntNode, SpinStrNode, SpinFloatNode, \
+            SpinCommandNode, SpinBoolNode, SpinEnumDefNode
+
         settings = {}
         available_settings = []
         success = False
@@ -727,6 +727,8 @@ ImageFormatControl.html
         self.ask_config('init_cam')
 
     def _create_available_settings(self):
+        from rotpy.system import SpinnakerAPIException
+
         available_settings = []
         saved_nodes = {}
         saved_values = self.saved_nodes
@@ -843,6 +845,8 @@ ImageFormatControl.html
         self.ask_config('serials')
 
     def _do_update_serials(self, system: SpinSystem):
+        from rotpy.camera import CameraList
+
         serials = []
 
         try:
@@ -928,12 +932,29 @@ ImageFormatControl.html
                 self.start_config_item(item)
             queue.put((item, (args, kwargs)))
 
+    def _config_unavailable(self, *largs):
+        """Called in the kivy thread when the configuration thread could not
+        load RotPy, to drop the configuration requests still pending.
+        """
+        self.is_available = False
+        self.config_queue = None
+        self.active_settings_count.clear()
+        self.total_active_count = 0
+        self.config_active = False
+
     def config_thread_run(self):
         """The function run by the configuration thread.
         """
         cmd_queue = self.config_queue
+        try:
+            from rotpy.system import SpinSystem, SpinnakerAPIException
+            system = SpinSystem()
+        except Exception as err:
+            # rotpy is installed, but e.g. the Spinnaker driver is missing
+            self.exception(err)
+            self.call_in_kivy_thread(self._config_unavailable)
+            return
 
-        system = SpinSystem()
         camera: Optional[Camera] = None
 
         while True:
@@ -1009,6 +1030,7 @@ ImageFormatControl.html
     def play_thread_run(self):
         queue = self.initial_play_queue
         process_frame = self.process_frame
+        pool = self.frame_pool
         ffmpeg_fmts = self.ffmpeg_pix_map
         camera: Optional[Camera] = None
         acquiring = False
@@ -1033,32 +1055,27 @@ ImageFormatControl.html
                     self.exception(err)
                     continue
 
-            count = 0
-            ivl_start = clock()
-            self.setattr_in_kivy_thread('ts_play', ivl_start)
+            self.setattr_in_kivy_thread('ts_play', clock())
             Clock.schedule_once(self.complete_start)
+            timers = self.thread_timers['play']
+            timers.start()
+            mark = timers.mark
 
             while self.play_state != 'stopping':
-                ivl_end = clock()
-                if ivl_end - ivl_start >= 1.:
-                    real_rate = count / (ivl_end - ivl_start)
-                    self.setattr_in_kivy_thread('real_rate', real_rate)
-                    count = 0
-                    ivl_start = ivl_end
-
+                ts = clock()
                 try:
                     image: Optional[RotPyImage] = camera.get_next_image(.2)
                     if image is None:
+                        mark('acquire_timeout', ts)
+                        timers.tick()
                         continue
+                    host_t = mark('acquire', ts)
                 except Exception as err:
                     self.exception(err)
                     if image is not None:
                         image.release()
                     continue
 
-                count += 1
-                self.increment_in_kivy_thread('frames_played')
-
                 pix_fmt = image.get_pix_fmt()
                 w = image.get_width()
                 h = image.get_height()
@@ -1068,17 +1085,31 @@ ImageFormatControl.html
                     raise Exception(f'Pixel format {pix_fmt} cannot be used')
 
                 ff_fmt = ffmpeg_fmts[pix_fmt]
-                buff = image.get_image_data()
+                buff = memoryview(image.get_image_data_memoryview()).cast('B')
+                planes = pool.get_image_buffers(ff_fmt, w, h)
+                if sum(map(len, planes)) != len(buff):
+                    # padded image, we cannot copy it directly into the planes
+                    planes = None
+                    buff = image.get_image_data()
+
                 if ff_fmt == 'yuv444p':
-                    img = Image(
-                        plane_buffers=[buff[1::3], buff[0::3], buff[2::3]],
-                        pix_fmt=ff_fmt, size=(w, h))
+                    if planes is None:
+                        planes = [buff[1::3], buff[0::3], buff[2::3]]
+                    else:
+                        for plane, offset in zip(planes, (1, 0, 2)):
+                            memoryview(plane)[:] = buff[offset::3]
+                elif planes is None:
+                    planes = [buff]
                 else:
-                    img = Image(
-                        plane_buffers=[buff], pix_fmt=ff_fmt, size=(w, h))
+                    memoryview(planes[0])[:] = buff
 
+                del buff
                 image.release()
-                process_frame(img, {'t': t})
+                img = Image(plane_buffers=planes, pix_fmt=ff_fmt, size=(w, h))
+                ts = mark('wrap', host_t)
+                process_frame(img, FrameMetadata(t, host_t=host_t))
+                mark('callbacks', ts)
+                timers.tick()
         except Exception as err:
             self.exception(err)
         finally:
@@ -1099,175 +1130,13 @@ ImageFormatControl.html
         return values
 
 
-class FlirSettingsWidget(BoxLayout):
-    """Settings widget for :class:`FlirPlayer`.
-    """
-
-    player: FlirPlayer = ObjectProperty(None)
-    """The player.
-    """
-
-    setting: Optional[CameraSetting] = ObjectProperty(None, allownone=True)
-
-    selected_name = StringProperty('')
-
-    current_widget = None
-
-    widget_cls_cache = {}
-
-    setting_parent: ObjectProperty(None)
-
-    def __init__(self, player=None, **kwargs):
-        if player is None:
-            player = FlirPlayer()
-        self.player = player
-        super().__init__(**kwargs)
-        self.widget_cls_cache = {}
-
-        def setting_callback(*args):
-            self.update_setting('')
-        player.fbind('available_camera_settings', setting_callback)
-        player.fbind('serial', setting_callback)
-
-    def update_setting(self, name):
-        if self.current_widget is not None:
-            self.current_widget.setting = None
-            self.current_widget.parent.remove_widget(self.current_widget)
-            self.current_widget = None
-        self.setting = None
-
-        self.selected_name = name
-        if not name:
-            return
-
-        setting = self.player.camera_settings[name]
-        widget = self.get_setting_widget(setting)
-        self.setting_parent.add_widget(widget)
-        self.current_widget = widget
-        self.setting = setting
-        setting.refresh_value()
-
-    def get_setting_widget(self, setting):
-        representation = None
-        if isinstance(setting, (IntSetting, FloatSetting)):
-            if setting.representation in (
-                    'MACAddress', 'IPV4Address', 'HexNumber'):
-                representation = setting.representation
-                cls = FlirTextSettingWidget
-            else:
-                cls = FlirNumericSettingWidget
-        elif isinstance(setting, StrSetting):
-            cls = FlirTextSettingWidget
-            representation = ''
-        elif isinstance(setting, BoolSetting):
-            cls = FlirBoolSettingWidget
-        elif isinstance(setting, EnumSetting):
-            cls = FlirEnumSettingWidget
-        elif isinstance(setting, CommandSetting):
-            cls = FlirCommandSettingWidget
-        else:
-            assert False
-
-        cache = self.widget_cls_cache
-        if cls in cache:
-            widget = cache[cls]
-            assert widget.parent is None
-        else:
-            widget = cache[cls] = cls()
-        if representation is not None:
-            widget.representation = representation
-        widget.setting = setting
-        widget.player = self.player
-
-        return widget
-
-
-class FlirSettingWidget(BoxLayout):
-
-    setting: Optional[CameraSetting] = ObjectProperty(
-        None, allownone=True, rebind=True)
-
-    player: FlirPlayer = ObjectProperty(None, allownone=True, rebind=True)
-
-    populated = BooleanProperty(False)
-
-
-class FlirTextSettingWidget(FlirSettingWidget):
-
-    representation = StringProperty('')
-
-    @error_guard
-    def set_value(self, text):
-        rep = self.representation
-        try:
-            if rep == 'MACAddress':
-                value = int(text, 0)
-            elif rep == 'HexNumber':
-                value = int(text, 0)
-            elif rep == 'IPV4Address':
-                value = int(ipaddress.ip_address(text))
-            elif not rep:
-                value = text
-            else:
-                assert False
-
-            self.setting.set_value(value)
-        except BaseException:
-            self.setting.property('value').dispatch(self.setting)
-            raise
-
-    @error_guard
-    def get_value(self, value):
-        rep = self.representation
-        try:
-            if not rep:
-                return value
-            if rep == 'MACAddress':
-                return hex(value)
-            elif rep == 'HexNumber':
-                return hex(value)
-            elif rep == 'IPV4Address':
-                return str(ipaddress.ip_address(value))
-            else:
-                assert False
-        except BaseException:
-            self.setting.property('value').dispatch(self.setting)
-            raise
-
-
-class FlirNumericSettingWidget(FlirSettingWidget):
-
-    _filter_cls = {IntSetting: 'int', FloatSetting: 'float'}
-
-    def get_input_filter(self, setting):
-        return self._filter_cls.get(setting.__class__)
-
-    @error_guard
-    def set_value(self, text):
-        cls_name = self._filter_cls[self.setting.__class__]
-        try:
-            if cls_name == 'int':
-                value = int(text or 0)
-            elif cls_name == 'float':
-                value = float(text or 0)
-            else:
-                assert False
-            self.setting.set_value(value)
-        except BaseException:
-            self.setting.property('value').dispatch(self.setting)
-            raise
-
-
-class FlirBoolSettingWidget(FlirSettingWidget):
-    pass
-
-
-class FlirEnumSettingWidget(FlirSettingWidget):
-    pass
-
-
-class FlirCommandSettingWidget(FlirSettingWidget):
-    pass
-
-
-Builder.load_file(join(dirname(__file__), 'rotpy_player.kv'))
+# the settings widgets are only imported from their own module when they
+# are used, so Kivy widgets and kv files are not loaded when headless
+__getattr__ = lazy_module_getattr(__name__, {
+    'FlirSettingsWidget': 'cpl_media.rotpy.widgets',
+    'FlirSettingWidget': 'cpl_media.rotpy.widgets',
+    'FlirTextSettingWidget': 'cpl_media.rotpy.widgets',
+    'FlirNumericSettingWidget': 'cpl_media.rotpy.widgets',
+    'FlirBoolSettingWidget': 'cpl_media.rotpy.widgets',
+    'FlirEnumSettingWidget': 'cpl_media.rotpy.widgets',
+    'FlirCommandSettingWidget': 'cpl_media.rotpy.widgets'})
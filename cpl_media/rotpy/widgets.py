@@ -0,0 +1,196 @@
+"""Flir player widgets
+=====================
+
+The settings widgets for :class:`~cpl_media.rotpy.FlirPlayer`.
+"""
+
+from typing import Optional
+import ipaddress
+from os.path import join, dirname
+
+from kivy.properties import ObjectProperty, StringProperty, BooleanProperty
+from kivy.uix.boxlayout import BoxLayout
+from kivy.lang import Builder
+
+from cpl_media.rotpy import FlirPlayer, CameraSetting, IntSetting, \
+    FloatSetting, StrSetting, BoolSetting, EnumSetting, CommandSetting
+from cpl_media import error_guard
+
+__all__ = (
+    'FlirSettingsWidget', 'FlirSettingWidget', 'FlirTextSettingWidget',
+    'FlirNumericSettingWidget', 'FlirBoolSettingWidget',
+    'FlirEnumSettingWidget', 'FlirCommandSettingWidget')
+
+
+class FlirSettingsWidget(BoxLayout):
+    """Settings widget for :class:`~cpl_media.rotpy.FlirPlayer`.
+    """
+
+    player: FlirPlayer = ObjectProperty(None)
+    """The player.
+    """
+
+    setting: Optional[CameraSetting] = ObjectProperty(None, allownone=True)
+
+    selected_name = StringProperty('')
+
+    current_widget = None
+
+    widget_cls_cache = {}
+
+    setting_parent: ObjectProperty(None)
+
+    def __init__(self, player=None, **kwargs):
+        if player is None:
+            player = FlirPlayer()
+        self.player = player
+        super().__init__(**kwargs)
+        self.widget_cls_cache = {}
+
+        def setting_callback(*args):
+            self.update_setting('')
+        player.fbind('available_camera_settings', setting_callback)
+        player.fbind('serial', setting_callback)
+
+    def update_setting(self, name):
+        if self.current_widget is not None:
+            self.current_widget.setting = None
+            self.current_widget.parent.remove_widget(self.current_widget)
+            self.current_widget = None
+        self.setting = None
+
+        self.selected_name = name
+        if not name:
+            return
+
+        setting = self.player.camera_settings[name]
+        widget = self.get_setting_widget(setting)
+        self.setting_parent.add_widget(widget)
+        self.current_widget = widget
+        self.setting = setting
+        setting.refresh_value()
+
+    def get_setting_widget(self, setting):
+        representation = None
+        if isinstance(setting, (IntSetting, FloatSetting)):
+            if setting.representation in (
+                    'MACAddress', 'IPV4Address', 'HexNumber'):
+                representation = setting.representation
+                cls = FlirTextSettingWidget
+            else:
+                cls = FlirNumericSettingWidget
+        elif isinstance(setting, StrSetting):
+            cls = FlirTextSettingWidget
+            representation = ''
+        elif isinstance(setting, BoolSetting):
+            cls = FlirBoolSettingWidget
+        elif isinstance(setting, EnumSetting):
+            cls = FlirEnumSettingWidget
+        elif isinstance(setting, CommandSetting):
+            cls = FlirCommandSettingWidget
+        else:
+            assert False
+
+        cache = self.widget_cls_cache
+        if cls in cache:
+            widget = cache[cls]
+            assert widget.parent is None
+        else:
+            widget = cache[cls] = cls()
+        if representation is not None:
+            widget.representation = representation
+        widget.setting = setting
+        widget.player = self.player
+
+        return widget
+
+
+class FlirSettingWidget(BoxLayout):
+
+    setting: Optional[CameraSetting] = ObjectProperty(
+        None, allownone=True, rebind=True)
+
+    player: FlirPlayer = ObjectProperty(None, allownone=True, rebind=True)
+
+    populated = BooleanProperty(False)
+
+
+class FlirTextSettingWidget(FlirSettingWidget):
+
+    representation = StringProperty('')
+
+    @error_guard
+    def set_value(self, text):
+        rep = self.representation
+        try:
+            if rep == 'MACAddress':
+                value = int(text, 0)
+            elif rep == 'HexNumber':
+                value = int(text, 0)
+            elif rep == 'IPV4Address':
+                value = int(ipaddress.ip_address(text))
+            elif not rep:
+                value = text
+            else:
+                assert False
+
+            self.setting.set_value(value)
+        except BaseException:
+            self.setting.property('value').dispatch(self.setting)
+            raise
+
+    @error_guard
+    def get_value(self, value):
+        rep = self.representation
+        try:
+            if not rep:
+                return value
+            if rep == 'MACAddress':
+                return hex(value)
+            elif rep == 'HexNumber':
+                return hex(value)
+            elif rep == 'IPV4Address':
+                return str(ipaddress.ip_address(value))
+            else:
+                assert False
+        except BaseException:
+            self.setting.property('value').dispatch(self.setting)
+            raise
+
+
+class FlirNumericSettingWidget(FlirSettingWidget):
+
+    _filter_cls = {IntSetting: 'int', FloatSetting: 'float'}
+
+    def get_input_filter(self, setting):
+        return self._filter_cls.get(setting.__class__)
+
+    @error_guard
+    def set_value(self, text):
+        cls_name = self._filter_cls[self.setting.__class__]
+        try:
+            if cls_name == 'int':
+                value = int(text or 0)
+            elif cls_name == 'float':
+                value = float(text or 0)
+            else:
+                assert False
+            self.setting.set_value(value)
+        except BaseException:
+            self.setting.property('value').dispatch(self.setting)
+            raise
+
+
+class FlirBoolSettingWidget(FlirSettingWidget):
+    pass
+
+
+class FlirEnumSettingWidget(FlirSettingWidget):
+    pass
+
+
+class FlirCommandSettingWidget(FlirSettingWidget):
+    pass
+
+
+Builder.load_file(join(dirname(__file__), 'rotpy_player.kv'))
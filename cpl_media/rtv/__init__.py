@@ -6,29 +6,20 @@ This player can play RTV24 camera feeds using :mod:`pybarst`.
 from time import perf_counter as clock
 import sys
 import itertools
-from os.path import splitext, join, exists, isdir, abspath, dirname, isfile
+from os.path import splitext, join, exists, isdir, abspath, isfile
 
 from ffpyplayer.pic import Image
 
-from kivy.clock import Clock
+from cpl_media.clock import Clock
 from kivy.properties import (
     NumericProperty, StringProperty, BooleanProperty)
-from kivy.uix.boxlayout import BoxLayout
 from kivy.logger import Logger
-from kivy.lang import Builder
 
-from cpl_media.player import BasePlayer, VideoMetadata
+from cpl_media.player import BasePlayer, VideoMetadata, FrameMetadata
 from cpl_media import error_guard
+from cpl_media.common import lazy_module_getattr, module_available
 
-try:
-    import pybarst
-    from pybarst.core.server import BarstServer
-    from pybarst.rtv import RTVChannel
-except ImportError as err:
-    RTVChannel = BarstServer = None
-    Logger.debug('cpl_media: Could not import pybarst: {}'.format(err))
-
-__all__ = ('RTVPlayer', 'RTVSettingsWidget')
+__all__ = ('RTVPlayer', )
 
 
 class RTVPlayer(BasePlayer):
@@ -82,7 +73,7 @@ class RTVPlayer(BasePlayer):
     It can be one of the keys in :attr:`video_fmts`.
     '''
 
-    is_available = BooleanProperty(BarstServer is not None)
+    is_available = BooleanProperty(module_available('pybarst'))
     """Whether pybarst is available to play."""
 
     barst_server = None
@@ -118,6 +109,11 @@ class RTVPlayer(BasePlayer):
     def play_thread_run(self):
         chan = None
         try:
+            # pybarst is only imported when playing
+            import pybarst
+            from pybarst.core.server import BarstServer
+            from pybarst.rtv import RTVChannel
+
             process_frame = self.process_frame
             paths = list(pybarst.dep_bins)
             if hasattr(sys, '_MEIPASS'):
@@ -162,30 +158,18 @@ class RTVPlayer(BasePlayer):
 
             started = False
             # use_rt = self.use_real_time
-            count = 0
-            ivl_start = 0
 
             while self.play_state != 'stopping':
                 ts, buf = chan.read()
+                ivl_end = clock()
                 if not started:
-                    ivl_start = clock()
-                    self.setattr_in_kivy_thread('ts_play', ivl_start)
+                    self.setattr_in_kivy_thread('ts_play', ivl_end)
                     Clock.schedule_once(self.complete_start)
                     started = True
 
-                ivl_end = clock()
-                if ivl_end - ivl_start >= 1.:
-                    real_rate = count / (ivl_end - ivl_start)
-                    self.setattr_in_kivy_thread('real_rate', real_rate)
-                    count = 0
-                    ivl_start = ivl_end
-
-                count += 1
-                self.increment_in_kivy_thread('frames_played')
-
                 img = Image(
                     plane_buffers=[buf], pix_fmt=ffmpeg_pix_fmt, size=(w, h))
-                process_frame(img, {'t': ts})
+                process_frame(img, FrameMetadata(ts, host_t=ivl_end))
         except Exception as e:
             self.exception(e)
         finally:
@@ -205,19 +189,7 @@ class RTVPlayer(BasePlayer):
             self.barst_server = None
 
 
-class RTVSettingsWidget(BoxLayout):
-    """Settings widget for :class:`RTVPlayer`.
-    """
-
-    player: RTVPlayer = None
-    """The player.
-    """
-
-    def __init__(self, player=None, **kwargs):
-        if player is None:
-            player = RTVPlayer()
-        self.player = player
-        super(RTVSettingsWidget, self).__init__(**kwargs)
-
-
-Builder.load_file(join(dirname(__file__), 'rtv_player.kv'))
+# the settings widgets are only imported from their own module when they
+# are used, so Kivy widgets and kv files are not loaded when headless
+__getattr__ = lazy_module_getattr(
+    __name__, {'RTVSettingsWidget': 'cpl_media.rtv.widgets'})
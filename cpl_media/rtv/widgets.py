@@ -0,0 +1,32 @@
+"""RTV player widgets
+====================
+
+The settings widget for :class:`~cpl_media.rtv.RTVPlayer`.
+"""
+
+from os.path import join, dirname
+
+from kivy.uix.boxlayout import BoxLayout
+from kivy.lang import Builder
+
+from cpl_media.rtv import RTVPlayer
+
+__all__ = ('RTVSettingsWidget', )
+
+
+class RTVSettingsWidget(BoxLayout):
+    """Settings widget for :class:`~cpl_media.rtv.RTVPlayer`.
+    """
+
+    player: RTVPlayer = None
+    """The player.
+    """
+
+    def __init__(self, player=None, **kwargs):
+        if player is None:
+            player = RTVPlayer()
+        self.player = player
+        super(RTVSettingsWidget, self).__init__(**kwargs)
+
+
+Builder.load_file(join(dirname(__file__), 'rtv_player.kv'))
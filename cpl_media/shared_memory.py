@@ -0,0 +1,495 @@
+"""Shared memory frames
+========================
+
+Provides a ring of frames in shared memory, so that other processes on the
+same computer can receive the frames of a player without the encoding and
+socket copies of :mod:`cpl_media.remote`.
+
+:class:`SharedMemoryPublisher` writes the frames of a player into a
+:class:`SharedMemoryRing`, and :class:`SharedMemoryPlayer` plays the frames
+of the ring in another process. E.g. in the process with the camera::
+
+    publisher = SharedMemoryPublisher(player, name='camera1')
+    publisher.start()
+
+and in the analysis process::
+
+    player = SharedMemoryPlayer(ring_name='camera1')
+    for image, metadata in player.iter_frames():
+        ...
+
+The writer never waits for the readers. A reader that is too slow for the
+ring skips the frames that were overwritten and counts them in
+:attr:`SharedMemoryPlayer.frames_overrun`.
+"""
+
+import os
+import json
+import struct
+from itertools import count
+from threading import Lock
+from time import sleep, perf_counter as clock
+from multiprocessing import shared_memory, parent_process
+
+from ffpyplayer.pic import Image
+
+from cpl_media.clock import Clock
+from kivy.properties import NumericProperty, StringProperty
+
+from cpl_media.player import BasePlayer, VideoMetadata, FrameMetadata
+from cpl_media import error_guard
+
+__all__ = ('SharedMemoryRing', 'SharedMemoryPublisher', 'SharedMemoryPlayer')
+
+_name_count = count()
+
+_created_names = set()
+
+
+class SharedMemoryRing(object):
+    """A fixed size ring of frame slots in a
+    :class:`multiprocessing.shared_memory.SharedMemory` block, written by
+    a single writer and read by any number of readers.
+
+    Every frame written gets the next sequence number, starting from 1, and is
+    written to slot ``seq % n_slots``. The header holds the sequence number of
+    the last frame written. Each slot holds the sequence number of its frame,
+    the image format, the plane sizes and linesizes, the JSON encoded metadata
+    and the plane data.
+
+    The slot's sequence number is set to -1 while it's written, so a reader
+    checks the slot's sequence number before and after copying the frame to
+    detect that it was overwritten (overrun) while being read, like a seqlock.
+    """
+
+    magic = b'CPLRING1'
+
+    header_struct = struct.Struct('<8sqqq')
+    """The ring header: the magic, :attr:`n_slots`, :attr:`slot_size`, and
+    :attr:`metadata_size`. It's followed by the :attr:`rate` and the sequence
+    number of the last frame written.
+    """
+
+    slot_struct = struct.Struct('<q16sii4q4qq')
+    """The slot header: the sequence number, the pixel format, the width and
+    height, the size of each of the 4 planes, their linesizes and the size of
+    the metadata.
+    """
+
+    header_size = 64
+
+    slot_header_size = 128
+
+    name = ''
+    """The name of the shared memory block.
+    """
+
+    shm: shared_memory.SharedMemory = None
+    """The :class:`multiprocessing.shared_memory.SharedMemory`.
+    """
+
+    n_slots = 8
+    """The number of frames in the ring.
+    """
+
+    slot_size = 0
+    """The maximum size in bytes of the plane data of a frame.
+    """
+
+    metadata_size = 4096
+    """The maximum size in bytes of the JSON encoded metadata of a frame.
+    """
+
+    _slot_stride = 0
+
+    _rate_offset = 32
+
+    _seq_offset = 40
+
+    def __init__(
+            self, name, create=False, n_slots=8, slot_size=0,
+            metadata_size=4096, rate=0., **kwargs):
+        super(SharedMemoryRing, self).__init__(**kwargs)
+        header_size = self.header_size
+
+        if create:
+            if not slot_size:
+                raise ValueError('The slot size must be provided')
+            stride = self.slot_header_size + metadata_size + slot_size
+            stride = (stride + 63) // 64 * 64
+            shm = self.shm = shared_memory.SharedMemory(
+                name=name, create=True, size=header_size + stride * n_slots)
+            _created_names.add(name)
+            self.header_struct.pack_into(
+                shm.buf, 0, self.magic, n_slots, slot_size, metadata_size)
+            struct.pack_into('<dq', shm.buf, self._rate_offset, rate, 0)
+        else:
+            shm = self.shm = self._attach(name)
+            magic, n_slots, slot_size, metadata_size = \
+                self.header_struct.unpack_from(shm.buf, 0)
+            if magic != self.magic:
+                shm.close()
+                raise ValueError(
+                    'Shared memory "{}" is not a frame ring'.format(name))
+            stride = self.slot_header_size + metadata_size + slot_size
+            stride = (stride + 63) // 64 * 64
+
+        self.name = name
+        self.n_slots = n_slots
+        self.slot_size = slot_size
+        self.metadata_size = metadata_size
+        self._slot_stride = stride
+
+    @staticmethod
+    def _attach(name):
+        try:
+            return shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:
+            pass
+
+        # before python 3.13 the resource tracker would unlink the block when
+        # the reader process exits, unless it's the creator's tracker, as in
+        # multiprocessing children
+        shm = shared_memory.SharedMemory(name=name)
+        if os.name == 'posix' and name not in _created_names and \
+                parent_process() is None:
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        return shm
+
+    @property
+    def rate(self):
+        """The frame rate of the player that writes the ring, or zero if
+        unknown. It can be set by the writer.
+        """
+        return struct.unpack_from('<d', self.shm.buf, self._rate_offset)[0]
+
+    @rate.setter
+    def rate(self, value):
+        struct.pack_into('<d', self.shm.buf, self._rate_offset, value)
+
+    @property
+    def write_seq(self):
+        """The sequence number of the last frame written, or zero.
+        """
+        return struct.unpack_from('<q', self.shm.buf, self._seq_offset)[0]
+
+    def _slot_offset(self, seq):
+        return self.header_size + (seq % self.n_slots) * self._slot_stride
+
+    def write(self, image, metadata):
+        """Writes the frame into the next slot.
+
+        :param image: The :class:`ffpyplayer.pic.Image`.
+        :param metadata: The frame metadata dict or
+            :class:`~cpl_media.player.FrameMetadata`. Values that are not JSON
+            serializable are converted to strings.
+        :return: The sequence number of the frame, or zero if the frame or its
+            metadata is too large for the slot and was not written.
+        """
+        planes = [
+            memoryview(plane).cast('B')
+            for plane in image.to_memoryview(keep_align=True)
+            if plane is not None]
+        sizes = [plane.nbytes for plane in planes]
+        meta = json.dumps(dict(metadata), default=str).encode('utf8')
+        if sum(sizes) > self.slot_size or len(meta) > self.metadata_size:
+            return 0
+
+        buf = self.shm.buf
+        seq = self.write_seq + 1
+        offset = self._slot_offset(seq)
+        slot_struct = self.slot_struct
+        sizes = (sizes + [0, 0, 0, 0])[:4]
+        linesizes = list(image.get_linesizes(keep_align=True))[:4]
+
+        struct.pack_into('<q', buf, offset, -1)
+        start = offset + self.slot_header_size
+        buf[start:start + len(meta)] = meta
+        start += self.metadata_size
+        for plane in planes:
+            buf[start:start + plane.nbytes] = plane
+            start += plane.nbytes
+
+        slot_struct.pack_into(
+            buf, offset, -1, image.get_pixel_format().encode('utf8'),
+            *image.get_size(), *sizes, *linesizes, len(meta))
+        struct.pack_into('<q', buf, offset, seq)
+        struct.pack_into('<q', buf, self._seq_offset, seq)
+        return seq
+
+    def read(self, seq, pool=None):
+        """Copies the frame with the given sequence number from the ring.
+
+        :param seq: The sequence number of the frame.
+        :param pool: An optional :class:`~cpl_media.player.FrameBufferPool`
+            from which to get the plane buffers.
+        :return: The ``(image, metadata)`` tuple, or None if the slot doesn't
+            hold the frame, e.g. because it was already overwritten or is
+            being written.
+        """
+        buf = self.shm.buf
+        offset = self._slot_offset(seq)
+        slot_seq, fmt, w, h, *sizes = self.slot_struct.unpack_from(buf, offset)
+        if slot_seq != seq:
+            return None
+
+        sizes, linesizes, meta_size = sizes[:4], sizes[4:8], sizes[8]
+        start = offset + self.slot_header_size
+        meta = bytes(buf[start:start + meta_size])
+        start += self.metadata_size
+
+        sizes = [size for size in sizes if size]
+        if pool is not None:
+            planes = pool.get_buffers(sizes)
+        else:
+            planes = [bytearray(size) for size in sizes]
+        for plane in planes:
+            plane[:] = buf[start:start + len(plane)]
+            start += len(plane)
+
+        if struct.unpack_from('<q', buf, offset)[0] != seq:
+            return None
+
+        image = Image(
+            plane_buffers=planes, pix_fmt=fmt.rstrip(b'\0').decode('utf8'),
+            size=(w, h), linesize=linesizes[:len(planes)])
+        return image, FrameMetadata.from_dict(json.loads(meta.decode('utf8')))
+
+    def close(self):
+        """Closes the shared memory of this process.
+        """
+        self.shm.close()
+
+    def unlink(self):
+        """Destroys the shared memory block. Should only be called by the
+        writer, once done.
+        """
+        self.shm.unlink()
+        _created_names.discard(self.name)
+
+
+class SharedMemoryPublisher(object):
+    """Publishes the frames of a player to a :class:`SharedMemoryRing`
+    from :attr:`~cpl_media.player.BasePlayer.frame_callbacks`.
+
+    The ring is created when the first frame is received, with slots large
+    enough for that frame unless :attr:`slot_size` is given. Later frames
+    that don't fit are counted in :attr:`frames_skipped`. The ring's
+    :attr:`SharedMemoryRing.rate` follows the player's
+    ``metadata_play_used`` rate.
+    """
+
+    player: BasePlayer = None
+    """The player whose frames are published.
+    """
+
+    name = ''
+    """The name of the shared memory ring, which readers use to attach.
+    """
+
+    n_slots = 8
+    """The number of frames in the ring.
+    """
+
+    slot_size = 0
+    """The maximum size of the plane data of a frame. If zero, it's the size
+    of the first frame.
+    """
+
+    metadata_size = 4096
+    """The maximum size of the JSON encoded metadata of a frame.
+    """
+
+    ring: SharedMemoryRing = None
+    """The :class:`SharedMemoryRing`, once created.
+    """
+
+    frames_published = 0
+    """The number of frames written to the ring.
+    """
+
+    frames_skipped = 0
+    """The number of frames that were too large for the ring.
+    """
+
+    _lock = None
+
+    _started = False
+
+    _rate = 0.
+
+    def __init__(
+            self, player, name='', n_slots=8, slot_size=0,
+            metadata_size=4096, **kwargs):
+        super(SharedMemoryPublisher, self).__init__(**kwargs)
+        self.player = player
+        self.name = name or 'cpl_media_{}_{}'.format(
+            os.getpid(), next(_name_count))
+        self.n_slots = n_slots
+        self.slot_size = slot_size
+        self.metadata_size = metadata_size
+        self._lock = Lock()
+
+    def start(self):
+        """Starts publishing the player's frames. May be called from the kivy
+        thread only.
+        """
+        if self._started:
+            return
+        self._started = True
+        self.player.frame_callbacks.append(self._publish)
+
+    def stop(self):
+        """Stops publishing and destroys the ring. May be called from the
+        kivy thread only.
+        """
+        if not self._started:
+            return
+        self._started = False
+        self.player.frame_callbacks.remove(self._publish)
+
+        with self._lock:
+            ring, self.ring = self.ring, None
+            if ring is not None:
+                ring.close()
+                ring.unlink()
+
+    def _publish(self, item):
+        image, metadata = item
+        with self._lock:
+            if not self._started:
+                return
+
+            ring = self.ring
+            rate = self.player.metadata_play_used.rate or 0.
+            if ring is None:
+                ring = self.ring = SharedMemoryRing(
+                    self.name, create=True, n_slots=self.n_slots,
+                    slot_size=self.slot_size or sum(
+                        image.get_buffer_size(keep_align=True)),
+                    metadata_size=self.metadata_size, rate=rate)
+            elif rate != self._rate:
+                ring.rate = rate
+            self._rate = rate
+
+            if ring.write(image, metadata):
+                self.frames_published += 1
+            else:
+                self.frames_skipped += 1
+
+
+class SharedMemoryPlayer(BasePlayer):
+    """Plays the frames published to a :class:`SharedMemoryRing`, e.g. by a
+    :class:`SharedMemoryPublisher` in another process.
+
+    It starts with the newest frame in the ring. The frame rate of
+    ``metadata_play_used`` follows the ring's :attr:`SharedMemoryRing.rate`.
+    The frames' metadata is
+    passed through, and since the :func:`time.perf_counter` clock is shared
+    by the processes, ``'host_t'`` still measures the latency from when the
+    frame was acquired in the publishing process. Each frame's metadata also
+    has its ``'ring_seq'`` sequence number.
+    """
+
+    _config_props_ = ('ring_name', 'poll_interval', 'attach_timeout')
+
+    ring_name = StringProperty('')
+    """The name of the :class:`SharedMemoryRing` to play, i.e.
+    :attr:`SharedMemoryPublisher.name`.
+    """
+
+    poll_interval = NumericProperty(.001)
+    """How long to sleep in seconds when there are no new frames in the ring,
+    before checking again.
+    """
+
+    attach_timeout = NumericProperty(5)
+    """How long to wait in seconds for the ring to be created, when starting
+    to play.
+    """
+
+    frames_overrun = NumericProperty(0)
+    """The number of frames that were overwritten in the ring before we could
+    read them, since :meth:`play` was called.
+    """
+
+    def __init__(self, **kwargs):
+        super(SharedMemoryPlayer, self).__init__(**kwargs)
+        self.fbind('ring_name', self._update_summary)
+        self._update_summary()
+
+    def _update_summary(self, *largs):
+        self.player_summery = 'Shared memory "{}"'.format(self.ring_name)
+
+    @error_guard
+    def play(self):
+        if not self.ring_name:
+            raise TypeError('No shared memory ring name was provided')
+
+        if not super(SharedMemoryPlayer, self).play():
+            return False
+        self.frames_overrun = 0
+        return True
+
+    def play_thread_run(self):
+        ring = None
+        try:
+            name = self.ring_name
+            poll_interval = self.poll_interval
+            end = clock() + self.attach_timeout
+            while ring is None and self.play_state != 'stopping':
+                try:
+                    ring = SharedMemoryRing(name)
+                except FileNotFoundError:
+                    if clock() >= end:
+                        raise
+                    sleep(.05)
+            if ring is None:
+                return
+
+            n_slots = ring.n_slots
+            pool = self.frame_pool
+            process_frame = self.process_frame
+            seq = max(ring.write_seq, 1)
+            rate = None
+            started = False
+
+            while self.play_state != 'stopping':
+                write_seq = ring.write_seq
+                if seq > write_seq:
+                    sleep(poll_interval)
+                    continue
+
+                # the oldest frame that may still be in the ring
+                oldest = write_seq - n_slots + 1
+                if seq < oldest:
+                    self.increment_stat_in_kivy_thread(
+                        'frames_overrun', oldest - seq)
+                    seq = oldest
+
+                item = ring.read(seq, pool)
+                if item is None:
+                    # overwritten while reading, the next loop skips it
+                    continue
+
+                image, metadata = item
+                metadata['ring_seq'] = seq
+                seq += 1
+                if rate != ring.rate:
+                    rate = ring.rate
+                    self.setattr_in_kivy_thread(
+                        'metadata_play_used', VideoMetadata(
+                            image.get_pixel_format(), *image.get_size(), rate))
+                if not started:
+                    self.setattr_in_kivy_thread('ts_play', clock())
+                    Clock.schedule_once(self.complete_start)
+                    started = True
+
+                process_frame(image, metadata)
+        except Exception as e:
+            self.exception(e)
+        finally:
+            if ring is not None:
+                ring.close()
+            Clock.schedule_once(self.complete_stop)
@@ -0,0 +1,424 @@
+"""Frame processing stages
+===========================
+
+Provides players that process the frames of another player, so that a
+transform needed by multiple consumers is only computed once.
+
+Each stage is a :class:`~cpl_media.player.BasePlayer` that subscribes to its
+:attr:`StagePlayer.source` player, processes the frames in its own play thread
+and plays the results. Stages can be chained into a graph, since any player,
+including a stage, can be the source of multiple stages. And like any other
+player, recorders, the display, and subscribers can attach to any stage. E.g.::
+
+    player = FFmpegPlayer(play_filename='video.mp4')
+    small = ScaleStage(source=player, output_size=[640, 0])
+    gray = PixelFormatStage(source=small, output_pix_fmt='gray')
+    slow = DecimateStage(source=small, factor=3)
+
+    player.play()
+    for stage in (small, gray, slow):
+        stage.play()
+
+    slow.display_frame = display
+    recorder.record(gray)
+
+A stage stops when its source stops, after processing the frames it already
+received.
+"""
+
+from time import perf_counter as clock
+
+from cpl_media.clock import Clock
+from kivy.properties import (
+    NumericProperty, ObjectProperty, StringProperty, ListProperty)
+
+from cpl_media.player import BasePlayer, VideoMetadata, FrameSubscriber, \
+    sws_cache, get_image_arrays, image_from_arrays, plane_layouts
+from cpl_media.common import LatencyHistogram
+from cpl_media import error_guard
+
+__all__ = (
+    'StagePlayer', 'CropStage', 'ScaleStage', 'PixelFormatStage',
+    'DecimateStage', 'LUTStage', 'CallableStage')
+
+
+class StagePlayer(BasePlayer):
+    """Base class for the players that process the frames of their
+    :attr:`source` player.
+
+    Subclasses implement :meth:`process_stage` and optionally
+    :meth:`prepare_stage` and :meth:`get_stage_rate`.
+
+    In addition to the :attr:`~cpl_media.player.BasePlayer.real_rate`
+    throughput, :attr:`~cpl_media.player.BasePlayer.latency_histograms` has a
+    ``'stage'`` histogram of the duration of :meth:`process_stage` for each
+    frame. The ``'process'`` histogram measures the latency from when the
+    frame was acquired by the first player, until it was processed by the
+    stage.
+    """
+
+    _config_props_ = ('source_queue_size', 'source_queue_policy')
+
+    source: BasePlayer = ObjectProperty(None, allownone=True)
+    """The player whose frames are processed. It may also be a stage.
+
+    It's read when the stage starts playing.
+    """
+
+    source_queue_size = NumericProperty(4)
+    """The maximum number of frames from :attr:`source` that may be waiting
+    to be processed. Zero means unbounded.
+    """
+
+    source_queue_policy = StringProperty('block')
+    """What to do when the queue of frames from the :attr:`source` is full.
+    Can be one of :attr:`cpl_media.player.FrameQueue.policies`.
+
+    With ``'block'``, no frames are lost but a slow stage delays the source.
+    """
+
+    source_subscriber: FrameSubscriber = None
+    """The :class:`~cpl_media.player.FrameSubscriber` through which we
+    receive the frames from the :attr:`source` while playing.
+    """
+
+    _source = None
+
+    _source_uids = ()
+
+    _stage_format = None
+
+    def __init__(self, **kwargs):
+        super(StagePlayer, self).__init__(**kwargs)
+        self.latency_histograms['stage'] = LatencyHistogram()
+        self.fbind('source', self._update_summary)
+        self._update_summary()
+
+    def _update_summary(self, *largs):
+        source = self.source
+        self.player_summery = '{} of {}'.format(
+            self.__class__.__name__,
+            source.player_summery if source is not None else 'nothing')
+
+    def prepare_stage(self):
+        """Called from the kivy thread when the stage starts playing, before
+        the play thread is started. Subclasses can read their settings here,
+        so that they don't change while playing.
+        """
+        pass
+
+    def process_stage(self, image, metadata):
+        """Called from the play thread to process each frame from the
+        :attr:`source`.
+
+        :param image: The :class:`ffpyplayer.pic.Image`.
+        :param metadata: The frame metadata. It's shared with the other
+            consumers of the source, so it must not be modified.
+        :return: The processed ``(image, metadata)`` tuple to be played, or
+            None to drop the frame.
+        """
+        raise NotImplementedError
+
+    def get_stage_rate(self, rate):
+        """Returns the frame rate of the stage given the frame rate of the
+        :attr:`source`.
+        """
+        return rate
+
+    @error_guard
+    def play(self):
+        source = self.source
+        if source is None:
+            raise TypeError('Cannot play a stage without a source')
+        if self.play_state != 'none':
+            raise TypeError('Asked to play while {}'.format(self.play_state))
+
+        self.prepare_stage()
+        self._source = source
+        self.source_subscriber = source.subscribe(
+            maxsize=self.source_queue_size, policy=self.source_queue_policy,
+            name=self.player_summery)
+        self._stage_format = None
+        self._source_uids = (
+            source.fbind('play_state', self._source_state_changed),
+            source.fbind('metadata_play_used', self._update_stage_metadata))
+
+        if not super(StagePlayer, self).play():
+            self._unsubscribe_source()
+            return False
+        return True
+
+    def _source_state_changed(self, *largs):
+        if self._source.play_state == 'none':
+            self.stop()
+
+    def _update_stage_metadata(self, *largs):
+        if self._stage_format is None:
+            return
+
+        self.metadata_play_used = VideoMetadata(
+            *self._stage_format,
+            self.get_stage_rate(self._source.metadata_play_used.rate))
+
+    def _complete_stage_start(self, ts, fmt, w, h):
+        # the source's metadata is only final in the kivy thread
+        self.ts_play = ts
+        self._stage_format = fmt, w, h
+        self._update_stage_metadata()
+        self.complete_start()
+
+    def _unsubscribe_source(self):
+        source = self._source
+        if source is None:
+            return
+
+        if self._source_uids:
+            play_uid, metadata_uid = self._source_uids
+            source.unbind_uid('play_state', play_uid)
+            source.unbind_uid('metadata_play_used', metadata_uid)
+            self._source_uids = ()
+        if self.source_subscriber is not None:
+            source.unsubscribe(self.source_subscriber)
+            self.source_subscriber = None
+        self._source = None
+
+    @error_guard
+    def stop(self, *largs, join=False):
+        # the play thread exits once it processed the frames already received
+        if self.play_state in ('starting', 'playing') and \
+                self.source_subscriber is not None:
+            self._source.unsubscribe(self.source_subscriber)
+        return super(StagePlayer, self).stop(join=join)
+
+    def complete_stop(self, *largs):
+        super(StagePlayer, self).complete_stop(*largs)
+        self._unsubscribe_source()
+
+    def play_thread_run(self):
+        try:
+            queue = self.source_subscriber.queue
+            process_stage = self.process_stage
+            process_frame = self.process_frame
+            histogram = self.latency_histograms['stage']
+            started = False
+
+            while True:
+                item = queue.get()
+                if item == 'eof':
+                    break
+
+                ts = clock()
+                item = process_stage(*item)
+                histogram.add(clock() - ts)
+                if item is None:
+                    continue
+
+                image, metadata = item
+                if not started:
+                    self.call_in_kivy_thread(
+                        self._complete_stage_start, ts,
+                        image.get_pixel_format(), *image.get_size())
+                    started = True
+
+                process_frame(image, metadata)
+        except Exception as e:
+            self.exception(e)
+        finally:
+            Clock.schedule_once(self.complete_stop)
+
+
+class CropStage(StagePlayer):
+    """Crops the frames to :attr:`roi`. Requires numpy and a pixel format
+    listed in :attr:`cpl_media.player.plane_layouts`.
+    """
+
+    _config_props_ = ('roi', )
+
+    roi = ListProperty([0, 0, 0, 0])
+    """The ``[x, y, w, h]`` region to crop from the frames. A zero width or
+    height means until the end of the frame.
+
+    The ``x`` and ``y`` position is rounded down to a multiple of the
+    subsampling of the pixel format, e.g. to an even position for
+    ``yuv420p`` or ``uyvy422``.
+    """
+
+    _roi = None
+
+    def prepare_stage(self):
+        self._roi = tuple(self.roi)
+
+    def process_stage(self, image, metadata):
+        x, y, w, h = self._roi
+        fmt = image.get_pixel_format()
+        iw, ih = image.get_size()
+        planes = plane_layouts[fmt][1]
+
+        x_div = max(plane[0] * plane[3] for plane in planes)
+        y_div = max(plane[1] for plane in planes)
+        x = min(x - x % x_div, iw - 1)
+        y = min(y - y % y_div, ih - 1)
+        w = min(w or iw, iw - x)
+        h = min(h or ih, ih - y)
+
+        arrays = []
+        for arr, (x_div, y_div, _, x_align) in zip(
+                get_image_arrays(image), planes):
+            end = (x + w + x_div - 1) // x_div
+            end = (end + x_align - 1) // x_align * x_align
+            arrays.append(arr[
+                y // y_div:(y + h + y_div - 1) // y_div, x // x_div:end])
+        return image_from_arrays(
+            arrays, fmt, (w, h), pool=self.frame_pool), metadata
+
+
+class ScaleStage(StagePlayer):
+    """Scales the frames to :attr:`output_size`, using
+    :attr:`cpl_media.player.sws_cache`.
+    """
+
+    _config_props_ = ('output_size', )
+
+    output_size = ListProperty([0, 0])
+    """The ``[width, height]`` of the scaled frames. If one of them is zero,
+    it's computed from the other, keeping the aspect ratio. If both are zero,
+    the size is unchanged.
+    """
+
+    _output_size = None
+
+    def prepare_stage(self):
+        self._output_size = tuple(self.output_size)
+
+    def process_stage(self, image, metadata):
+        w, h = self._output_size
+        iw, ih = image.get_size()
+        if w and not h:
+            h = max(int(round(ih * w / iw)), 1)
+        elif h and not w:
+            w = max(int(round(iw * h / ih)), 1)
+        return sws_cache.scale(image, w, h), metadata
+
+
+class PixelFormatStage(StagePlayer):
+    """Converts the frames to :attr:`output_pix_fmt`, using
+    :attr:`cpl_media.player.sws_cache`.
+    """
+
+    _config_props_ = ('output_pix_fmt', )
+
+    output_pix_fmt = StringProperty('')
+    """The pixel format to which the frames are converted. If empty, the
+    frames are unchanged.
+    """
+
+    _output_pix_fmt = ''
+
+    def prepare_stage(self):
+        self._output_pix_fmt = self.output_pix_fmt
+
+    def process_stage(self, image, metadata):
+        return sws_cache.scale(image, ofmt=self._output_pix_fmt), metadata
+
+
+class DecimateStage(StagePlayer):
+    """Only plays every :attr:`factor` frame of the source.
+
+    If the frames have a ``'count'`` metadata key, it's replaced by the count
+    of the played frames and the original count is saved in
+    ``'source_count'``, so the stage's frames are not seen as dropped frames.
+    """
+
+    _config_props_ = ('factor', )
+
+    factor = NumericProperty(2)
+    """The decimation factor. E.g. for 3, every third frame is played.
+    """
+
+    _factor = 1
+
+    _count = 0
+
+    def prepare_stage(self):
+        self._factor = max(int(self.factor), 1)
+        self._count = 0
+
+    def get_stage_rate(self, rate):
+        return rate / self._factor
+
+    def process_stage(self, image, metadata):
+        count = self._count
+        self._count += 1
+        if count % self._factor:
+            return None
+
+        if 'count' in metadata:
+            metadata = metadata.copy()
+            metadata['source_count'] = metadata['count']
+            metadata['count'] = count // self._factor
+        return image, metadata
+
+
+class LUTStage(StagePlayer):
+    """Maps the pixel values of the frames through the lookup table
+    :attr:`lut`. Requires numpy and a pixel format listed in
+    :attr:`cpl_media.player.plane_layouts`.
+    """
+
+    lut = ObjectProperty(None, allownone=True, force_dispatch=True)
+    """The lookup table numpy array. It's indexed with the pixel values so it
+    must have an entry for every possible value, e.g. 256 ``uint8`` entries
+    for 8-bit formats. If None, the frames are unchanged.
+    """
+
+    lut_planes = ListProperty([])
+    """The indices of the planes to which :attr:`lut` is applied. E.g.
+    ``[0]`` for only the luma plane of ``yuv420p`` frames. If empty, it's
+    applied to all the planes.
+    """
+
+    _lut = None
+
+    _lut_planes = ()
+
+    def prepare_stage(self):
+        self._lut = self.lut
+        self._lut_planes = tuple(self.lut_planes)
+
+    def process_stage(self, image, metadata):
+        lut = self._lut
+        if lut is None:
+            return image, metadata
+
+        planes = self._lut_planes
+        arrays = [
+            lut[arr] if not planes or i in planes else arr
+            for i, arr in enumerate(get_image_arrays(image))]
+        return image_from_arrays(
+            arrays, image.get_pixel_format(), image.get_size(),
+            pool=self.frame_pool), metadata
+
+
+class CallableStage(StagePlayer):
+    """Processes the frames with the user provided :attr:`function`.
+    """
+
+    function = ObjectProperty(None, allownone=True)
+    """The function called from the play thread with the ``image`` and
+    ``metadata`` of each frame. It returns the processed ``(image, metadata)``
+    tuple, or None to drop the frame, like
+    :meth:`StagePlayer.process_stage`. The metadata must be copied if it's
+    modified.
+
+    If None, the frames are unchanged.
+    """
+
+    _function = None
+
+    def prepare_stage(self):
+        self._function = self.function
+
+    def process_stage(self, image, metadata):
+        if self._function is None:
+            return image, metadata
+        return self._function(image, metadata)
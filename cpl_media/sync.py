@@ -0,0 +1,329 @@
+"""Frame synchronization
+=========================
+
+Provides :class:`FrameSyncGroup`, which matches the frames of multiple
+players by their timestamps, e.g. to record multiple cameras in sync. E.g.::
+
+    group = FrameSyncGroup([player1, player2], tolerance=.005)
+    group.start()
+
+    # get the matched frames from a queue
+    subscriber = group.subscribe(maxsize=8)
+    frames, metadata = subscriber.queue.get()
+    (image1, metadata1), (image2, metadata2) = frames
+
+    # or record only the matched frames of player1
+    recorder.record(group.get_source(0))
+"""
+
+from collections import deque
+from functools import partial
+from threading import Lock
+from typing import List
+
+from .player import BasePlayer, FrameSubscriber
+
+__all__ = ('FrameSyncGroup', 'SyncedSource')
+
+
+class FrameSyncGroup(object):
+    """Subscribes to the frames of multiple
+    :class:`~cpl_media.player.BasePlayer` and emits a matched item whenever
+    each player has a frame whose timestamp is within :attr:`tolerance` of the
+    others.
+
+    The frames of each player are buffered in a bounded deque, in the order
+    they arrive, which must be increasing time. Once every buffer has at least
+    one frame, the oldest frames are matched if their timestamps are within
+    :attr:`tolerance`. Otherwise, the oldest frames that are too old to match
+    the newest of the oldest frames are discarded as unmatched. So each frame
+    is examined a constant number of times.
+
+    Each matched item is a 2-tuple of ``(frames, metadata)``, where ``frames``
+    is a tuple with the ``(image, metadata)`` frame of each player, in the
+    order of :attr:`players`. ``metadata`` is a dict with ``'t'``, the
+    timestamp of the first player's frame, ``'host_t'``, the earliest
+    ``'host_t'`` of the frames and ``'spread'``, the difference between the
+    largest and smallest timestamps of the frames.
+
+    The matched items are delivered to the subscribers added with
+    :meth:`subscribe`. :meth:`get_source` provides a player-like view of one
+    player's matched frames, which can be passed to a recorder.
+    """
+
+    players: List[BasePlayer] = []
+    """The players whose frames are matched.
+    """
+
+    tolerance = .005
+    """The maximum difference in seconds between the timestamps of the frames
+    of a matched item.
+    """
+
+    time_key = 'host_t'
+    """The key in the frames' metadata of the timestamps that are matched.
+
+    The default ``'host_t'`` is the time the frame was acquired by the
+    player, which is comparable between players. Camera timestamps (``'t'``)
+    are typically only comparable between cameras that are synchronized.
+    """
+
+    maxsize = 32
+    """The maximum number of frames buffered for each player. When exceeded,
+    the oldest frame is discarded as unmatched.
+    """
+
+    frame_subscribers: List[FrameSubscriber] = []
+    """The list of :class:`~cpl_media.player.FrameSubscriber` added with
+    :meth:`subscribe` that receive the matched items.
+    """
+
+    matched = 0
+    """The number of matched items emitted.
+    """
+
+    unmatched = []
+    """For each player, the number of frames that were discarded because no
+    frame of the other players matched them, or because the buffer was full.
+    """
+
+    late = []
+    """For each player, the number of frames that were discarded because they
+    arrived after a newer frame of the player was already matched.
+    """
+
+    _lock = None
+
+    _buffers = []
+
+    _last_matched = []
+
+    _subscribers = []
+
+    _source_subscribers = []
+
+    def __init__(
+            self, players, tolerance=.005, time_key='host_t', maxsize=32,
+            **kwargs):
+        super(FrameSyncGroup, self).__init__(**kwargs)
+        if len(players) < 2:
+            raise ValueError('Need at least two players to sync')
+
+        self.players = list(players)
+        self.tolerance = tolerance
+        self.time_key = time_key
+        self.maxsize = maxsize
+        self.frame_subscribers = []
+        self._lock = Lock()
+        self._subscribers = []
+        self._source_subscribers = []
+        self.reset()
+
+    def reset(self):
+        """Clears the buffered frames and the statistics.
+        """
+        n = len(self.players)
+        with self._lock:
+            self._buffers = [deque() for _ in range(n)]
+            self._last_matched = [None, ] * n
+            self.matched = 0
+            self.unmatched = [0, ] * n
+            self.late = [0, ] * n
+
+    def start(self):
+        """Subscribes to the frames of the :attr:`players`.
+
+        The frames are matched from the subscribers' delivery threads.
+        """
+        if self._subscribers:
+            return
+
+        self._subscribers = [
+            player.subscribe(
+                callback=partial(self._add_frame, i), maxsize=self.maxsize,
+                policy='drop_oldest', name='sync group',
+                on_drop=partial(self._drop_frame, i))
+            for i, player in enumerate(self.players)]
+
+    def stop(self, join=False):
+        """Unsubscribes from the :attr:`players` and clears the buffered
+        frames.
+
+        :param join: Whether to wait for the delivery threads to exit.
+        """
+        subscribers, self._subscribers = self._subscribers, []
+        for player, subscriber in zip(self.players, subscribers):
+            player.unsubscribe(subscriber, join=join)
+
+        with self._lock:
+            for buffer in self._buffers:
+                buffer.clear()
+
+    def _drop_frame(self, i, item):
+        with self._lock:
+            self.unmatched[i] += 1
+
+    def _add_frame(self, i, item):
+        """Called from the delivery thread of player ``i`` with its frame.
+        """
+        key = self.time_key
+        t = item[1][key]
+        tolerance = self.tolerance
+        with self._lock:
+            last = self._last_matched[i]
+            if last is not None and t <= last:
+                self.late[i] += 1
+                return
+
+            buffer = self._buffers[i]
+            if len(buffer) >= self.maxsize:
+                buffer.popleft()
+                self.unmatched[i] += 1
+            buffer.append((t, item))
+
+            buffers = self._buffers
+            unmatched = self.unmatched
+            while all(buffers):
+                times = [buffer[0][0] for buffer in buffers]
+                t_min = min(times)
+                t_max = max(times)
+
+                if t_max - t_min <= tolerance:
+                    frames = tuple(buffer.popleft()[1] for buffer in buffers)
+                    self._last_matched = times
+                    self.matched += 1
+
+                    host_ts = [
+                        m['host_t'] for _, m in frames if 'host_t' in m]
+                    metadata = {
+                        't': frames[0][1].get('t', times[0]),
+                        'spread': t_max - t_min}
+                    if host_ts:
+                        metadata['host_t'] = min(host_ts)
+
+                    for subscriber in self.frame_subscribers:
+                        subscriber.queue.put((frames, metadata))
+                    for j, subscriber in self._source_subscribers:
+                        subscriber.queue.put(frames[j])
+                    continue
+
+                # these frames are too old to match the newest oldest frame
+                for j, buffer in enumerate(buffers):
+                    while buffer and buffer[0][0] < t_max - tolerance:
+                        buffer.popleft()
+                        unmatched[j] += 1
+
+    def subscribe(
+            self, callback=None, maxsize=0, policy='block', name='',
+            on_drop=None, queue=None):
+        """Adds a :class:`~cpl_media.player.FrameSubscriber` that receives
+        the matched items. It accepts the same parameters as
+        :meth:`cpl_media.player.BasePlayer.subscribe`.
+
+        With the ``'block'`` policy, a full subscriber queue blocks the
+        matching of all the players.
+        """
+        subscriber = FrameSubscriber(
+            callback=callback, maxsize=maxsize, policy=policy, name=name,
+            on_drop=on_drop, queue=queue)
+        subscriber.start()
+        self.frame_subscribers = self.frame_subscribers + [subscriber]
+        return subscriber
+
+    def unsubscribe(self, subscriber, join=False):
+        """Removes the subscriber added with :meth:`subscribe`.
+
+        :param subscriber: The :class:`~cpl_media.player.FrameSubscriber`.
+        :param join: Whether to wait for its delivery thread to exit.
+        """
+        self.frame_subscribers = [
+            s for s in self.frame_subscribers if s is not subscriber]
+        subscriber.stop(join=join)
+
+    def _add_source_subscriber(self, index, subscriber):
+        self._source_subscribers = self._source_subscribers + [
+            (index, subscriber)]
+
+    def _remove_source_subscriber(self, subscriber):
+        self._source_subscribers = [
+            item for item in self._source_subscribers
+            if item[1] is not subscriber]
+
+    def get_source(self, index):
+        """Returns a :class:`SyncedSource` for the matched frames of the
+        player at the given index of :attr:`players`.
+        """
+        return SyncedSource(self, index)
+
+    def get_stats(self):
+        """Returns a dict with the ``matched``, ``unmatched``, and ``late``
+        counts, and the number of frames currently ``buffered`` for each
+        player.
+        """
+        with self._lock:
+            return {
+                'matched': self.matched, 'unmatched': list(self.unmatched),
+                'late': list(self.late),
+                'buffered': [len(buffer) for buffer in self._buffers]}
+
+
+class SyncedSource(object):
+    """A view of a player of a :class:`FrameSyncGroup`, whose subscribers only
+    receive the player's frames that were matched.
+
+    All the other attributes are forwarded to the player, so it can be
+    passed to e.g. :meth:`cpl_media.recorder.BaseRecorder.record` instead of
+    the player to record only the synchronized frames. Recording each of the
+    group's players like this results in the same number of frames in each
+    recording.
+    """
+
+    group: FrameSyncGroup = None
+    """The :class:`FrameSyncGroup`.
+    """
+
+    index = 0
+    """The index of the player in :attr:`FrameSyncGroup.players`.
+    """
+
+    player: BasePlayer = None
+    """The player.
+    """
+
+    frame_subscribers: List[FrameSubscriber] = []
+    """The list of :class:`~cpl_media.player.FrameSubscriber` added with
+    :meth:`subscribe`.
+    """
+
+    def __init__(self, group, index, **kwargs):
+        super(SyncedSource, self).__init__(**kwargs)
+        self.group = group
+        self.index = index
+        self.player = group.players[index]
+        self.frame_subscribers = []
+
+    def __getattr__(self, name):
+        return getattr(self.player, name)
+
+    def subscribe(
+            self, callback=None, maxsize=0, policy='block', name='',
+            on_drop=None, queue=None):
+        """Adds a :class:`~cpl_media.player.FrameSubscriber` that receives
+        the player's ``(image, metadata)`` frames that were matched. It accepts
+        the same parameters as :meth:`cpl_media.player.BasePlayer.subscribe`.
+        """
+        subscriber = FrameSubscriber(
+            callback=callback, maxsize=maxsize, policy=policy, name=name,
+            on_drop=on_drop, queue=queue)
+        subscriber.start()
+        self.group._add_source_subscriber(self.index, subscriber)
+        self.frame_subscribers = self.frame_subscribers + [subscriber]
+        return subscriber
+
+    def unsubscribe(self, subscriber, join=False):
+        """Removes the subscriber added with :meth:`subscribe`.
+        """
+        self.frame_subscribers = [
+            s for s in self.frame_subscribers if s is not subscriber]
+        self.group._remove_source_subscriber(subscriber)
+        subscriber.stop(join=join)
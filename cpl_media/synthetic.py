@@ -0,0 +1,323 @@
+"""Synthetic player
+===================
+
+Provides :class:`SyntheticPlayer`, a player that generates test pattern
+frames at a configurable size, pixel format and rate without any hardware,
+e.g. to load test recorders or the network path. E.g.::
+
+    player = SyntheticPlayer(
+        frame_size=[3840, 2160], pix_fmt='yuv420p', frame_rate=240,
+        pattern='moving_bar')
+    player.play()
+
+Each frame has its ``count`` embedded in its top left corner, which can be
+read back with :func:`read_frame_counter`, e.g. from a recording to check
+that no frames were lost.
+"""
+
+import struct
+import time
+from random import Random
+from time import perf_counter as clock
+
+from ffpyplayer.pic import Image
+
+from cpl_media.clock import Clock
+from kivy.properties import NumericProperty, StringProperty, \
+    BooleanProperty, ListProperty, OptionProperty
+
+from cpl_media.player import BasePlayer, VideoMetadata, FrameMetadata, \
+    sws_cache
+
+__all__ = ('SyntheticPlayer', 'read_frame_counter')
+
+_counter_bits = 32
+
+_counter_struct = struct.Struct('<I')
+
+
+def _counter_geometry(line_bytes, h):
+    """Returns the ``(width, height)`` in bytes of each bit block of the frame
+    counter, for the first plane of an image with the given number of bytes
+    in each line, excluding any alignment, and height. Width is zero if the
+    counter doesn't fit.
+    """
+    return min(8, line_bytes // _counter_bits), min(8, h)
+
+
+def read_frame_counter(image):
+    """Reads the frame ``count`` embedded by :class:`SyntheticPlayer` in the
+    image.
+
+    The counter is encoded as 32 black or white blocks at the start of the
+    first plane, so it survives the pixel format conversions and mild lossy
+    compression of the recorders.
+
+    :param image: The :class:`ffpyplayer.pic.Image`.
+    :return: The count, modulo ``2 ** 32``, or None if the image is too small
+        to hold a counter.
+    """
+    line_bytes = image.get_linesizes(keep_align=False)[0]
+    linesize = image.get_linesizes(keep_align=True)[0]
+    h = image.get_size()[1]
+    block_w, block_h = _counter_geometry(line_bytes, h)
+    if not block_w:
+        return None
+
+    # sample the center of each block
+    plane = image.to_memoryview(keep_align=True)[0]
+    offset = (block_h // 2) * linesize + block_w // 2
+    value = 0
+    for i in range(_counter_bits):
+        if plane[offset + i * block_w] > 127:
+            value |= 1 << i
+    return value
+
+
+class SyntheticPlayer(BasePlayer):
+    """A player that generates test pattern frames.
+
+    When played, :attr:`pattern_frames` distinct frames of the :attr:`pattern`
+    are generated once, and then each frame is copied from them into a buffer
+    of the :attr:`~cpl_media.player.BasePlayer.frame_pool`, and its counter is
+    embedded. So generating a frame costs about one copy of the frame, e.g.
+    about a millisecond for a 4K frame, and the pool's buffers are reused once
+    the consumers released them.
+
+    Frames are generated at :attr:`frame_rate` using the host clock. Like a
+    camera, the frame ``'t'`` in the metadata is the ideal time of the frame
+    since :meth:`play`, and ``'count'`` is its index. If the player falls more
+    than a frame and 20 ms behind, e.g. because the frame callbacks are slow,
+    the late frames are skipped, which shows up as gaps in ``count``.
+    """
+
+    _config_props_ = (
+        'pix_fmt', 'frame_size', 'frame_rate', 'pattern', 'pattern_frames',
+        'embed_counter', 'drop_probability', 'jitter', 'seed', 'max_frames')
+
+    pix_fmt = StringProperty('gray')
+    """The pixel format of the generated frames. Any format supported by
+    FFmpeg's swscale may be used.
+    """
+
+    frame_size = ListProperty([640, 480])
+    """The ``[width, height]`` of the generated frames.
+    """
+
+    frame_rate = NumericProperty(30.)
+    """The rate at which frames are generated. If zero, frames are generated
+    as fast as possible.
+    """
+
+    pattern = OptionProperty(
+        'moving_bar',
+        options=['moving_bar', 'gradient', 'checkerboard', 'noise', 'solid'])
+    """The test pattern. ``'moving_bar'`` is a vertical bar that moves
+    horizontally, ``'gradient'`` is a horizontal ramp and ``'checkerboard'``
+    is a checkerboard, both scrolling horizontally, ``'noise'`` is random
+    pixels and ``'solid'`` is a uniform gray frame.
+    """
+
+    pattern_frames = NumericProperty(8)
+    """The number of distinct frames generated when playing, which are then
+    repeated. Moving patterns complete a cycle in this many frames.
+
+    All these frames are held in memory while playing.
+    """
+
+    embed_counter = BooleanProperty(True)
+    """Whether the frame ``count`` is embedded in the frames. See
+    :func:`read_frame_counter`.
+    """
+
+    drop_probability = NumericProperty(0)
+    """The probability that each frame is dropped, to simulate frames dropped
+    by a camera. The ``count`` of dropped frames is skipped.
+    """
+
+    jitter = NumericProperty(0)
+    """The standard deviation in seconds of a random delay added to the time
+    when each frame is generated, to simulate the delivery jitter of a camera.
+    The frame ``'t'`` is not affected.
+    """
+
+    seed = NumericProperty(0)
+    """The seed of the random generator used for :attr:`drop_probability`,
+    :attr:`jitter` and the ``'noise'`` pattern.
+    """
+
+    max_frames = NumericProperty(0)
+    """The number of frames, including dropped frames, after which the player
+    stops by itself, like at the end of a file. If zero, it plays until
+    stopped.
+    """
+
+    def __init__(self, **kwargs):
+        super(SyntheticPlayer, self).__init__(**kwargs)
+        for prop in ('pix_fmt', 'frame_size', 'frame_rate', 'pattern'):
+            self.fbind(prop, self._update_metadata)
+            self.fbind(prop, self._update_summary)
+        self._update_metadata()
+        self._update_summary()
+
+    def _update_metadata(self, *largs):
+        w, h = self.frame_size
+        self.metadata_play = VideoMetadata(
+            self.pix_fmt, w, h, self.frame_rate)
+
+    def _update_summary(self, *largs):
+        w, h = self.frame_size
+        self.player_summery = 'Synthetic {} {}x{} {} @ {:g}'.format(
+            self.pattern, w, h, self.pix_fmt, self.frame_rate)
+
+    def _generate_gray_frame(self, i, n, w, h, rng):
+        """Returns the bytes of frame ``i`` of ``n`` of the :attr:`pattern`,
+        as a ``gray`` image.
+        """
+        pattern = self.pattern
+        if pattern == 'solid':
+            return bytes([128]) * (w * h)
+        if pattern == 'noise':
+            return rng.getrandbits(8 * w * h).to_bytes(w * h, 'little')
+
+        shift = i * w // n
+        if pattern == 'gradient':
+            row = bytes((x + shift) % w * 256 // w for x in range(w))
+            return row * h
+
+        if pattern == 'checkerboard':
+            square = max(1, min(w, h) // 8)
+            rows = [
+                bytes(
+                    255 if ((x + shift) // square + y) % 2 else 0
+                    for x in range(w))
+                for y in range(2)]
+            return b''.join(
+                rows[(y // square) % 2] for y in range(h))
+
+        bar = max(1, w // 16)
+        row = bytearray([16]) * w
+        for x in range(shift, shift + bar):
+            row[x % w] = 235
+        return bytes(row) * h
+
+    def _generate_frames(self, fmt, w, h):
+        """Returns the list of the plane bytes of the :attr:`pattern_frames`
+        frames, in the given format.
+        """
+        n = max(1, int(self.pattern_frames))
+        rng = Random(self.seed)
+        frames = []
+        for i in range(n):
+            image = Image(
+                plane_buffers=[self._generate_gray_frame(i, n, w, h, rng)],
+                pix_fmt='gray', size=(w, h))
+            image = sws_cache.scale(image, ofmt=fmt)
+            frames.append([bytes(p) for p in image.to_bytearray() if p])
+        return frames
+
+    @staticmethod
+    def _get_counter_rows(line_bytes, h):
+        """Returns the ``(block_h, table)``, where ``table`` maps each byte to
+        the counter row bytes of its 8 bits, or None if the counter doesn't
+        fit.
+        """
+        block_w, block_h = _counter_geometry(line_bytes, h)
+        if not block_w:
+            return None
+
+        on, off = bytes([255]) * block_w, bytes(block_w)
+        table = [
+            b''.join(on if value & (1 << bit) else off for bit in range(8))
+            for value in range(256)]
+        return block_h, table
+
+    def play_thread_run(self):
+        try:
+            self._play_thread_run()
+        except Exception as e:
+            self.exception(e)
+        finally:
+            Clock.schedule_once(self.complete_stop)
+
+    def _play_thread_run(self):
+        process_frame = self.process_frame
+        pool = self.frame_pool
+        fmt = self.pix_fmt
+        w, h = map(int, self.frame_size)
+        rate = self.frame_rate
+        max_frames = self.max_frames
+        drop_probability = self.drop_probability
+        jitter = self.jitter
+        rng = Random(self.seed)
+
+        frames = self._generate_frames(fmt, w, h)
+        n_patterns = len(frames)
+        sizes = [len(plane) for plane in frames[0]]
+        # the planes are not aligned
+        linesize = sizes[0] // h
+        counter = None
+        if self.embed_counter:
+            counter = self._get_counter_rows(linesize, h)
+        pack = _counter_struct.pack
+        timers = self.thread_timers['play']
+        timers.start()
+        mark = timers.mark
+
+        ts = clock()
+        self.call_in_kivy_thread(
+            self._complete_synthetic_start, ts, fmt, w, h, rate)
+
+        period = 1 / rate if rate else 0
+        # don't skip frames just because sleep is coarse
+        max_lag = max(period, .02)
+        count = 0
+        while self.play_state != 'stopping':
+            if max_frames and count >= max_frames:
+                break
+
+            if period:
+                deadline = ts + count * period
+                now = clock()
+                if now - deadline > max_lag:
+                    # we're too late, skip the late frames
+                    count = int((now - ts) / period)
+                    continue
+
+                if jitter:
+                    deadline += abs(rng.gauss(0, jitter))
+                if deadline > now:
+                    time.sleep(deadline - now)
+                    mark('sleep', now)
+
+            if drop_probability and rng.random() < drop_probability:
+                count += 1
+                continue
+
+            host_t = clock()
+            planes = pool.get_buffers(sizes)
+            for plane, source in zip(planes, frames[count % n_patterns]):
+                # copying through a memoryview is much faster
+                memoryview(plane)[:] = source
+
+            if counter is not None:
+                block_h, table = counter
+                row = b''.join(table[b] for b in pack(count & 0xFFFFFFFF))
+                plane = planes[0]
+                n = len(row)
+                for y in range(block_h):
+                    plane[y * linesize:y * linesize + n] = row
+
+            image = Image(plane_buffers=planes, pix_fmt=fmt, size=(w, h))
+            t = mark('wrap', host_t)
+            process_frame(
+                image, FrameMetadata(
+                    count * period if period else host_t - ts, count, host_t))
+            mark('callbacks', t)
+            count += 1
+            timers.tick()
+
+    def _complete_synthetic_start(self, ts, fmt, w, h, rate):
+        self.ts_play = ts
+        self.update_metadata(fmt=fmt, w=w, h=h, rate=rate)
+        self.complete_start()
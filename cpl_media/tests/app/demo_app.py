@@ -14,18 +14,23 @@ from kivy.lang import Builder
 from base_kivy_app.app import BaseKivyApp, run_app as run_base_app,\
     report_exception_in_app
 from base_kivy_app.graphics import BufferImage
-from cpl_media.rotpy import FlirPlayer, FlirSettingsWidget
-from cpl_media.ffmpeg import FFmpegPlayer, FFmpegSettingsWidget
-from cpl_media.thorcam import ThorCamPlayer, ThorCamSettingsWidget
-from cpl_media.remote.client import RemoteVideoPlayer, \
-    ClientPlayerSettingsWidget
-from cpl_media.rtv import RTVPlayer, RTVSettingsWidget
+from cpl_media.rotpy import FlirPlayer
+from cpl_media.rotpy.widgets import FlirSettingsWidget
+from cpl_media.ffmpeg import FFmpegPlayer
+from cpl_media.ffmpeg.widgets import FFmpegSettingsWidget
+from cpl_media.thorcam import ThorCamPlayer
+from cpl_media.thorcam.widgets import ThorCamSettingsWidget
+from cpl_media.remote.client import RemoteVideoPlayer
+from cpl_media.remote.client_widgets import ClientPlayerSettingsWidget
+from cpl_media.rtv import RTVPlayer
+from cpl_media.rtv.widgets import RTVSettingsWidget
 from cpl_media.player import BasePlayer
 
-from cpl_media.recorder import ImageFileRecorder, VideoRecorder, \
-    ImageFileRecordSettingsWidget, VideoRecordSettingsWidget
-from cpl_media.remote.server import RemoteVideoRecorder, \
-    RemoteRecordSettingsWidget
+from cpl_media.recorder import ImageFileRecorder, VideoRecorder
+from cpl_media.recorder_widgets import ImageFileRecordSettingsWidget, \
+    VideoRecordSettingsWidget
+from cpl_media.remote.server import RemoteVideoRecorder
+from cpl_media.remote.server_widgets import RemoteRecordSettingsWidget
 from cpl_media.recorder import BaseRecorder
 import cpl_media
 
@@ -20,3 +20,27 @@ async def test_open_app(media_app: DemoTestApp, video_file):
             raise TimeoutError()
 
     media_app.ffmpeg_player.stop()
+
+
+async def test_async_frames(media_app: DemoTestApp, long_video_file):
+    player = media_app.ffmpeg_player
+    player.play_filename = long_video_file
+    player.use_dshow = False
+
+    with trio.fail_after(10):
+        assert await player.aplay(async_lib='trio')
+        assert player.play_state == 'playing'
+
+        frames = []
+        frames_iter = player.aframes(async_lib='trio')
+        async for image, metadata in frames_iter:
+            frames.append(metadata['t'])
+            if len(frames) == 5:
+                break
+        await frames_iter.aclose()
+        assert frames == sorted(frames)
+        assert image.get_size() == (64, 48)
+
+        await player.astop(async_lib='trio')
+        assert player.play_state == 'none'
+        assert not player.frame_subscribers
@@ -0,0 +1,95 @@
+import time
+import socket
+import trio
+from ..media_test_app import DemoTestApp
+
+
+async def wait_for(condition, timeout=10):
+    ts = time.perf_counter()
+    while not condition():
+        await trio.sleep(.05)
+        if time.perf_counter() - ts >= timeout:
+            raise TimeoutError()
+
+
+async def start_playing_file(media_app: DemoTestApp, filename):
+    player = media_app.ffmpeg_player
+    player.play_filename = filename
+    player.use_dshow = False
+
+    player.play()
+    await wait_for(
+        lambda: player.play_state == 'playing' and
+        player.metadata_play_used.rate)
+    return player
+
+
+async def test_record_video(media_app: DemoTestApp, long_video_file, tmp_path):
+    recorder = media_app.video_recorder
+    recorder.record_directory = str(tmp_path)
+    recorder.record_fname = 'video{}.mkv'
+    filename = recorder.record_filename
+
+    player = await start_playing_file(media_app, long_video_file)
+    recorder.record(player)
+    await wait_for(lambda: recorder.frames_recorded >= 10)
+
+    recorder.stop()
+    await wait_for(lambda: recorder.record_state == 'none')
+    player.stop()
+    await wait_for(lambda: player.play_state == 'none')
+
+    assert recorder.size_recorded
+    assert recorder.record_latency['count'] == recorder.frames_recorded
+    assert player.frame_latency['process']['count']
+    assert (tmp_path / filename.split('/')[-1].split('\\')[-1]).exists()
+    assert not player.frame_subscribers
+
+
+async def test_record_images(
+        media_app: DemoTestApp, long_video_file, tmp_path):
+    recorder = media_app.image_file_recorder
+    recorder.record_directory = str(tmp_path)
+    recorder.extension = 'bmp'
+
+    player = await start_playing_file(media_app, long_video_file)
+    recorder.record(player)
+    await wait_for(lambda: recorder.frames_recorded >= 5)
+
+    recorder.stop()
+    await wait_for(lambda: recorder.record_state == 'none')
+    player.stop()
+    await wait_for(lambda: player.play_state == 'none')
+
+    assert len(list(tmp_path.glob('*.bmp'))) == recorder.frames_recorded
+
+
+async def test_network_stream(media_app: DemoTestApp, long_video_file):
+    with socket.socket() as sock:
+        sock.bind(('localhost', 0))
+        port = sock.getsockname()[1]
+
+    server = media_app.server_recorder
+    server.server = 'localhost'
+    server.port = port
+    client = media_app.client_player
+    client.server = 'localhost'
+    client.port = port
+
+    player = await start_playing_file(media_app, long_video_file)
+    server.record(player)
+    await wait_for(lambda: server.server_active)
+
+    client.play()
+    await wait_for(lambda: client.frames_played >= 5)
+    assert client.last_image.get_size() == (64, 48)
+
+    client.stop()
+    await wait_for(lambda: client.play_state == 'none')
+    server.stop()
+    player.stop()
+    await wait_for(lambda: player.play_state == 'none')
+
+    assert server.frames_recorded
+    client.stop_listener(join=True)
+    server.stop_server(join=True)
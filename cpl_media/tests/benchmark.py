@@ -0,0 +1,417 @@
+"""Startup benchmarks
+=====================
+
+Measures how long it takes to import the :mod:`cpl_media` modules and create
+their players and recorders, and how long a player takes from
+:meth:`~cpl_media.player.BasePlayer.play` until its first frame is processed
+and from :meth:`~cpl_media.player.BasePlayer.stop` until its
+:attr:`~cpl_media.player.BasePlayer.play_state` is ``'none'``.
+
+Each measurement is run in a fresh interpreter in headless mode (see
+:mod:`cpl_media.clock`), so that e.g. modules imported by an earlier
+measurement don't make a later one faster. The results are written as JSON so
+that runs can be compared. E.g.::
+
+    python -m cpl_media.tests.benchmark --output before.json
+    # make some changes
+    python -m cpl_media.tests.benchmark --output after.json \\
+        --compare before.json
+
+This module only imports the standard library, the measured modules are
+only imported by the child interpreters.
+"""
+
+import os
+import sys
+import json
+import time
+import platform
+import faulthandler
+import argparse
+import tempfile
+import subprocess
+from statistics import median
+from os.path import join
+
+__all__ = (
+    'import_modules', 'player_kinds', 'measure_import', 'measure_player',
+    'run_benchmarks', 'compare_results')
+
+import_modules = {
+    'cpl_media.player': None,
+    'cpl_media.recorder': 'VideoRecorder',
+    'cpl_media.ffmpeg': 'FFmpegPlayer',
+    'cpl_media.rotpy': 'FlirPlayer',
+    'cpl_media.thorcam': 'ThorCamPlayer',
+    'cpl_media.rtv': 'RTVPlayer',
+    'cpl_media.remote.client': 'RemoteVideoPlayer',
+    'cpl_media.remote.server': 'RemoteVideoRecorder',
+    'cpl_media.synthetic': 'SyntheticPlayer',
+}
+"""The modules whose import is measured, mapped to the name of the class in
+the module that is created after it's imported, or None.
+
+Players whose backend is not available (``is_available`` is False) are not
+created.
+"""
+
+player_kinds = ('ffmpeg', 'synthetic', 'remote')
+"""The players whose play-to-first-frame and stop latencies are measured.
+
+``'ffmpeg'`` plays a generated file with a
+:class:`~cpl_media.ffmpeg.FFmpegPlayer`. ``'synthetic'`` plays a 640x480
+:class:`~cpl_media.synthetic.SyntheticPlayer` at 30 fps. ``'remote'`` plays
+the frames of such an FFmpeg player with a
+:class:`~cpl_media.remote.client.RemoteVideoPlayer`, through a
+:class:`~cpl_media.remote.server.RemoteVideoRecorder` on localhost.
+"""
+
+_import_script = '''
+import os, sys, json
+from time import perf_counter
+
+ts = perf_counter()
+import {module} as mod
+import_s = perf_counter() - ts
+
+create_s = None
+cls = getattr(mod, {cls!r}) if {cls!r} else None
+# is_available is a kivy property of the backend players
+available = getattr(cls, 'is_available', None)
+if cls is not None and (available is None or available.defaultvalue):
+    ts = perf_counter()
+    obj = cls()
+    create_s = perf_counter() - ts
+
+from cpl_media.tests.benchmark import get_peak_rss_mib
+print(json.dumps({{
+    'import_s': import_s, 'create_s': create_s,
+    'rss_mib': get_peak_rss_mib()}}))
+# don't wait on any threads started by the created objects
+sys.stdout.flush()
+os._exit(0)
+'''
+
+
+def get_peak_rss_mib():
+    """Returns the peak resident memory of the current process in MiB, or
+    None if it cannot be measured on this platform.
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # it's in bytes on mac and KiB on linux
+    if sys.platform == 'darwin':
+        return rss / 2 ** 20
+    return rss / 2 ** 10
+
+
+def _child_env():
+    env = dict(os.environ)
+    env['CPL_MEDIA_HEADLESS'] = '1'
+    env['KIVY_NO_ARGS'] = '1'
+    env['KIVY_NO_CONSOLELOG'] = '1'
+    # concurrent children would race when purging the old log files
+    env['KIVY_NO_FILELOG'] = '1'
+    return env
+
+
+def _summarize(runs):
+    values = [v for v in runs if v is not None]
+    if not values:
+        return {'runs': runs, 'median': None, 'min': None}
+    return {'runs': runs, 'median': median(values), 'min': min(values)}
+
+
+def _run_child(args, timeout):
+    res = subprocess.run(
+        [sys.executable] + args, env=_child_env(), stdout=subprocess.PIPE,
+        timeout=timeout, check=True, universal_newlines=True)
+    # the result is the last line, anything before is logging
+    return json.loads(res.stdout.strip().splitlines()[-1])
+
+
+def measure_import(module, repeats=3, timeout=60):
+    """Measures the time to import the module in a fresh interpreter, the time
+    to then create its class (see :attr:`import_modules`), and the peak
+    resident memory of the interpreter after that.
+
+    :param module: The name of the module to import.
+    :param repeats: The number of interpreters to run.
+    :param timeout: The timeout in seconds of each interpreter.
+    :return: A dict with the ``import_s``, ``create_s`` and ``rss_mib``
+        results, each a dict with the ``runs`` list and their ``median`` and
+        ``min``.
+    """
+    script = _import_script.format(
+        module=module, cls=import_modules.get(module))
+    runs = [_run_child(['-c', script], timeout) for _ in range(repeats)]
+    return {
+        key: _summarize([run[key] for run in runs])
+        for key in ('import_s', 'create_s', 'rss_mib')}
+
+
+def create_video_file(filename, n_frames=300, size=(64, 48), rate=30):
+    """Writes a gray rawvideo file used by the player benchmarks.
+
+    :param filename: The name of the file to create.
+    :param n_frames: The number of frames in the video.
+    :param size: The ``(width, height)`` of the frames.
+    :param rate: The frame rate of the video.
+    """
+    from ffpyplayer.writer import MediaWriter
+    from ffpyplayer.pic import Image
+
+    w, h = size
+    writer = MediaWriter(filename, [{
+        'pix_fmt_in': 'gray', 'width_in': w, 'height_in': h,
+        'codec': 'rawvideo', 'frame_rate': (rate, 1)}])
+    for i in range(n_frames):
+        buf = bytearray([i % 256] * (w * h))
+        img = Image(plane_buffers=[buf], pix_fmt='gray', size=(w, h))
+        writer.write_frame(img=img, pts=i / rate, stream=0)
+    writer.close()
+
+
+def _timed_out(name):
+    # show what every thread, including the clock, was stuck on
+    faulthandler.dump_traceback(file=sys.stderr)
+    return TimeoutError('Timed out waiting for {}'.format(name))
+
+
+def _wait(condition, timeout, name):
+    from cpl_media.clock import run_clock_until
+    if not run_clock_until(condition, timeout):
+        raise _timed_out(name)
+
+
+def _call_in_clock(timeout, f, *args, **kwargs):
+    from concurrent.futures import TimeoutError as FutureTimeoutError
+    from cpl_media.clock import call_in_clock
+    try:
+        return call_in_clock(f, *args, **kwargs).result(timeout)
+    except FutureTimeoutError:
+        raise _timed_out('the clock to call {}'.format(f)) from None
+
+
+def _create_player(kind, filename, timeout, cleanup):
+    from cpl_media.ffmpeg import FFmpegPlayer
+
+    if kind == 'ffmpeg':
+        return FFmpegPlayer(play_filename=filename, use_dshow=False)
+    if kind == 'synthetic':
+        from cpl_media.synthetic import SyntheticPlayer
+        return SyntheticPlayer(frame_size=[640, 480], frame_rate=30)
+
+    if kind != 'remote':
+        raise ValueError('Unknown player "{}"'.format(kind))
+
+    from cpl_media.remote.server import RemoteVideoRecorder
+    from cpl_media.remote.client import RemoteVideoPlayer
+
+    source = FFmpegPlayer(play_filename=filename, use_dshow=False)
+    # let the system pick a free port when the server listens
+    server = RemoteVideoRecorder(server='localhost', port=0)
+    _call_in_clock(timeout, source.play)
+    _wait(lambda: source.play_state == 'playing', timeout, 'the source')
+    _call_in_clock(timeout, server.record, source)
+    _wait(lambda: server.record_state == 'recording', timeout, 'the server')
+    # it only starts listening after it's recording
+    _wait(lambda: server.listening_port, timeout, 'the server to listen')
+
+    def stop():
+        server.stop_all(join=True)
+        source.stop_all(join=True)
+    cleanup.append(stop)
+
+    return RemoteVideoPlayer(server='localhost', port=server.listening_port)
+
+
+def player_child(kind, filename, repeats, timeout):
+    """Runs in the child interpreter started by :func:`measure_player` and
+    prints the JSON results.
+    """
+    from time import perf_counter
+    import cpl_media
+
+    errors = []
+
+    def error_callback(e, exc_info=None, threaded=False):
+        errors.append(exc_info or str(e))
+    cpl_media.error_callback = error_callback
+
+    cleanup = []
+    player = _create_player(kind, filename, timeout, cleanup)
+    times = {}
+
+    def frame_callback(item):
+        if 'frame' not in times:
+            times['frame'] = perf_counter()
+    player.frame_callbacks.append(frame_callback)
+
+    def state_callback(obj, state):
+        if state == 'none':
+            times['none'] = perf_counter()
+    player.fbind('play_state', state_callback)
+
+    def start():
+        times['play'] = perf_counter()
+        player.play()
+
+    def stop():
+        times['stop'] = perf_counter()
+        player.stop()
+
+    first_frame = []
+    stop_times = []
+    try:
+        for _ in range(repeats):
+            times.clear()
+            _call_in_clock(timeout, start)
+            _wait(lambda: 'frame' in times or errors, timeout, 'a frame')
+            # some players only set the state after the first frame
+            _wait(lambda: player.play_state == 'playing' or errors, timeout,
+                  'playing')
+            if errors:
+                break
+            first_frame.append(times['frame'] - times['play'])
+
+            _call_in_clock(timeout, stop)
+            _wait(lambda: 'none' in times or errors, timeout, 'stopping')
+            if errors:
+                break
+            stop_times.append(times['none'] - times['stop'])
+    finally:
+        _call_in_clock(timeout, player.stop_all, join=True)
+        for f in cleanup:
+            _call_in_clock(timeout, f)
+
+    if errors:
+        raise Exception('The player failed:\n{}'.format('\n'.join(errors)))
+
+    print(json.dumps({'first_frame_s': first_frame, 'stop_s': stop_times}))
+    sys.stdout.flush()
+
+
+def measure_player(kind, filename, repeats=5, timeout=30):
+    """Measures the time from ``play()`` to the first processed frame and from
+    ``stop()`` until the play state is ``'none'`` of a player in a fresh
+    interpreter, playing and stopping it ``repeats`` times.
+
+    :param kind: One of :attr:`player_kinds`.
+    :param filename: The video file played, e.g. one created with
+        :func:`create_video_file`.
+    :param repeats: The number of times the player is played and stopped.
+    :param timeout: The timeout in seconds of each step.
+    :return: A dict with the ``first_frame_s`` and ``stop_s`` results, each a
+        dict with the ``runs`` list and their ``median`` and ``min``.
+    """
+    script = (
+        'from cpl_media.tests.benchmark import player_child; '
+        'player_child({!r}, {!r}, {}, {})'.format(
+            kind, filename, repeats, timeout))
+    res = _run_child(['-c', script], timeout * (2 * repeats + 4))
+    return {key: _summarize(value) for key, value in res.items()}
+
+
+def run_benchmarks(
+        modules=None, players=None, import_repeats=3, play_repeats=5,
+        timeout=30):
+    """Runs the import and player benchmarks.
+
+    :param modules: The list of modules whose import is measured, defaults to
+        all of :attr:`import_modules`.
+    :param players: The list of players that are measured, defaults to all of
+        :attr:`player_kinds`.
+    :param import_repeats: The number of interpreters run for each module.
+    :param play_repeats: The number of times each player is played.
+    :param timeout: The timeout in seconds of each step.
+    :return: A dict with the results and a description of the environment.
+    """
+    import cpl_media
+    if modules is None:
+        modules = list(import_modules)
+    if players is None:
+        players = list(player_kinds)
+
+    results = {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': sys.version, 'platform': platform.platform(),
+        'cpl_media': cpl_media.__version__,
+        'imports': {}, 'players': {}}
+
+    for module in modules:
+        results['imports'][module] = measure_import(
+            module, import_repeats, timeout)
+
+    if players:
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = join(tmp, 'benchmark_video.avi')
+            create_video_file(filename)
+            for kind in players:
+                results['players'][kind] = measure_player(
+                    kind, filename, play_repeats, timeout)
+    return results
+
+
+def compare_results(old, new):
+    """Returns a list of lines comparing the medians of two results returned
+    by :func:`run_benchmarks`.
+    """
+    lines = []
+    for group in ('imports', 'players'):
+        for name, values in new[group].items():
+            for key, value in values.items():
+                old_median = old.get(group, {}).get(name, {}).get(
+                    key, {}).get('median')
+                median_ = value['median']
+                if median_ is None or not old_median:
+                    change = ''
+                else:
+                    change = '{:+.1f}%'.format(
+                        (median_ / old_median - 1) * 100)
+                lines.append('{} {}: {} -> {} {}'.format(
+                    name, key, old_median, median_, change).strip())
+    return lines
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        description='Benchmarks the cpl_media import and play latencies.')
+    parser.add_argument(
+        '--output', default='', help='The JSON file to write the results to')
+    parser.add_argument(
+        '--compare', default='', help='A JSON file of an earlier run to '
+        'compare to')
+    parser.add_argument(
+        '--modules', nargs='*', default=None,
+        help='The modules to import, defaults to all')
+    parser.add_argument(
+        '--players', nargs='*', default=None, choices=player_kinds,
+        help='The players to play, defaults to all')
+    parser.add_argument('--import-repeats', type=int, default=3)
+    parser.add_argument('--play-repeats', type=int, default=5)
+    parser.add_argument('--timeout', type=float, default=30)
+    args = parser.parse_args(args)
+
+    results = run_benchmarks(
+        args.modules, args.players, args.import_repeats, args.play_repeats,
+        args.timeout)
+
+    if args.output:
+        with open(args.output, 'w') as fh:
+            json.dump(results, fh, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+
+    if args.compare:
+        with open(args.compare) as fh:
+            old = json.load(fh)
+        print('\n'.join(compare_results(old, results)))
+
+
+if __name__ == '__main__':
+    main()
@@ -98,3 +98,24 @@ def video_file(tmp_path_factory):
     writer.close()
 
     return fname
+
+
+@pytest.fixture(scope='session')
+def long_video_file(tmp_path_factory):
+    from ffpyplayer.writer import MediaWriter
+    from ffpyplayer.pic import Image
+    fname = str(tmp_path_factory.mktemp('data') / 'test_long_video.avi')
+
+    w, h = 64, 48
+    out_opts = {
+        'pix_fmt_in': 'gray', 'width_in': w, 'height_in': h,
+        'codec': 'rawvideo', 'frame_rate': (30, 1)}
+
+    writer = MediaWriter(fname, [out_opts])
+    for i in range(90):
+        buf = bytearray([i] * (w * h))
+        img = Image(plane_buffers=[buf], pix_fmt='gray', size=(w, h))
+        writer.write_frame(img=img, pts=i / 30, stream=0)
+    writer.close()
+
+    return fname
@@ -0,0 +1,33 @@
+import pytest
+
+from cpl_media.common import module_available
+from cpl_media.tests.benchmark import measure_import, measure_player, \
+    create_video_file, compare_results
+
+
+def test_measure_import():
+    res = measure_import('cpl_media.ffmpeg', repeats=1)
+    assert res['import_s']['median'] > 0
+    assert res['create_s']['median'] > 0
+
+    # without rotpy the player is not created
+    res = measure_import('cpl_media.rotpy', repeats=1)
+    if not module_available('rotpy'):
+        assert res['create_s']['runs'] == [None]
+
+    lines = compare_results(
+        {'imports': {'cpl_media.rotpy': res}}, {
+            'imports': {'cpl_media.rotpy': res}, 'players': {}})
+    assert 'cpl_media.rotpy import_s' in lines[0]
+    assert lines[0].endswith('+0.0%')
+
+
+@pytest.mark.parametrize('kind', ['ffmpeg', 'synthetic', 'remote'])
+def test_measure_player(kind, tmp_path):
+    filename = str(tmp_path / 'video.avi')
+    create_video_file(filename, n_frames=150)
+
+    res = measure_player(kind, filename, repeats=2, timeout=10)
+    assert len(res['first_frame_s']['runs']) == 2
+    assert len(res['stop_s']['runs']) == 2
+    assert 0 < res['first_frame_s']['median'] < 10
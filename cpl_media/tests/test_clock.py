@@ -0,0 +1,136 @@
+import sys
+import subprocess
+
+from cpl_media.clock import HeadlessClock
+
+
+def test_headless_clock_triggers():
+    clock = HeadlessClock()
+    calls = []
+
+    trigger = clock.create_trigger(lambda dt: calls.append('trigger'))
+    trigger()
+    trigger()
+    assert trigger.is_triggered
+    assert clock.tick() == 1
+    assert calls == ['trigger']
+    assert not trigger.is_triggered
+
+    trigger()
+    trigger.cancel()
+    assert not clock.tick()
+
+    def interval(dt):
+        calls.append('interval')
+        return len(calls) < 4
+
+    clock.schedule_interval(interval, 0)
+    assert clock.run_until(lambda: len(calls) == 4, timeout=5)
+    clock.tick()
+    assert calls == ['trigger', 'interval', 'interval', 'interval']
+
+    clock.schedule_once(lambda dt: calls.append('later'), 10)
+    assert not clock.run_until(lambda: len(calls) == 5, timeout=.1)
+
+
+def test_headless_clock_cancel_in_callback():
+    clock = HeadlessClock()
+    calls = []
+
+    def own(dt):
+        calls.append('own')
+        own_event.cancel()
+
+    def other(dt):
+        calls.append('other')
+        interval_event.cancel()
+
+    own_event = clock.schedule_interval(own, 0)
+    clock.tick()
+    assert calls == ['own']
+    assert not own_event.is_triggered
+
+    # canceled by a callback due in the same tick, before it's called
+    other_event = clock.create_trigger(other)
+    other_event()
+    interval_event = clock.schedule_interval(
+        lambda dt: calls.append('interval'), 0)
+    for _ in range(5):
+        clock.tick()
+    assert calls == ['own', 'other']
+    assert not interval_event.is_triggered
+
+    # it can be scheduled again after it was canceled
+    own_event()
+    clock.tick()
+    assert calls == ['own', 'other', 'own']
+
+
+def test_headless_clock_thread():
+    clock = HeadlessClock()
+    calls = []
+    clock.start()
+    try:
+        clock.schedule_once(lambda dt: calls.append(1), .05)
+        assert clock.run_until(lambda: calls, timeout=5)
+    finally:
+        clock.stop(join=True)
+
+
+headless_script = '''
+import os, sys
+os.environ['CPL_MEDIA_HEADLESS'] = '1'
+from cpl_media.clock import Clock, call_in_clock
+from cpl_media.ffmpeg import FFmpegPlayer
+from cpl_media.recorder import VideoRecorder
+
+player = FFmpegPlayer(play_filename=sys.argv[1], use_dshow=False)
+recorder = VideoRecorder(
+    record_directory=sys.argv[2], record_fname='video{}.avi')
+
+call_in_clock(player.play).result(5)
+assert Clock.run_until(
+    lambda: player.play_state == 'playing' and player.frames_played >= 5,
+    timeout=10)
+call_in_clock(recorder.record, player).result(5)
+assert Clock.run_until(lambda: recorder.frames_recorded >= 5, timeout=10)
+
+call_in_clock(recorder.stop).result(5)
+assert Clock.run_until(lambda: recorder.record_state == 'none', timeout=10)
+call_in_clock(player.stop).result(5)
+assert Clock.run_until(lambda: player.play_state == 'none', timeout=10)
+
+assert not [
+    m for m in sys.modules if m.startswith(('kivy.uix', 'kivy.lang'))]
+'''
+
+
+def test_headless_record(long_video_file, tmp_path):
+    subprocess.run(
+        [sys.executable, '-c', headless_script, long_video_file,
+         str(tmp_path)],
+        check=True, timeout=60)
+    assert list(tmp_path.glob('video*.avi'))
+
+
+iter_frames_script = '''
+import os, sys
+os.environ['CPL_MEDIA_HEADLESS'] = '1'
+from cpl_media.ffmpeg import FFmpegPlayer
+
+player = FFmpegPlayer(
+    play_filename=sys.argv[1], use_dshow=False, unthrottled=True)
+frames = list(player.iter_frames(timeout=10))
+assert len(frames) == 90, len(frames)
+assert player.play_state == 'none'
+
+frames = list(player.iter_frames(timeout=10, max_frames=10))
+assert len(frames) == 10
+assert player.play_state == 'none'
+'''
+
+
+def test_headless_iter_frames(long_video_file):
+    subprocess.run(
+        [sys.executable, '-c', iter_frames_script, long_video_file],
+        check=True, timeout=60)
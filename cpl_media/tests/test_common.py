@@ -0,0 +1,154 @@
+import sys
+import subprocess
+from threading import Thread
+from time import perf_counter
+
+from cpl_media.common import KivyThreadStats, LatencyHistogram, \
+    module_available, ThreadTimers, ThreadTimersDumper, get_thread_timers, \
+    format_thread_timers
+
+
+class StatsTarget:
+
+    frames = 0
+
+    size = 0
+
+    rate = 0
+
+
+def test_thread_stats_coalesce():
+    triggered = []
+    stats = KivyThreadStats(trigger=lambda: triggered.append(1))
+
+    def worker():
+        for i in range(1000):
+            stats.increment('frames')
+            stats.increment('size', 10)
+            stats.set(rate=i)
+
+    threads = [Thread(target=worker) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # only the first update after a snapshot triggers
+    assert len(triggered) == 1
+
+    target = StatsTarget()
+    stats.apply(target)
+    assert target.frames == 4000
+    assert target.size == 40000
+    assert target.rate == 999
+
+    stats.increment('frames')
+    assert len(triggered) == 2
+
+
+def test_thread_stats_set_overrides_increments():
+    stats = KivyThreadStats()
+    target = StatsTarget()
+    target.frames = 5
+
+    stats.increment('frames', 3)
+    stats.set(frames=1)
+    stats.increment('frames')
+    stats.apply(target)
+    assert target.frames == 2
+
+    stats.increment('frames')
+    stats.clear()
+    stats.apply(target)
+    assert target.frames == 2
+
+
+def test_latency_histogram():
+    hist = LatencyHistogram()
+    assert hist.summary()['p50'] == 0
+
+    for i in range(1, 101):
+        hist.add(i / 1000)
+    summary = hist.summary()
+    assert summary['count'] == 100
+    assert summary['max'] == .1
+    assert abs(summary['mean'] - .0505) < 1e-9
+    # within the bin resolution
+    assert .05 <= summary['p50'] <= .05 * 1.13
+    assert .095 <= summary['p95'] <= .1
+    assert summary['p99'] <= .1
+
+    # out of range values
+    hist.add(0)
+    hist.add(1000)
+    assert hist.percentile(100) == 1000
+
+    hist.reset()
+    assert not hist.count
+    assert not any(hist.bins)
+
+
+engine_import_script = '''
+import sys
+import cpl_media.recorder
+import cpl_media.ffmpeg
+import cpl_media.rotpy
+import cpl_media.thorcam
+import cpl_media.rtv
+import cpl_media.remote.client
+import cpl_media.remote.server
+
+loaded = [
+    m for m in sys.modules
+    if m.startswith(('kivy.uix', 'kivy.lang', 'rotpy', 'pybarst'))]
+assert not loaded, loaded
+'''
+
+
+def test_thread_timers(tmp_path):
+    timers = ThreadTimers('test thread')
+    assert timers in get_thread_timers()
+
+    def worker():
+        timers.start()
+        for i in range(10):
+            ts = timers.mark('acquire', perf_counter())
+            ts = timers.mark('callbacks', ts)
+            timers.add('sleep', i / 1000)
+            timers.tick()
+
+    thread = Thread(target=worker)
+    thread.start()
+    thread.join()
+
+    snapshot = timers.snapshot()
+    assert snapshot['name'] == 'test thread'
+    assert snapshot['iterations'] == 10
+    assert snapshot['cpu_s'] >= 0
+    assert snapshot['wall_s'] > 0
+    assert sorted(snapshot['stages']) == ['acquire', 'callbacks', 'sleep']
+    sleep = snapshot['stages']['sleep']
+    assert sleep['count'] == 10
+    assert abs(sleep['total_s'] - .045) < 1e-9
+    assert abs(sleep['mean_s'] - .0045) < 1e-9
+    assert abs(sleep['max_s'] - .009) < 1e-9
+
+    text = format_thread_timers([timers])
+    assert text.startswith('test thread: 10 iterations')
+    assert 'sleep: 10 x 4.500ms mean, 9.000ms max' in text
+
+    filename = str(tmp_path / 'timers.txt')
+    dumper = ThreadTimersDumper(filename, interval=.01)
+    dumper.start()
+    dumper.stop(join=True)
+    dumper.dump()
+    with open(filename) as fh:
+        assert 'test thread: 10 iterations' in fh.read()
+
+
+def test_engine_imports():
+    assert module_available('cpl_media')
+    assert not module_available('cpl_media_missing_module')
+
+    subprocess.run(
+        [sys.executable, '-c', engine_import_script], check=True, timeout=60)
@@ -0,0 +1,41 @@
+from time import sleep
+
+
+def mean_luma(image, metadata):
+    from cpl_media.player import get_image_arrays
+    sleep(.01)
+    return float(get_image_arrays(image)[0].mean())
+
+
+def test_frame_process_executor(long_video_file):
+    from cpl_media.clock import set_headless, call_in_clock, Clock
+    from cpl_media.ffmpeg import FFmpegPlayer
+    from cpl_media.executor import FrameProcessExecutor
+
+    set_headless()
+    try:
+        results = []
+        player = FFmpegPlayer(play_filename=long_video_file, use_dshow=False)
+        executor = FrameProcessExecutor(
+            player, mean_luma, lambda *item: results.append(item),
+            workers=2, max_in_flight=4)
+        call_in_clock(executor.start).result(5)
+        try:
+            call_in_clock(player.play).result(5)
+            assert Clock.run_until(
+                lambda: player.play_state == 'none', timeout=30)
+            assert Clock.run_until(
+                lambda: not executor.in_flight and
+                len(results) == executor.frames_completed, timeout=30)
+        finally:
+            call_in_clock(executor.stop).result(5)
+
+        stats = executor.get_stats()
+        assert stats['completed'] == len(results) > 10
+        assert stats['completed'] + stats['dropped'] == 90
+        assert not stats['failed']
+        ts = [metadata['t'] for _, metadata in results]
+        assert ts == sorted(ts)
+        assert all(isinstance(result, float) for result, _ in results)
+    finally:
+        set_headless(False)
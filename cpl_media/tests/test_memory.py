@@ -0,0 +1,120 @@
+from threading import Thread
+import time
+
+from ffpyplayer.pic import Image
+
+from cpl_media.memory import MemoryGovernor, get_frame_nbytes
+from cpl_media.player import FrameQueue
+
+
+def create_frame(count, w=64, h=32):
+    image = Image(plane_buffers=[bytes(w * h)], pix_fmt='gray', size=(w, h))
+    return image, {'count': count}
+
+
+def test_governor_drop():
+    nbytes = get_frame_nbytes(create_frame(0))
+    assert nbytes >= 64 * 32
+    governor = MemoryGovernor(budget=3 * nbytes)
+    preview = FrameQueue(name='preview', governor=governor)
+    other = FrameQueue(name='other', governor=governor)
+
+    for i in range(3):
+        assert preview.put(create_frame(i))
+    assert not preview.put(create_frame(3))
+    # the first frame of a queue is accepted even when over budget
+    assert other.put(create_frame(0))
+    assert not other.put(create_frame(1))
+
+    assert governor.in_flight == 4 * nbytes
+    assert preview.memory.high_water == 3 * nbytes
+    assert preview.dropped == preview.memory.dropped == 1
+    assert other.dropped == other.memory.dropped == 1
+
+    preview.get()
+    preview.get()
+    assert other.put(create_frame(2))
+    assert governor.in_flight == 3 * nbytes
+    assert governor.high_water == 4 * nbytes
+
+    stats = governor.get_stats()
+    assert stats['in_flight'] == 3 * nbytes
+    assert sorted(a['name'] for a in stats['accounts']) == [
+        'other', 'preview']
+
+    # unused queues are no longer counted
+    del preview
+    assert governor.in_flight == 2 * nbytes
+
+
+def test_governor_block():
+    nbytes = get_frame_nbytes(create_frame(0))
+    governor = MemoryGovernor(budget=2 * nbytes)
+    recorder = FrameQueue(
+        name='recorder', memory_policy='block', governor=governor)
+
+    def produce():
+        for i in range(6):
+            recorder.put(create_frame(i))
+        recorder.put_eof()
+
+    thread = Thread(target=produce)
+    thread.start()
+    counts = []
+    while True:
+        time.sleep(.01)
+        item = recorder.get()
+        if item == 'eof':
+            break
+        counts.append(item[1]['count'])
+        assert governor.in_flight <= 2 * nbytes
+    thread.join()
+
+    assert counts == list(range(6))
+    assert not recorder.dropped
+    assert recorder.memory.blocked
+    assert governor.high_water == 2 * nbytes
+    assert not governor.in_flight
+
+
+def test_governor_block_aborted():
+    nbytes = get_frame_nbytes(create_frame(0))
+    governor = MemoryGovernor(budget=nbytes)
+    recorder = FrameQueue(memory_policy='block', governor=governor)
+    assert recorder.put(create_frame(0))
+
+    result = []
+    thread = Thread(target=lambda: result.append(
+        recorder.put(create_frame(1))))
+    thread.start()
+    time.sleep(.05)
+    assert not result
+
+    recorder.put_eof()
+    thread.join()
+    assert result == [False]
+    assert recorder.get()[1]['count'] == 0
+    assert recorder.get() == 'eof'
+    assert not governor.in_flight
+
+
+def test_governor_closed_while_full():
+    nbytes = get_frame_nbytes(create_frame(0))
+    governor = MemoryGovernor()
+    recorder = FrameQueue(maxsize=1, policy='block', governor=governor)
+    assert recorder.put(create_frame(0))
+
+    result = []
+    thread = Thread(target=lambda: result.append(
+        recorder.put(create_frame(1))))
+    thread.start()
+    time.sleep(.05)
+    assert not result
+
+    recorder.put_eof()
+    thread.join()
+    assert result == [False]
+    # the frame that waited for space is no longer counted
+    assert governor.in_flight == nbytes
+    assert recorder.get()[1]['count'] == 0
+    assert not governor.in_flight
@@ -0,0 +1,283 @@
+import pytest
+
+from ffpyplayer.pic import Image
+
+from cpl_media.player import FrameBufferPool, FrameRateEstimator, SWScaleCache
+
+
+def test_frame_pool_reuse():
+    pool = FrameBufferPool(max_buffers=2)
+    w, h = 64, 32
+
+    planes = pool.get_image_buffers('yuv420p', w, h)
+    assert list(map(len, planes)) == [w * h, w * h // 4, w * h // 4]
+    img = Image(plane_buffers=planes, pix_fmt='yuv420p', size=(w, h))
+    del planes
+    assert pool.misses == 1
+    assert pool.resident_bytes == w * h * 3 // 2
+
+    # still used by img
+    planes2 = pool.get_image_buffers('yuv420p', w, h)
+    assert pool.misses == 2
+    del planes2
+
+    del img
+    planes = pool.get_image_buffers('yuv420p', w, h)
+    assert pool.hits == 1
+    del planes
+
+    # different size
+    pool.get_image_buffers('gray', w, h)
+    assert pool.misses == 3
+    assert pool.resident_bytes == w * h * 3 // 2 * 2 + w * h
+
+    pool.clear()
+    assert not pool.resident_bytes
+
+
+def test_image_arrays():
+    import numpy as np
+    from cpl_media.player import get_image_arrays, get_buffer_arrays, \
+        image_from_arrays
+
+    w, h = 5, 3
+    buffers = [bytearray(range(w * h)), bytearray(9), bytearray(9)]
+    img = Image(plane_buffers=buffers, pix_fmt='yuv420p', size=(w, h),
+                linesize=[w, 3, 3])
+    y, u, v = get_image_arrays(img)
+    assert y.shape == (3, 5)
+    assert u.shape == v.shape == (2, 3)
+    assert not y.flags.writeable
+    assert y[1, 2] == 7
+    assert y.image is img
+    assert y[1:].image is img
+
+    # the arrays view the buffers
+    buffers[0][7] = 100
+    assert y[1, 2] == 100
+
+    # image with padded lines
+    img = Image(pix_fmt='rgb24', size=(w, h))
+    linesize = img.get_linesizes(keep_align=True)[0]
+    arr, = get_image_arrays(img)
+    assert arr.shape == (h, w, 3)
+    assert arr.strides == (linesize, 3, 1)
+
+    buffers = [bytearray(w * h * 2)]
+    arr, = get_buffer_arrays(buffers, 'gray16le', (w, h))
+    arr[:, :] = np.arange(w * h, dtype=np.uint16).reshape(h, w) * 256
+    img = image_from_arrays([arr], 'gray16le', (w, h))
+    arr2, = get_image_arrays(img)
+    assert np.array_equal(arr, arr2)
+    # no copy
+    arr[0, 0] = 12
+    assert arr2[0, 0] == 12
+
+    # non-contiguous arrays are copied
+    img = image_from_arrays([arr[:, ::2]], 'gray16le', (3, h))
+    arr3, = get_image_arrays(img)
+    assert np.array_equal(arr[:, ::2], arr3)
+
+    # odd width uyvy422 lines end with the V and Y of the last pixel pair
+    w = 31
+    img = Image(pix_fmt='uyvy422', size=(w, h))
+    assert img.get_linesizes(keep_align=True)[0] == 64
+    arr, = get_image_arrays(img)
+    assert arr.shape == (h, 32, 2)
+    assert arr.strides == (64, 2, 1)
+
+    buffers = [bytearray(h * 64)]
+    arr, = get_buffer_arrays(buffers, 'uyvy422', (w, h))
+    assert arr.shape == (h, 32, 2)
+    arr[:, :, :] = np.arange(h * 64, dtype=np.uint8).reshape(h, 32, 2)
+    img = image_from_arrays([arr], 'uyvy422', (w, h))
+    assert img.to_bytearray()[0] == bytearray(range(h * 64))
+
+
+def test_rate_estimator():
+    for mode in FrameRateEstimator.modes:
+        est = FrameRateEstimator(mode=mode)
+        for i in range(100):
+            est.add(i / 50, source_t=i / 50)
+        assert abs(est.rate - 50) < 1e-6
+        assert est.jitter < 1e-6
+        assert not est.dropped
+
+        # skip 2 frames from the timestamps
+        assert est.add(102 / 50, source_t=102 / 50) == 2
+        assert est.dropped == 2
+        assert est.jitter > 0
+
+    est = FrameRateEstimator()
+    for i, count in enumerate([0, 1, 2, 5, 6, 10]):
+        est.add(i / 50, count=count)
+    assert est.dropped == 5
+    assert est.frames == 6
+
+    est.reset()
+    assert not est.rate and not est.dropped
+
+
+def test_display_preview():
+    from cpl_media.player import BasePlayer
+    player = BasePlayer(
+        display_max_fps=1, display_max_size=[32, 0], display_pix_fmt='rgb24')
+    w, h = 64, 48
+    img = Image(
+        plane_buffers=[bytes(w * h)], pix_fmt='gray', size=(w, h))
+
+    player._preview_frame(1, 32, 0, 'rgb24', (img, {'t': 0}))
+    assert player.display_image.get_size() == (32, 24)
+    assert player.display_image.get_pixel_format() == 'rgb24'
+    assert player.display_image_metadata == {'t': 0}
+
+    # within 1 / max_fps of the last frame
+    player._preview_frame(1, 32, 0, 'rgb24', (img, {'t': 1}))
+    assert player.display_image_metadata == {'t': 0}
+
+    # no scaling or conversion needed
+    player._preview_frame(0, 0, 0, '', (img, {'t': 2}))
+    assert player.display_image is img
+
+
+def test_sws_cache():
+    cache = SWScaleCache(max_entries=2)
+    w, h = 64, 48
+    img = Image(plane_buffers=[bytes(w * h)], pix_fmt='gray', size=(w, h))
+
+    assert cache.scale(img) is img
+    assert cache.scale(img, w, h, 'gray') is img
+    assert not cache.misses
+
+    rgb = cache.scale(img, ofmt='rgb24')
+    assert rgb.get_pixel_format() == 'rgb24'
+    assert rgb.get_size() == (w, h)
+    cache.scale(img, ofmt='rgb24')
+    assert cache.misses == 1
+    assert cache.hits == 1
+
+    assert cache.scale(img, 32, 24).get_size() == (32, 24)
+    assert cache.scale(rgb, ofmt='gray').get_pixel_format() == 'gray'
+    assert cache.misses == 3
+    assert len(cache) == 2
+
+    # the least recently used was removed
+    cache.scale(img, ofmt='rgb24')
+    assert cache.misses == 4
+
+
+def test_frame_metadata():
+    import pickle
+    from cpl_media.player import FrameMetadata
+
+    metadata = FrameMetadata(t=1.5, count=0, exposure=.01)
+    assert metadata['t'] == 1.5
+    assert metadata['count'] == 0
+    assert 'count' in metadata
+    assert 'host_t' not in metadata
+    assert metadata.get('host_t', 3) == 3
+    assert metadata == {'t': 1.5, 'count': 0, 'exposure': .01}
+    assert list(metadata) == ['t', 'count', 'exposure']
+    assert len(metadata) == 3
+
+    metadata['host_t'] = 2.
+    metadata['gain'] = 4
+    del metadata['count']
+    assert dict(metadata) == {
+        't': 1.5, 'host_t': 2., 'exposure': .01, 'gain': 4}
+    assert metadata.host_t == 2.
+    with pytest.raises(KeyError):
+        metadata['count']
+
+    copy = metadata.copy()
+    copy['gain'] = 5
+    assert metadata['gain'] == 4
+    assert pickle.loads(pickle.dumps(metadata)) == metadata
+    assert FrameMetadata.from_dict(dict(metadata)) == metadata
+
+
+def test_aframes_stopped():
+    import asyncio
+    from cpl_media.clock import set_headless, call_in_clock, run_clock_until
+    from cpl_media.synthetic import SyntheticPlayer
+
+    set_headless()
+    try:
+        player = SyntheticPlayer(frame_size=[64, 32], frame_rate=100)
+        assert player.play_state == 'none'
+
+        async def read_frames():
+            return [item async for item in player.aframes()]
+
+        assert asyncio.run(asyncio.wait_for(read_frames(), 5)) == []
+        # the subscriber is removed from the clock thread
+        run_clock_until(call_in_clock(lambda: None).done, 5)
+        assert not player.frame_subscribers
+    finally:
+        set_headless(False)
+
+
+def test_aplay_astop():
+    import asyncio
+    from cpl_media.clock import set_headless
+    from cpl_media.synthetic import SyntheticPlayer
+
+    set_headless()
+    try:
+        player = SyntheticPlayer(frame_size=[64, 32], frame_rate=100)
+
+        async def play():
+            assert await player.aplay()
+            assert player.play_state == 'playing'
+
+            frames = []
+            frames_iter = player.aframes()
+            async for image, metadata in frames_iter:
+                frames.append(metadata['t'])
+                if len(frames) == 3:
+                    break
+            await frames_iter.aclose()
+
+            await player.astop()
+            assert player.play_state == 'none'
+            return frames
+
+        frames = asyncio.run(asyncio.wait_for(play(), 5))
+        assert frames == sorted(frames)
+        assert not player.frame_subscribers
+    finally:
+        set_headless(False)
+
+
+def test_flir_unavailable(monkeypatch):
+    import cpl_media
+    from cpl_media.clock import set_headless, call_in_clock, run_clock_until
+    from cpl_media.rotpy import FlirPlayer
+    try:
+        import rotpy.system
+        pytest.skip('rotpy can be imported')
+    except ImportError:
+        pass
+
+    errors = []
+    monkeypatch.setattr(
+        cpl_media, 'error_callback',
+        lambda e, exc_info=None, threaded=False: errors.append(e))
+
+    set_headless()
+    try:
+        # as if rotpy was installed but failed to load
+        player = call_in_clock(FlirPlayer, is_available=True).result(10)
+        call_in_clock(player.ask_config, 'serials').result(10)
+        assert run_clock_until(lambda: not player.is_available, 10)
+        player.config_thread.join(10)
+        assert not player.config_thread.is_alive()
+        assert not player.config_active
+        # later requests are ignored rather than queued forever
+        call_in_clock(player.ask_config, 'serials').result(10)
+        assert not player.config_active
+    finally:
+        set_headless(False)
+
+    assert len(errors) == 1
+    assert isinstance(errors[0], ImportError)
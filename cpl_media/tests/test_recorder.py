@@ -0,0 +1,264 @@
+import os
+import time
+import pytest
+
+from ffpyplayer.pic import Image
+
+from cpl_media.recorder import SpillFrameQueue
+
+
+def create_frame(count, w=64, h=32):
+    planes = [bytes([count % 256]) * (w * h), bytes(w * h // 4),
+              bytes([255]) * (w * h // 4)]
+    image = Image(plane_buffers=planes, pix_fmt='yuv420p', size=(w, h))
+    return image, {'count': count}
+
+
+def test_spill_queue_order(tmp_path):
+    frame_size = 64 * 32 * 3 // 2
+    spilled = []
+    recovered = []
+    # room for 3 frames, so the ring wraps around
+    queue = SpillFrameQueue(
+        spill_threshold=2, spill_size=3 * frame_size,
+        spill_directory=str(tmp_path), on_spill=spilled.append,
+        on_recover=recovered.append)
+    assert os.path.getsize(queue.filename) == 3 * frame_size
+
+    counts = []
+    original = create_frame(0)[0].to_bytearray()
+    for i in range(20):
+        assert queue.put(create_frame(i))
+        if i % 3 == 2:
+            for _ in range(2):
+                image, metadata = queue.get()
+                counts.append(metadata['count'])
+                if metadata['count'] == 0:
+                    assert image.to_bytearray() == original
+
+    queue.put_eof()
+    while True:
+        item = queue.get()
+        if item == 'eof':
+            break
+        image, metadata = item
+        counts.append(metadata['count'])
+        assert image.get_pixel_format() == 'yuv420p'
+        assert image.get_size() == (64, 32)
+        assert image.to_bytearray()[0][0] == metadata['count']
+
+    assert counts == list(range(20))
+    assert queue.spilled == len(spilled) == len(recovered) == \
+        queue.recovered
+    assert queue.spilled
+    assert queue.spill_high_water <= 3 * frame_size
+    assert not queue.spilled_queued
+    assert not queue.dropped
+    assert not os.path.exists(queue.filename)
+
+
+def test_spill_queue_full(tmp_path):
+    frame_size = 64 * 32 * 3 // 2
+    queue = SpillFrameQueue(
+        spill_threshold=1, spill_size=2 * frame_size,
+        spill_directory=str(tmp_path), maxsize=5, policy='drop_oldest')
+
+    for i in range(5):
+        assert queue.put(create_frame(i))
+    # 1 in memory, 2 in the file, then in memory because it's full
+    assert queue.spilled == queue.spilled_queued == 2
+    assert queue.qsize() == 5
+
+    # drops the frame in memory, and then a spilled frame
+    assert queue.put(create_frame(5))
+    assert queue.put(create_frame(6))
+    assert queue.dropped == 2
+    assert queue.spilled_queued == 1
+
+    counts = [queue.get(block=False)[1]['count'] for _ in range(5)]
+    assert counts == [2, 3, 4, 5, 6]
+    assert queue.recovered == 1
+    assert not queue.spilled_queued
+    queue.close()
+    assert not os.path.exists(queue.filename)
+
+
+def test_recorder_spill(tmp_path):
+    from cpl_media.clock import set_headless, call_in_clock, run_clock_until
+    from cpl_media.synthetic import SyntheticPlayer
+    from cpl_media.recorder import ImageFileRecorder
+
+    set_headless()
+    try:
+        player = SyntheticPlayer(
+            frame_size=[64, 32], pix_fmt='yuv420p', frame_rate=500)
+        recorder = ImageFileRecorder(
+            record_directory=str(tmp_path), extension='bmp',
+            image_queue_spill_threshold=1,
+            image_queue_spill_directory=str(tmp_path))
+
+        call_in_clock(player.play).result(10)
+        assert run_clock_until(lambda: player.play_state == 'playing', 10)
+        call_in_clock(recorder.record, player).result(10)
+        assert run_clock_until(
+            lambda: recorder.record_state == 'recording', 10)
+        run_clock_until(lambda: recorder.frames_spilled, 5)
+        call_in_clock(recorder.stop_all, join=True).result(10)
+        run_clock_until(lambda: recorder.record_state == 'none', 10)
+        call_in_clock(player.stop_all, join=True).result(10)
+    finally:
+        set_headless(False)
+
+    assert recorder.frames_recorded
+    assert not recorder.frames_skipped
+    # frames still queued when stopping are not recorded
+    assert recorder.frames_spilled >= recorder.frames_recovered
+    assert len([f for f in os.listdir(str(tmp_path))
+                if f.endswith('.bmp')]) == recorder.frames_recorded
+    assert not [f for f in os.listdir(str(tmp_path))
+                if f.startswith('cpl_media_spill_')]
+
+
+@pytest.mark.parametrize('kind', ['video', 'image'])
+def test_recorder_timestamps(tmp_path, kind):
+    from cpl_media.clock import set_headless, call_in_clock, run_clock_until
+    from cpl_media.synthetic import SyntheticPlayer
+    from cpl_media.recorder import ImageFileRecorder, VideoRecorder, \
+        load_timestamps
+
+    set_headless()
+    try:
+        player = SyntheticPlayer(
+            frame_size=[64, 32], pix_fmt='yuv420p', frame_rate=200)
+        if kind == 'video':
+            recorder = VideoRecorder(record_directory=str(tmp_path))
+        else:
+            recorder = ImageFileRecorder(
+                record_directory=str(tmp_path), extension='bmp')
+
+        call_in_clock(player.play).result(10)
+        assert run_clock_until(lambda: player.play_state == 'playing', 10)
+        call_in_clock(recorder.record, player).result(10)
+        assert run_clock_until(lambda: recorder.frames_recorded >= 20, 10)
+        call_in_clock(recorder.stop_all, join=True).result(10)
+        run_clock_until(lambda: recorder.record_state == 'none', 10)
+        call_in_clock(player.stop_all, join=True).result(10)
+    finally:
+        set_headless(False)
+
+    if kind == 'video':
+        # rawvideo is not checked
+        assert not recorder.encode_rate_estimate
+        assert recorder.encode_can_keep_up
+
+    filename = recorder.timestamps_filename
+    assert filename == os.path.join(
+        str(tmp_path),
+        'video0_timestamps.npy' if kind == 'video' else 'image_timestamps.npy')
+    timestamps = load_timestamps(filename)
+    assert len(timestamps) == recorder.frames_recorded
+    assert list(timestamps['index']) == list(range(len(timestamps)))
+    counts = timestamps['count']
+    assert (counts[1:] > counts[:-1]).all()
+    assert (timestamps['t'] == counts / 200).all()
+    assert (timestamps['host_t'][1:] > timestamps['host_t'][:-1]).all()
+    assert timestamps['offset'][0] == 0
+    assert (timestamps['offset'][1:] > timestamps['offset'][:-1]).all()
+
+
+@pytest.mark.parametrize('codec', ['ffv1', 'mjpeg', 'libx264'])
+def test_recorder_codec(tmp_path, codec):
+    import tempfile
+    from ffpyplayer.player import MediaPlayer
+    from ffpyplayer.tools import get_supported_pixfmts
+    from cpl_media.clock import set_headless, call_in_clock, run_clock_until
+    from cpl_media.synthetic import SyntheticPlayer
+    from cpl_media.recorder import VideoRecorder
+
+    def encode_files():
+        return {f for f in os.listdir(tempfile.gettempdir())
+                if f.startswith('cpl_media_encode_')}
+    existing = encode_files()
+
+    set_headless()
+    try:
+        player = SyntheticPlayer(
+            frame_size=[64, 32], pix_fmt='rgb24', frame_rate=200)
+        recorder = VideoRecorder(
+            record_directory=str(tmp_path), codec=codec,
+            codec_preset='ultrafast', encoder_threads=2,
+            lib_opts={'g': 10})
+        assert recorder.get_codec_opts() == dict(
+            {'threads': '2', 'g': '10'},
+            **({'preset': 'ultrafast'} if codec == 'libx264' else {}))
+
+        call_in_clock(player.play).result(10)
+        assert run_clock_until(lambda: player.play_state == 'playing', 10)
+        call_in_clock(recorder.record, player).result(10)
+        assert run_clock_until(lambda: recorder.frames_recorded >= 40, 10)
+        assert run_clock_until(lambda: recorder.encode_rate_estimate, 10)
+        call_in_clock(recorder.stop_all, join=True).result(10)
+        run_clock_until(lambda: recorder.record_state == 'none', 10)
+        call_in_clock(player.stop_all, join=True).result(10)
+    finally:
+        set_headless(False)
+
+    fmt = recorder.metadata_record_used.fmt
+    assert fmt in get_supported_pixfmts(codec, fmt)
+    assert recorder.encode_rate_estimate > 0
+    assert recorder.encode_can_keep_up == (
+        recorder.encode_rate_estimate >= 200)
+    assert recorder.encode_time_per_frame > 0
+    assert recorder.compression_ratio > 1
+    recorder.encode_check_thread.join()
+    assert encode_files() <= existing
+
+    filename = os.path.join(str(tmp_path), 'video0.mkv')
+    reader = MediaPlayer(
+        filename, ff_opts={'an': True, 'paused': True})
+    try:
+        ts = time.perf_counter()
+        while reader.get_metadata()['src_vid_size'] == (0, 0) and \
+                time.perf_counter() - ts < 10:
+            time.sleep(.01)
+        metadata = reader.get_metadata()
+        assert metadata['src_vid_size'] == (64, 32)
+        src_fmt = metadata['src_pix_fmt']
+        if isinstance(src_fmt, bytes):
+            src_fmt = src_fmt.decode('utf8')
+        assert src_fmt == fmt
+    finally:
+        reader.close_player()
+
+
+def test_spill_queue_drop_while_recovering(tmp_path):
+    frame_size = 64 * 32 * 3 // 2
+    queue = SpillFrameQueue(
+        spill_threshold=0, spill_size=2 * frame_size,
+        spill_directory=str(tmp_path), maxsize=2, policy='drop_oldest')
+
+    assert queue.put(create_frame(0))
+    assert queue.put(create_frame(1))
+    assert queue.spilled == 2
+    # take the first spilled frame out, as get does before reading it back
+    frame = super(SpillFrameQueue, queue).get(block=False)
+
+    # no space in the file, so it stays in memory
+    assert queue.put(create_frame(2))
+    # drops the second spilled frame while the first is not read yet
+    assert queue.put(create_frame(3))
+    assert queue.dropped == 1
+    assert queue.get(block=False)[1]['count'] == 2
+    # spills into the region of the dropped frame, not of the first frame
+    assert queue.put(create_frame(4))
+    assert queue.spilled == 3
+
+    image, metadata = queue._recover_frame(frame)
+    assert metadata['count'] == 0
+    assert image.to_bytearray()[0][0] == 0
+
+    counts = [queue.get(block=False)[1]['count'] for _ in range(2)]
+    assert counts == [3, 4]
+    assert not queue.spilled_queued
+    assert not queue._regions
+    queue.close()
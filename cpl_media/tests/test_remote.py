@@ -0,0 +1,55 @@
+from ffpyplayer.pic import Image
+
+from cpl_media.player import FrameMetadata
+from cpl_media.remote.server import RemoteData
+
+
+def test_image_header():
+    w, h = 65, 33
+    planes = [bytes(range(65)) * h, bytes(33 * 17), bytes(33 * 17)]
+    image = Image(plane_buffers=planes, pix_fmt='yuv420p', size=(w, h))
+    bin_data = [plane for plane in image.to_bytearray() if plane]
+
+    metadata = FrameMetadata(t=1.25, count=7, seq=3, exposure=.5)
+    data = RemoteData.encode_image_header(image, metadata, bin_data)
+    sizes, pix_fmt, size, linesize, decoded = \
+        RemoteData.decode_image_header(data)
+
+    assert sizes == list(map(len, bin_data))
+    assert pix_fmt == 'yuv420p'
+    assert size == (w, h)
+    assert linesize == tuple(image.get_linesizes())
+    assert isinstance(decoded, FrameMetadata)
+    assert decoded == metadata
+    assert 'host_t' not in decoded
+
+    # plain dicts are also supported
+    data = RemoteData.encode_image_header(image, {'t': 0.}, bin_data)
+    assert RemoteData.decode_image_header(data)[4] == {'t': 0.}
+
+    msg, (planes, *_) = RemoteData().decode_data(
+        data + b''.join(bin_data), (len(data), sum(map(len, bin_data))))
+    assert msg == 'image'
+    assert [bytes(p) for p in planes] == [bytes(p) for p in bin_data]
+
+
+def test_server_listening_port():
+    import socket
+    from cpl_media.clock import set_headless, call_in_clock, run_clock_until
+    from cpl_media.remote.server import RemoteVideoRecorder
+
+    set_headless()
+    try:
+        server = RemoteVideoRecorder(server='localhost', port=0)
+        call_in_clock(server.start_server).result(10)
+        assert run_clock_until(lambda: server.listening_port, 10)
+        assert server.port == 0
+
+        with socket.create_connection(
+                ('localhost', server.listening_port), timeout=10):
+            pass
+
+        call_in_clock(server.stop_server, join=True).result(10)
+        assert run_clock_until(lambda: not server.listening_port, 10)
+    finally:
+        set_headless(False)
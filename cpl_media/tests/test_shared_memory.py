@@ -0,0 +1,82 @@
+import os
+import sys
+import subprocess
+
+from ffpyplayer.pic import Image
+
+from cpl_media.shared_memory import SharedMemoryRing
+
+
+def test_ring_overrun():
+    w, h = 64, 48
+    name = 'cpl_media_test_{}'.format(os.getpid())
+    writer = SharedMemoryRing(
+        name, create=True, n_slots=2, slot_size=w * h * 3 // 2, rate=30)
+    try:
+        reader = SharedMemoryRing(name)
+        assert reader.n_slots == 2
+        assert reader.rate == 30
+        assert not reader.write_seq
+
+        for i in range(3):
+            img = Image(
+                plane_buffers=[bytes([i]) * (w * h), bytes(w * h // 4),
+                               bytes(w * h // 4)],
+                pix_fmt='yuv420p', size=(w, h))
+            assert writer.write(img, {'t': i}) == i + 1
+        assert reader.write_seq == 3
+
+        # overwritten by the third frame
+        assert reader.read(1) is None
+        image, metadata = reader.read(2)
+        assert metadata == {'t': 1}
+        assert image.get_pixel_format() == 'yuv420p'
+        assert image.get_size() == (w, h)
+        assert bytes(image.to_bytearray()[0]) == bytes([1]) * (w * h)
+
+        # too large
+        big = Image(
+            plane_buffers=[bytes(w * h * 3)], pix_fmt='rgb24', size=(w, h))
+        assert not writer.write(big, {})
+        reader.close()
+    finally:
+        writer.close()
+        writer.unlink()
+
+
+reader_script = '''
+import os, sys
+os.environ['CPL_MEDIA_HEADLESS'] = '1'
+from cpl_media.shared_memory import SharedMemoryPlayer
+
+player = SharedMemoryPlayer(ring_name=sys.argv[1])
+frames = list(player.iter_frames(timeout=10, max_frames=20))
+seqs = [m['ring_seq'] for _, m in frames]
+assert seqs == list(range(seqs[0], seqs[0] + 20)), seqs
+assert frames[0][0].get_size() == (64, 48)
+assert player.metadata_play_used.rate == 30
+'''
+
+
+def test_shared_memory_player(long_video_file):
+    from cpl_media.clock import set_headless, call_in_clock, Clock
+    from cpl_media.ffmpeg import FFmpegPlayer
+    from cpl_media.shared_memory import SharedMemoryPublisher
+
+    set_headless()
+    try:
+        player = FFmpegPlayer(play_filename=long_video_file, use_dshow=False)
+        publisher = SharedMemoryPublisher(player, n_slots=32)
+        publisher.start()
+        try:
+            reader = subprocess.Popen(
+                [sys.executable, '-c', reader_script, publisher.name])
+            call_in_clock(player.play).result(5)
+            assert reader.wait(timeout=30) == 0
+            assert publisher.frames_published
+        finally:
+            call_in_clock(player.stop).result(5)
+            Clock.run_until(lambda: player.play_state == 'none', timeout=10)
+            call_in_clock(publisher.stop).result(5)
+    finally:
+        set_headless(False)
@@ -0,0 +1,88 @@
+import sys
+import subprocess
+
+from ffpyplayer.pic import Image
+
+
+def test_stage_transforms():
+    import numpy as np
+    from cpl_media.player import get_image_arrays
+    from cpl_media.stages import CropStage, ScaleStage, DecimateStage, \
+        LUTStage
+
+    w, h = 64, 48
+    data = bytearray(np.arange(w * h * 3 // 2, dtype=np.uint8).tobytes())
+    img = Image(
+        plane_buffers=[data[:w * h], data[w * h:w * h * 5 // 4],
+                       data[w * h * 5 // 4:]],
+        pix_fmt='yuv420p', size=(w, h))
+    y, u, v = get_image_arrays(img)
+
+    crop = CropStage(roi=[11, 10, 20, 0])
+    crop.prepare_stage()
+    cropped, _ = crop.process_stage(img, {})
+    assert cropped.get_size() == (20, 38)
+    cy, cu, cv = get_image_arrays(cropped)
+    assert np.array_equal(cy, y[10:, 10:30])
+    assert np.array_equal(cv, v[5:, 5:15])
+
+    lut = LUTStage(lut=255 - np.arange(256, dtype=np.uint8), lut_planes=[0])
+    lut.prepare_stage()
+    ly, lu, lv = get_image_arrays(lut.process_stage(img, {})[0])
+    assert np.array_equal(ly, 255 - y)
+    assert np.array_equal(lu, u)
+
+    scale = ScaleStage(output_size=[32, 0])
+    scale.prepare_stage()
+    assert scale.process_stage(img, {})[0].get_size() == (32, 24)
+
+    decimate = DecimateStage(factor=3)
+    decimate.prepare_stage()
+    frames = [decimate.process_stage(img, {'count': i}) for i in range(7)]
+    assert [f[1] for f in frames if f is not None] == [
+        {'count': 0, 'source_count': 0}, {'count': 1, 'source_count': 3},
+        {'count': 2, 'source_count': 6}]
+    assert decimate.get_stage_rate(30) == 10
+
+
+stages_script = '''
+import os, sys
+os.environ['CPL_MEDIA_HEADLESS'] = '1'
+from cpl_media.clock import Clock, call_in_clock
+from cpl_media.ffmpeg import FFmpegPlayer
+from cpl_media.stages import ScaleStage, PixelFormatStage, DecimateStage
+
+player = FFmpegPlayer(
+    play_filename=sys.argv[1], use_dshow=False, unthrottled=True)
+small = ScaleStage(source=player, output_size=[32, 0])
+gray = PixelFormatStage(source=small, output_pix_fmt='gray')
+slow = DecimateStage(source=small, factor=2)
+
+frames = {'gray': [], 'slow': []}
+gray_subscriber = gray.subscribe(callback=frames['gray'].append)
+slow_subscriber = slow.subscribe(callback=frames['slow'].append)
+
+stages = [gray, slow, small]
+for stage in stages:
+    assert call_in_clock(stage.play).result(5)
+call_in_clock(player.play).result(5)
+assert Clock.run_until(
+    lambda: all(p.play_state == 'none' for p in stages + [player]),
+    timeout=20)
+gray.unsubscribe(gray_subscriber, join=True)
+slow.unsubscribe(slow_subscriber, join=True)
+
+assert len(frames['gray']) == 90, len(frames['gray'])
+assert len(frames['slow']) == 45, len(frames['slow'])
+assert frames['gray'][0][0].get_size() == (32, 24)
+assert {img.get_pixel_format() for img, _ in frames['gray']} == {'gray'}
+assert gray.metadata_play_used.w == 32
+assert slow.metadata_play_used.rate == player.metadata_play_used.rate / 2
+assert gray.frame_latency['stage']['count'] == 90
+'''
+
+
+def test_stage_graph(long_video_file):
+    subprocess.run(
+        [sys.executable, '-c', stages_script, long_video_file],
+        check=True, timeout=60)
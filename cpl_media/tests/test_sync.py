@@ -0,0 +1,46 @@
+from cpl_media.player import BasePlayer
+from cpl_media.sync import FrameSyncGroup
+
+
+def test_sync_group_matching():
+    players = [BasePlayer(), BasePlayer()]
+    group = FrameSyncGroup(players, tolerance=.01, maxsize=4)
+    subscriber = group.subscribe()
+    source = group.get_source(1)
+    source_subscriber = source.subscribe()
+    assert source.play_state == 'none'
+
+    def add(i, t):
+        group._add_frame(i, ('image{}'.format(i), {'host_t': t, 't': t}))
+
+    add(0, 0)
+    add(1, .005)
+    add(0, .1)
+    # no match for .1
+    add(1, .2)
+    add(0, .205)
+    # older than the last match
+    add(1, .15)
+
+    frames, metadata = subscriber.queue.get(timeout=5)
+    assert frames[0][1]['t'] == 0 and frames[1][1]['t'] == .005
+    assert metadata['host_t'] == 0
+    assert abs(metadata['spread'] - .005) < 1e-9
+    frames, metadata = subscriber.queue.get(timeout=5)
+    assert metadata['t'] == .205
+    assert source_subscriber.queue.get(timeout=5)[1]['t'] == .005
+    assert source_subscriber.queue.get(timeout=5)[1]['t'] == .2
+
+    stats = group.get_stats()
+    assert stats['matched'] == 2
+    assert stats['unmatched'] == [1, 0]
+    assert stats['late'] == [0, 1]
+    assert stats['buffered'] == [0, 0]
+
+    # buffer of the first player overflows
+    for i in range(6):
+        add(0, 1 + i)
+    assert group.get_stats()['unmatched'] == [3, 0]
+
+    source.unsubscribe(source_subscriber, join=True)
+    group.unsubscribe(subscriber, join=True)
@@ -0,0 +1,51 @@
+import pytest
+
+
+@pytest.mark.parametrize('pix_fmt', ['gray', 'yuv420p', 'rgb24'])
+def test_synthetic_counter(pix_fmt):
+    from cpl_media.clock import set_headless
+    from cpl_media.synthetic import SyntheticPlayer, read_frame_counter
+
+    set_headless()
+    try:
+        player = SyntheticPlayer(
+            pix_fmt=pix_fmt, frame_size=[320, 240], frame_rate=0,
+            max_frames=50, pattern='checkerboard')
+        frames = list(player.iter_frames(timeout=10))
+    finally:
+        set_headless(False)
+
+    assert len(frames) == 50
+    assert player.metadata_play_used.fmt == pix_fmt
+    for i, (image, metadata) in enumerate(frames):
+        assert image.get_pixel_format() == pix_fmt
+        assert image.get_size() == (320, 240)
+        assert metadata['count'] == i
+        assert read_frame_counter(image) == i
+
+    snapshot = player.get_thread_timers_snapshot()['play']
+    assert snapshot['name'] == 'SyntheticPlayer play'
+    assert snapshot['iterations'] == 50
+    assert snapshot['stages']['callbacks']['count'] == 50
+
+
+def test_synthetic_rate_and_drops():
+    from cpl_media.clock import set_headless
+    from cpl_media.synthetic import SyntheticPlayer, read_frame_counter
+
+    set_headless()
+    try:
+        # too small for the counter
+        player = SyntheticPlayer(
+            frame_size=[16, 16], frame_rate=1000, max_frames=500,
+            drop_probability=.1, seed=1)
+        frames = list(player.iter_frames(timeout=10))
+    finally:
+        set_headless(False)
+
+    counts = [metadata['count'] for _, metadata in frames]
+    assert counts == sorted(set(counts))
+    assert 350 < len(frames) < 500
+    assert read_frame_counter(frames[0][0]) is None
+    assert player.frames_dropped_source == counts[-1] + 1 - len(frames)
+    assert frames[-1][1]['t'] == pytest.approx(counts[-1] / 1000)
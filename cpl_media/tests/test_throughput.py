@@ -0,0 +1,25 @@
+import pytest
+
+from cpl_media.tests.throughput import measure_pipeline, format_results
+
+
+@pytest.mark.parametrize(
+    'consumer', ['image_tiff_lzw', 'image_bmp', 'video', 'remote'])
+def test_measure_pipeline(consumer):
+    res = measure_pipeline(
+        consumer, size=(64, 48), pix_fmt='yuv420p', rate=30, duration=1,
+        timeout=10)
+
+    assert 20 < res['fps'] < 40
+    assert res['frames'] > 0
+    assert res['frames_skipped'] == \
+        res['source_skipped'] + res['queue_dropped']
+    assert res['cpu_per_frame_s'] > 0
+    assert res['peak_queue_depth'] >= 1
+    assert res['mb_per_s'] > 0
+
+    res.update(
+        {'consumer': consumer, 'size': [64, 48], 'pix_fmt': 'yuv420p',
+         'rate': 30})
+    assert format_results(res).startswith(
+        '{} 64x48 yuv420p @ 30: '.format(consumer))
@@ -0,0 +1,281 @@
+"""Pipeline throughput benchmarks
+=================================
+
+Measures the sustained throughput of the recorders and of the network path,
+when fed frames by a :class:`~cpl_media.synthetic.SyntheticPlayer`, over a
+sweep of frame sizes, pixel formats and frame rates. E.g.::
+
+    python -m cpl_media.tests.throughput --sizes 640x480 1920x1080 \\
+        --pix-fmts gray yuv420p --rates 30 120 --output throughput.json
+
+Each combination is run for a fixed duration in a fresh interpreter in
+headless mode (see :mod:`cpl_media.clock`) and reports:
+
+* ``fps``: The rate at which frames were recorded, or played by the
+  :class:`~cpl_media.remote.client.RemoteVideoPlayer` for ``'remote'``.
+* ``frames_skipped``: The frames skipped by the source because it fell behind
+  (``source_skipped``), plus the frames dropped by the recorder because its
+  queue was full (``queue_dropped``).
+* ``cpu_per_frame_s``: The CPU time of the whole process, including the
+  synthetic source, divided by the number of frames recorded.
+* ``peak_queue_depth``: The largest number of frames waiting in the
+  recorder's queue.
+* ``rss_mib``: The peak resident memory of the process.
+* ``mb_per_s``: The rate at which data was recorded, in MB/s.
+"""
+
+import sys
+import json
+import time
+import argparse
+import tempfile
+
+from cpl_media.tests.benchmark import _run_child, _wait, _call_in_clock, \
+    get_peak_rss_mib
+
+__all__ = (
+    'consumers', 'measure_pipeline', 'run_throughput', 'format_results')
+
+consumers = {
+    'image_tiff_raw': ('tiff', 'raw'),
+    'image_tiff_lzw': ('tiff', 'lzw'),
+    'image_tiff_zip': ('tiff', 'zip'),
+    'image_bmp': ('bmp', 'raw'),
+    'video': None,
+    'remote': None,
+}
+"""The consumers whose throughput is measured. The ``image_*`` consumers are a
+:class:`~cpl_media.recorder.ImageFileRecorder` with the given
+``(extension, compression)``. ``'video'`` is a
+:class:`~cpl_media.recorder.VideoRecorder` and ``'remote'`` is a
+:class:`~cpl_media.remote.server.RemoteVideoRecorder` that sends the frames
+to a :class:`~cpl_media.remote.client.RemoteVideoPlayer` over localhost.
+"""
+
+
+def _create_consumer(name, directory, queue_size):
+    if name == 'video':
+        from cpl_media.recorder import VideoRecorder
+        return VideoRecorder(
+            record_directory=directory, image_queue_size=queue_size,
+            image_queue_policy='drop_oldest')
+
+    if name == 'remote':
+        from cpl_media.remote.server import RemoteVideoRecorder
+        # let the system pick a free port when the server listens
+        return RemoteVideoRecorder(
+            server='localhost', port=0, max_images_buffered=queue_size)
+
+    if name not in consumers:
+        raise ValueError('Unknown consumer "{}"'.format(name))
+
+    from cpl_media.recorder import ImageFileRecorder
+    extension, compression = consumers[name]
+    return ImageFileRecorder(
+        record_directory=directory, extension=extension,
+        compression=compression, image_queue_size=queue_size,
+        image_queue_policy='drop_oldest')
+
+
+def pipeline_child(
+        consumer, size, pix_fmt, rate, duration, queue_size, directory,
+        timeout):
+    """Runs in the child interpreter started by :func:`measure_pipeline` and
+    prints the JSON results.
+    """
+    from time import perf_counter, process_time
+    import cpl_media
+    from ffpyplayer.pic import get_image_size
+    from cpl_media.clock import run_clock_until
+    from cpl_media.synthetic import SyntheticPlayer
+
+    errors = []
+
+    def error_callback(e, exc_info=None, threaded=False):
+        errors.append(exc_info or str(e))
+    cpl_media.error_callback = error_callback
+
+    player = SyntheticPlayer(
+        frame_size=list(size), pix_fmt=pix_fmt, frame_rate=rate)
+    recorder = _create_consumer(consumer, directory, queue_size)
+    client = None
+    try:
+        _call_in_clock(timeout, player.play)
+        _wait(lambda: player.play_state == 'playing' or errors, timeout,
+              'the player')
+        _call_in_clock(timeout, recorder.record, player)
+        _wait(lambda: recorder.record_state == 'recording' or errors,
+              timeout, 'the recorder')
+
+        if consumer == 'remote':
+            from cpl_media.remote.client import RemoteVideoPlayer
+            _wait(lambda: recorder.listening_port or errors, timeout,
+                  'the server to listen')
+            client = RemoteVideoPlayer(
+                server='localhost', port=recorder.listening_port)
+            _call_in_clock(timeout, client.play)
+            _wait(lambda: client.play_state == 'playing' or errors, timeout,
+                  'the client')
+        if errors:
+            raise Exception('\n'.join(errors))
+
+        subscriber = recorder.frame_subscriber
+        skipped = player.frames_dropped_source
+        dropped = recorder.frames_skipped
+        size_recorded = recorder.size_recorded
+        if client is not None:
+            recorded = client.frames_played
+        else:
+            recorded = recorder.frames_recorded
+        ts, cpu = perf_counter(), process_time()
+
+        run_clock_until(lambda: errors, duration)
+
+        elapsed = perf_counter() - ts
+        cpu = process_time() - cpu
+        if client is not None:
+            recorded = client.frames_played - recorded
+        else:
+            recorded = recorder.frames_recorded - recorded
+        skipped = player.frames_dropped_source - skipped
+        dropped = recorder.frames_skipped - dropped
+        size_recorded = recorder.size_recorded - size_recorded
+        if client is not None:
+            # the server doesn't count the bytes it sends
+            size_recorded = sum(get_image_size(pix_fmt, *size)) * recorded
+    finally:
+        if client is not None:
+            # let the server acknowledge the stop before disconnecting
+            _call_in_clock(timeout, client.stop)
+            run_clock_until(lambda: client.play_state == 'none', timeout)
+            _call_in_clock(timeout, client.stop_all, join=True)
+        _call_in_clock(timeout, recorder.stop_all, join=True)
+        _call_in_clock(timeout, player.stop_all, join=True)
+
+    if errors:
+        raise Exception('The pipeline failed:\n{}'.format('\n'.join(errors)))
+
+    print(json.dumps({
+        'fps': recorded / elapsed, 'frames': recorded,
+        'frames_skipped': skipped + dropped, 'source_skipped': skipped,
+        'queue_dropped': dropped,
+        'cpu_per_frame_s': cpu / recorded if recorded else None,
+        'peak_queue_depth': subscriber.high_water,
+        'rss_mib': get_peak_rss_mib(),
+        'mb_per_s': size_recorded / elapsed / 1e6}))
+    sys.stdout.flush()
+
+
+def measure_pipeline(
+        consumer, size=(640, 480), pix_fmt='gray', rate=30, duration=3,
+        queue_size=32, timeout=30):
+    """Measures the throughput of a consumer fed by a
+    :class:`~cpl_media.synthetic.SyntheticPlayer` in a fresh interpreter.
+
+    :param consumer: One of :attr:`consumers`.
+    :param size: The ``(width, height)`` of the frames.
+    :param pix_fmt: The pixel format of the frames.
+    :param rate: The frame rate of the player. It must not be zero, because
+        the recorders need the rate.
+    :param duration: The duration in seconds over which the throughput is
+        measured, once recording.
+    :param queue_size: The maximum number of frames waiting to be recorded,
+        beyond which the oldest frames are dropped.
+    :param timeout: The timeout in seconds of each step.
+    :return: A dict with the results, see the module description.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        script = (
+            'from cpl_media.tests.throughput import pipeline_child; '
+            'pipeline_child({!r}, {!r}, {!r}, {!r}, {!r}, {!r}, {!r}, {!r})'
+            .format(consumer, tuple(size), pix_fmt, rate, duration,
+                    queue_size, directory, timeout))
+        return _run_child(['-c', script], duration + 5 * timeout)
+
+
+def run_throughput(
+        consumer_names=None, sizes=((640, 480), (1920, 1080)),
+        pix_fmts=('gray', 'yuv420p', 'rgb24'), rates=(30, 120), duration=3,
+        queue_size=32, timeout=30, log=None):
+    """Runs :func:`measure_pipeline` for every combination of the consumers,
+    sizes, pixel formats and rates.
+
+    :param consumer_names: The list of :attr:`consumers` to measure, defaults
+        to all.
+    :param log: If not None, a function called with the result of each
+        combination as it completes.
+    :return: A dict with the ``runs`` list of results, each also containing
+        its ``consumer``, ``size``, ``pix_fmt`` and ``rate``.
+    """
+    import platform
+    import cpl_media
+    if consumer_names is None:
+        consumer_names = list(consumers)
+
+    runs = []
+    for name in consumer_names:
+        for size in sizes:
+            for pix_fmt in pix_fmts:
+                for rate in rates:
+                    run = {
+                        'consumer': name, 'size': list(size),
+                        'pix_fmt': pix_fmt, 'rate': rate}
+                    run.update(measure_pipeline(
+                        name, size, pix_fmt, rate, duration, queue_size,
+                        timeout))
+                    runs.append(run)
+                    if log is not None:
+                        log(run)
+
+    return {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': sys.version, 'platform': platform.platform(),
+        'cpl_media': cpl_media.__version__, 'duration': duration,
+        'queue_size': queue_size, 'runs': runs}
+
+
+def format_results(run):
+    """Returns a one line summary of a run returned by
+    :func:`measure_pipeline`.
+    """
+    cpu = run['cpu_per_frame_s']
+    return (
+        '{consumer} {size[0]}x{size[1]} {pix_fmt} @ {rate}: {fps:.1f} fps, '
+        '{frames_skipped} skipped, {cpu} ms CPU/frame, queue '
+        '{peak_queue_depth}, {rss_mib:.0f} MiB, {mb_per_s:.1f} MB/s'.format(
+            cpu='-' if cpu is None else '{:.2f}'.format(cpu * 1e3), **run))
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        description='Benchmarks the throughput of the cpl_media recorders.')
+    parser.add_argument(
+        '--output', default='', help='The JSON file to write the results to')
+    parser.add_argument(
+        '--consumers', nargs='*', default=None, choices=list(consumers))
+    parser.add_argument(
+        '--sizes', nargs='*', default=['640x480', '1920x1080'],
+        help='The frame sizes, e.g. 640x480')
+    parser.add_argument(
+        '--pix-fmts', nargs='*', default=['gray', 'yuv420p', 'rgb24'])
+    parser.add_argument('--rates', nargs='*', type=float, default=[30, 120])
+    parser.add_argument('--duration', type=float, default=3)
+    parser.add_argument('--queue-size', type=int, default=32)
+    parser.add_argument('--timeout', type=float, default=30)
+    args = parser.parse_args(args)
+
+    sizes = [tuple(map(int, size.split('x'))) for size in args.sizes]
+    results = run_throughput(
+        args.consumers, sizes, args.pix_fmts, args.rates, args.duration,
+        args.queue_size, args.timeout,
+        log=lambda run: print(format_results(run), file=sys.stderr))
+
+    if args.output:
+        with open(args.output, 'w') as fh:
+            json.dump(results, fh, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -6,19 +6,18 @@ This player can play Thor cameras using :mod:`thorcam`.
 
 from time import perf_counter as clock
 from queue import Queue, Empty
-from os.path import splitext, join, exists, isdir, abspath, dirname
+from os.path import splitext, exists, isdir, abspath
 
-from kivy.clock import Clock
+from cpl_media.clock import Clock
 from kivy.properties import (
     NumericProperty, ReferenceListProperty,
     ObjectProperty, ListProperty, StringProperty, BooleanProperty,
     DictProperty, AliasProperty, OptionProperty, ConfigParserProperty)
-from kivy.uix.boxlayout import BoxLayout
 from kivy.logger import Logger
-from kivy.lang import Builder
 
-from cpl_media.player import BasePlayer, VideoMetadata
+from cpl_media.player import BasePlayer, VideoMetadata, FrameMetadata
 from cpl_media import error_guard
+from cpl_media.common import lazy_module_getattr
 import cpl_media
 
 try:
@@ -28,7 +27,7 @@ except ImportError as err:
     Logger.debug('cpl_media: Could not import thorcam: {}'.format(err))
 
 
-__all__ = ('ThorCamPlayer', 'ThorCamSettingsWidget')
+__all__ = ('ThorCamPlayer', )
 
 
 class ThorCamPlayer(BasePlayer, ThorCamClient):
@@ -144,9 +143,7 @@ class ThorCamPlayer(BasePlayer, ThorCamClient):
     Can be one of none, opening, open, closing.
     """
 
-    _frame_count = 0
-
-    _ivl_start = 0
+    _ivl_start = None
 
     def __init__(self, open_thread=True, **kwargs):
         super(ThorCamPlayer, self).__init__(**kwargs)
@@ -165,7 +162,7 @@ class ThorCamPlayer(BasePlayer, ThorCamClient):
     @error_guard
     def received_camera_response(self, msg, value):
         if msg == 'image':
-            value = self.create_image_from_msg(value)
+            value = (*self.create_image_from_msg(value), clock())
         self.to_kivy_queue.put((msg, value))
         self._kivy_trigger()
 
@@ -229,7 +226,6 @@ class ThorCamPlayer(BasePlayer, ThorCamClient):
         """
         t = clock()
         if self.play_state == 'starting':
-            self._frame_count = 0
             self.ts_play = self._ivl_start = t
 
             img = value[0]
@@ -240,20 +236,17 @@ class ThorCamPlayer(BasePlayer, ThorCamClient):
         if self.play_state != 'playing':
             return
 
-        if t - self._ivl_start >= 1.:
-            r = self.real_rate = self._frame_count / (t - self._ivl_start)
+        img, count, queued_count, t_img, host_t = value
+        self.num_queued_frames = queued_count
+        self.process_frame(img, FrameMetadata(t_img, count, host_t))
+
+        # guess the rate from the first second of frames, if not known
+        if self._ivl_start is not None and t - self._ivl_start >= 1.:
+            self._ivl_start = None
             if not self.metadata_play_used.rate:
+                r = self.rate_estimator.rate
                 self.metadata_play_used = VideoMetadata(
                     *self.metadata_play_used[:3], int(2 * r))
-            self._frame_count = 0
-            self._ivl_start = t
-
-        self._frame_count += 1
-        self.frames_played += 1
-
-        img, count, queued_count, t_img = value
-        self.num_queued_frames = queued_count
-        self.process_frame(img, {'t': t_img, 'count': count})
 
     @error_guard
     def open_camera(self, serial):
@@ -316,19 +309,7 @@ class ThorCamPlayer(BasePlayer, ThorCamClient):
             self.stop_cam_process(join=join)
 
 
-class ThorCamSettingsWidget(BoxLayout):
-    """Settings widget for :class:`ThorCamPlayer`.
-    """
-
-    player: ThorCamPlayer = None
-    """The player.
-    """
-
-    def __init__(self, player=None, **kwargs):
-        if player is None:
-            player = ThorCamPlayer()
-        self.player = player
-        super(ThorCamSettingsWidget, self).__init__(**kwargs)
-
-
-Builder.load_file(join(dirname(__file__), 'thorcam_player.kv'))
+# the settings widgets are only imported from their own module when they
+# are used, so Kivy widgets and kv files are not loaded when headless
+__getattr__ = lazy_module_getattr(
+    __name__, {'ThorCamSettingsWidget': 'cpl_media.thorcam.widgets'})
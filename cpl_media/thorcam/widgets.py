@@ -0,0 +1,32 @@
+"""Thor player widgets
+=====================
+
+The settings widget for :class:`~cpl_media.thorcam.ThorCamPlayer`.
+"""
+
+from os.path import join, dirname
+
+from kivy.uix.boxlayout import BoxLayout
+from kivy.lang import Builder
+
+from cpl_media.thorcam import ThorCamPlayer
+
+__all__ = ('ThorCamSettingsWidget', )
+
+
+class ThorCamSettingsWidget(BoxLayout):
+    """Settings widget for :class:`~cpl_media.thorcam.ThorCamPlayer`.
+    """
+
+    player: ThorCamPlayer = None
+    """The player.
+    """
+
+    def __init__(self, player=None, **kwargs):
+        if player is None:
+            player = ThorCamPlayer()
+        self.player = player
+        super(ThorCamSettingsWidget, self).__init__(**kwargs)
+
+
+Builder.load_file(join(dirname(__file__), 'thorcam_player.kv'))
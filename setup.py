@@ -36,7 +36,7 @@ setup(
         'base_kivy_app~=0.1.1', 'ffpyplayer', 'kivy', 'tree-config'],
     extras_require={
         'dev': ['pytest>=3.6', 'pytest-cov', 'flake8', 'sphinx-rtd-theme',
-                'coveralls', 'trio', 'pytest-trio'],
+                'coveralls', 'trio', 'pytest-trio', 'numpy'],
     },
     package_data={'cpl_media': ['*.kv', '**/*.kv']},
     project_urls={